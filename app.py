@@ -1,33 +1,21 @@
 import streamlit as st
 
-# Importe os agentes 
-from src.agents.nfe_sequential_agent.agent import root_agent, extractor_agent
-# from src.agents.agente_exemplo.agent import agente_exemplo
+from functools import partial
 
-from src.agents.doc_data_extractor.agent import coordinator
+# Registro dos agentes (src/agents/*/agent.py, ver EXPORTED_AGENTS); cada agente só é importado ao ser selecionado
+from src.agents.agent_registry import get_agent_registry
 
 # Importe as páginas
 from src.ui.pages.chat_page import agent_chat_page
 
+# Páginas - Nome: função sem argumentos que renderiza a página
 PAGES_LIST = {
-    "Chat com Agente": agent_chat_page,
+    "Chat com Agente": partial(agent_chat_page, get_agent_registry()),
     # "Nome da Página": pagina_exemplo
 }
 
-AGENTS_LIST = [
-    root_agent,
-    extractor_agent,
-    coordinator,
-    # agente_exemplo,
-]
-
 with st.sidebar:
     st.title("Navegação")
     selection = st.radio("Ir para", list(PAGES_LIST.keys()))
-    
-page = PAGES_LIST[selection]
 
-if 'agent_list' in page.__code__.co_varnames:
-    page(AGENTS_LIST)
-else:
-    page()
+PAGES_LIST[selection]()
@@ -0,0 +1,69 @@
+import asyncio
+import itertools
+import json
+import random
+
+from typing import Any, AsyncGenerator, Dict, List
+
+from google.adk.models import BaseLlm, LlmRequest, LlmResponse
+from google.genai import types
+from pydantic import PrivateAttr
+
+# Estimativa usada para o uso de tokens reportado pelo modelo local
+CHARS_PER_TOKEN = 4
+TOKENS_PER_INLINE_BLOB = 258
+
+
+def _estimate_prompt_tokens(llm_request: LlmRequest) -> int:
+    # Aproxima os tokens de entrada a partir do texto e dos dados inline da requisição
+    tokens = 0
+    for content in llm_request.contents:
+        for part in content.parts or []:
+            if part.text:
+                tokens += len(part.text) // CHARS_PER_TOKEN
+            if part.inline_data:
+                tokens += TOKENS_PER_INLINE_BLOB
+    return tokens
+
+
+class ReplayLlm(BaseLlm):
+    """
+    Modelo local que reproduz respostas gravadas, com latência artificial configurável.
+    Substitui o Gemini nos benchmarks para medir a sobrecarga de orquestração sem acesso à rede.
+
+    Cada resposta gravada é um dicionário com "text" ou "function_call" ({"name", "args"}).
+    As respostas são usadas em ordem e recomeçam do início quando acabam.
+    """
+
+    responses: List[Dict[str, Any]]
+    latency_s: float = 0.0
+    jitter_s: float = 0.0
+
+    _cycle: Any = PrivateAttr(default=None)
+
+    def model_post_init(self, __context: Any) -> None:
+        super().model_post_init(__context)
+        self._cycle = itertools.cycle(self.responses)
+
+    async def generate_content_async(self, llm_request: LlmRequest, stream: bool = False) -> AsyncGenerator[LlmResponse, None]:
+        if self.latency_s or self.jitter_s:
+            await asyncio.sleep(self.latency_s + random.uniform(0, self.jitter_s))
+
+        recorded = next(self._cycle)
+        if "function_call" in recorded:
+            part = types.Part(function_call=types.FunctionCall(**recorded["function_call"]))
+            response_text = json.dumps(recorded["function_call"])
+        else:
+            part = types.Part(text=recorded["text"])
+            response_text = recorded["text"]
+
+        prompt_tokens = _estimate_prompt_tokens(llm_request)
+        response_tokens = len(response_text) // CHARS_PER_TOKEN
+        yield LlmResponse(
+            content=types.Content(role="model", parts=[part]),
+            usage_metadata=types.GenerateContentResponseUsageMetadata(
+                prompt_token_count=prompt_tokens,
+                candidates_token_count=response_tokens,
+                total_token_count=prompt_tokens + response_tokens
+            )
+        )
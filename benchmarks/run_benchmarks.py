@@ -0,0 +1,200 @@
+import argparse
+import asyncio
+import json
+import logging
+import os
+import statistics
+import sys
+import time
+import tracemalloc
+
+from pathlib import Path
+from typing import Dict, List, Optional
+
+# Os benchmarks medem a orquestração: o cache de extração pularia as chamadas ao modelo
+os.environ.setdefault("EXTRACTION_CACHE_ENABLED", "0")
+
+from google.adk.agents import BaseAgent
+from google.adk.sessions import InMemorySessionService
+
+from src.agents.agent_config import run_agent_query, clone_agent_tree
+from src.agents.execution_service import get_execution_service
+from src.agents.nfe_sequential_agent.agent import root_agent
+from src.agents.doc_data_extractor.agent import coordinator, document_router
+
+from benchmarks.replay_llm import ReplayLlm
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+RECORDINGS_DIR = Path(__file__).parent / "recordings"
+
+# Agentes cobertos pelos benchmarks (nome: agente)
+BENCHMARK_AGENTS = {agent.name: agent for agent in [root_agent, coordinator, document_router]}
+
+
+def load_recordings(recordings_dir: Path = RECORDINGS_DIR) -> List[Dict]:
+    """
+    Carrega as respostas gravadas de cada documento de exemplo.
+
+    Args:
+        recordings_dir: Diretório com os arquivos JSON de gravação
+
+    Returns:
+        List[Dict]: Gravações (documento, agente, mensagem e respostas por agente)
+    """
+    return [json.loads(path.read_text(encoding="utf-8")) for path in sorted(recordings_dir.glob("*.json"))]
+
+
+def build_replay_agent(recording: Dict, latency_s: float, jitter_s: float) -> BaseAgent:
+    """
+    Cria uma cópia da árvore do agente gravado em que cada agente com LLM usa um ReplayLlm.
+
+    Args:
+        recording: Gravação carregada por `load_recordings`
+        latency_s: Latência artificial de cada chamada ao modelo
+        jitter_s: Variação aleatória máxima somada à latência
+
+    Returns:
+        BaseAgent: Árvore de agentes com modelos locais
+    """
+    responses = recording["respostas"]
+
+    def replay_model(agent: BaseAgent) -> ReplayLlm:
+        return ReplayLlm(
+            model=f"replay-{agent.name}",
+            responses=responses.get(agent.name, [{"text": ""}]),
+            latency_s=latency_s,
+            jitter_s=jitter_s
+        )
+
+    return clone_agent_tree(BENCHMARK_AGENTS[recording["agente"]], replay_model)
+
+
+def percentile(values: List[float], pct: float) -> float:
+    """
+    Calcula o percentil (interpolação linear) de uma lista de valores.
+
+    Args:
+        values: Valores medidos
+        pct: Percentil entre 0 e 100
+
+    Returns:
+        float: Valor do percentil
+    """
+    ordered = sorted(values)
+    if len(ordered) == 1:
+        return ordered[0]
+    rank = (len(ordered) - 1) * pct / 100
+    lower = int(rank)
+    upper = min(lower + 1, len(ordered) - 1)
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (rank - lower)
+
+
+async def run_scenario(recording: Dict, documents: int, concurrency: int, latency_s: float, jitter_s: float) -> Dict:
+    """
+    Processa `documents` cópias do documento gravado com até `concurrency` execuções simultâneas.
+
+    Args:
+        recording: Gravação do documento
+        documents: Número de documentos processados
+        concurrency: Número máximo de execuções simultâneas
+        latency_s: Latência artificial de cada chamada ao modelo
+        jitter_s: Variação aleatória máxima somada à latência
+
+    Returns:
+        Dict: Latências (p50/p95/p99), documentos por segundo e pico de memória
+    """
+    agent = build_replay_agent(recording, latency_s, jitter_s)
+    file_bytes = (REPO_ROOT / recording["documento"]).read_bytes()
+    session_service = InMemorySessionService()
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+
+    async def process(index: int):
+        async with semaphore:
+            session = await session_service.create_session(app_name="benchmark", user_id="benchmark", session_id=f"doc-{index}")
+            started = time.perf_counter()
+            await run_agent_query(agent, session_service, session, recording["mensagem"], None, files=[file_bytes])
+            latencies.append(time.perf_counter() - started)
+            await session_service.delete_session(app_name="benchmark", user_id="benchmark", session_id=session.id)
+
+    tracemalloc.reset_peak()
+    started = time.perf_counter()
+    await asyncio.gather(*(process(index) for index in range(documents)))
+    elapsed = time.perf_counter() - started
+    _, peak_memory = tracemalloc.get_traced_memory()
+
+    return {
+        "documento": recording["documento"],
+        "agente": recording["agente"],
+        "concorrencia": concurrency,
+        "documentos": documents,
+        "p50_ms": round(percentile(latencies, 50) * 1000, 2),
+        "p95_ms": round(percentile(latencies, 95) * 1000, 2),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 2),
+        "media_ms": round(statistics.mean(latencies) * 1000, 2),
+        "documentos_por_segundo": round(documents / elapsed, 2),
+        "pico_memoria_mb": round(peak_memory / (1024 * 1024), 2),
+    }
+
+
+async def run_benchmarks(concurrency_levels: List[int], documents: int, latency_s: float, jitter_s: float) -> List[Dict]:
+    """
+    Executa todos os cenários (gravação x nível de concorrência).
+
+    Args:
+        concurrency_levels: Níveis de concorrência avaliados
+        documents: Documentos processados por cenário
+        latency_s: Latência artificial de cada chamada ao modelo
+        jitter_s: Variação aleatória máxima somada à latência
+
+    Returns:
+        List[Dict]: Resultado de cada cenário
+    """
+    results = []
+    for recording in load_recordings():
+        # Aquecimento: primeira execução cria Runners e importa dependências tardias
+        await run_scenario(recording, 1, 1, 0.0, 0.0)
+        for concurrency in concurrency_levels:
+            results.append(await run_scenario(recording, documents, concurrency, latency_s, jitter_s))
+    return results
+
+
+def print_report(results: List[Dict]):
+    columns = ["documento", "agente", "concorrencia", "p50_ms", "p95_ms", "p99_ms", "documentos_por_segundo", "pico_memoria_mb"]
+    widths = {column: max(len(column), *(len(str(result[column])) for result in results)) for column in columns}
+    print("  ".join(column.ljust(widths[column]) for column in columns))
+    for result in results:
+        print("  ".join(str(result[column]).ljust(widths[column]) for column in columns))
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmarks offline dos agentes com respostas gravadas do modelo")
+    parser.add_argument("-c", "--concorrencia", type=int, nargs="+", default=[1, 4, 16], help="Níveis de concorrência")
+    parser.add_argument("-n", "--documentos", type=int, default=32, help="Documentos processados por cenário")
+    parser.add_argument("--latencia", type=float, default=0.0, help="Latência artificial por chamada ao modelo (segundos)")
+    parser.add_argument("--jitter", type=float, default=0.0, help="Variação aleatória máxima somada à latência (segundos)")
+    parser.add_argument("-o", "--saida", help="Grava os resultados em JSON")
+    parser.add_argument("--max-p95-ms", type=float, help="Falha (código 1) se o p95 de algum cenário passar deste limite (para CI)")
+    args = parser.parse_args(argv)
+
+    # Os logs por documento (pré-processamento e métricas de turno) distorceriam as medições
+    logging.getLogger("src").setLevel(logging.WARNING)
+
+    tracemalloc.start()
+    results = get_execution_service().run(run_benchmarks(args.concorrencia, args.documentos, args.latencia, args.jitter))
+    tracemalloc.stop()
+
+    print_report(results)
+    if args.saida:
+        Path(args.saida).write_text(json.dumps(results, ensure_ascii=False, indent=2), encoding="utf-8")
+
+    if args.max_p95_ms is not None:
+        regressions = [result for result in results if result["p95_ms"] > args.max_p95_ms]
+        for result in regressions:
+            print(f"p95 acima do limite: {result['documento']} (concorrência {result['concorrencia']}): {result['p95_ms']}ms", file=sys.stderr)
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,16 +1,28 @@
 import logging
 import dotenv
 import os
-import mimetypes
+import threading
 
-from typing import List
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import TYPE_CHECKING, Any, AsyncGenerator, Callable, Iterator, List, Optional, Union
 
 import asyncio
-from google.adk.agents import Agent
-from google.adk.runners import Runner
-from google.adk.sessions import InMemorySessionService, Session
-from google.genai import types
-from google.adk.apps import App
+
+from src.agents.image_preprocessing import ImageProfile, preprocess_image
+from src.agents.pdf_ingestion import extract_pdf_attachments, split_pdf_pages
+from src.agents.ingestion import ingest_file, check_message_size, sniff_mime_type, SNIFF_BYTES
+from src.agents.instrumentation import TurnMetrics
+
+# O Google ADK só é importado ao montar ou executar um agente (a importação leva vários segundos)
+if TYPE_CHECKING:
+    from google.adk.agents import Agent, BaseAgent
+    from google.adk.agents.run_config import RunConfig
+    from google.adk.events import Event
+    from google.adk.models import BaseLlm
+    from google.adk.runners import Runner
+    from google.adk.sessions import BaseSessionService, Session
+    from google.genai import types
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -27,10 +39,33 @@ DEFAULT_LLM_MODELS_PRETTY_NAME_MAP = {
     "Gemini 2.0 Flash": "gemini-2.0-flash"
 }
 
+# Perfis de pré-processamento de imagens por agente (nome do agente: perfil)
+# Notas Fiscais precisam de mais resolução para os itens; documentos com foto toleram imagens menores
+DEFAULT_IMAGE_PROFILE = ImageProfile(max_long_edge=2048, grayscale=False, output_format="JPEG", quality=85)
+
+IMAGE_PREPROCESSING_PROFILES = {
+    "calculador_de_ICMS_NFe": ImageProfile(max_long_edge=3072, grayscale=True, output_format="WEBP", quality=90),
+    "extrator_de_dados_NFe": ImageProfile(max_long_edge=3072, grayscale=True, output_format="WEBP", quality=90),
+    "extracao_dados_documentos": ImageProfile(max_long_edge=1600, grayscale=False, output_format="JPEG", quality=80),
+    "extracao_rapida_dados_documentos": ImageProfile(max_long_edge=1600, grayscale=False, output_format="JPEG", quality=80),
+}
+
+def get_image_profile(agent: "Agent") -> ImageProfile:
+    """
+    Retorna o perfil de pré-processamento de imagens de um agente.
+
+    Args:
+        agent: Agente que receberá as imagens
+
+    Returns:
+        ImageProfile: Perfil do agente ou DEFAULT_IMAGE_PROFILE
+    """
+    return IMAGE_PREPROCESSING_PROFILES.get(agent.name, DEFAULT_IMAGE_PROFILE)
+
 def detect_file_mime_type(file_bytes: bytes, filename: str = None) -> str:
     """
-    Detecta o tipo MIME de um arquivo baseado no conteúdo ou nome do arquivo.
-    Suporta imagens e PDFs.
+    Detecta o tipo MIME de um arquivo pelos magic numbers (ver `ingestion.sniff_mime_type`)
+    ou, se não reconhecido, pelo nome do arquivo.
 
     Args:
         file_bytes: Bytes do arquivo
@@ -39,49 +74,252 @@ def detect_file_mime_type(file_bytes: bytes, filename: str = None) -> str:
     Returns:
         str: Tipo MIME detectado ou 'application/octet-stream' como fallback
     """
-    if filename:
-        mime_type, _ = mimetypes.guess_type(filename)
-        if mime_type:
-            return mime_type
-
-    # Detecção baseada no conteúdo
-    if len(file_bytes) >= 8:
-        # PDF: %PDF-
-        if file_bytes[0:5] == b'%PDF-':
-            return 'application/pdf'
-        # JPEG: FF D8 FF
-        elif file_bytes[0:3] == b'\xFF\xD8\xFF':
-            return 'image/jpeg'
-        # PNG: 89 50 4E 47
-        elif file_bytes[0:4] == b'\x89\x50\x4E\x47':
-            return 'image/png'
-        # GIF: 47 49 46
-        elif file_bytes[0:3] == b'\x47\x49\x46':
-            return 'image/gif'
-        # WebP: 52 49 46 46 (RIFF) seguido de WEBP
-        elif len(file_bytes) >= 12 and file_bytes[0:4] == b'\x52\x49\x46\x46' and file_bytes[8:12] == b'\x57\x45\x42\x50':
-            return 'image/webp'
-
-    # Fallback
-    return 'application/octet-stream'
-
-# Executa uma chamada ao agente com base na entrada do usuário (Texto, Imagens e PDFs)
-async def run_agent_query(agent: Agent, session_service: InMemorySessionService, session: Session, user_input: str, llm_model_pretty_name: str = "Gemini 2.5 Flash", files: List[bytes] = None):
-
-    # Atualiza o modelo LLM do agente
+    return sniff_mime_type(file_bytes[:SNIFF_BYTES], filename) or 'application/octet-stream'
+
+# Modelo de um agente: nome do modelo, instância de BaseLlm ou função que escolhe o modelo por agente
+AgentModel = Union[str, "BaseLlm", Callable[["BaseAgent"], Union[str, "BaseLlm"]]]
+
+def iter_agent_tree(agent: "BaseAgent") -> Iterator["BaseAgent"]:
+    """
+    Percorre o agente e todos os seus subagentes (em profundidade).
+
+    Args:
+        agent: Agente raiz
+
+    Returns:
+        Iterator[BaseAgent]: Agentes da árvore
+    """
+    yield agent
+    for sub_agent in agent.sub_agents:
+        yield from iter_agent_tree(sub_agent)
+
+def clone_agent_tree(agent: "BaseAgent", model: AgentModel) -> "BaseAgent":
+    """
+    Cria uma cópia independente da árvore de agentes com o modelo aplicado a todos os agentes que usam LLM.
+    Os agentes originais não são alterados.
+
+    Args:
+        agent: Agente raiz
+        model: Modelo a aplicar (ou função que recebe o agente e retorna o modelo)
+
+    Returns:
+        BaseAgent: Cópia da árvore de agentes
+    """
+    clone = agent.clone()
+    for cloned_agent in iter_agent_tree(clone):
+        if "model" in type(cloned_agent).model_fields:
+            cloned_agent.model = model(cloned_agent) if callable(model) else model
+    return clone
+
+# Cache de árvores de agentes por modelo - (agente, modelo): (agente original, cópia)
+_model_agent_cache = {}
+_model_agent_cache_lock = threading.Lock()
+
+def get_agent_for_model(agent: "BaseAgent", model: Union[str, "BaseLlm"]) -> "BaseAgent":
+    """
+    Retorna a cópia da árvore de agentes configurada com o modelo, criando-a na primeira chamada.
+    Permite que execuções simultâneas usem modelos diferentes sem alterar os agentes compartilhados.
+
+    Args:
+        agent: Agente raiz
+        model: Nome do modelo ou instância de BaseLlm
+
+    Returns:
+        BaseAgent: Árvore de agentes configurada com o modelo
+    """
+    key = (id(agent), model if isinstance(model, str) else id(model))
+    with _model_agent_cache_lock:
+        cached = _model_agent_cache.get(key)
+        if cached is not None and cached[0] is agent:
+            return cached[1]
+
+        clone = clone_agent_tree(agent, model)
+        _model_agent_cache[key] = (agent, clone)
+        return clone
+
+def resolve_agent_model(agent: "BaseAgent", llm_model_pretty_name: Optional[str]) -> "BaseAgent":
+    """
+    Retorna a árvore de agentes a executar para o modelo escolhido pelo usuário.
+
+    Args:
+        agent: Agente raiz
+        llm_model_pretty_name: Nome do modelo LLM (ver DEFAULT_MODELS_PRETTY_NAME) ou None para
+            executar o agente com os modelos já configurados nele (ex.: modelos locais de teste)
+
+    Returns:
+        BaseAgent: Árvore de agentes a executar
+    """
+    if llm_model_pretty_name is None:
+        return agent
     llm_model = DEFAULT_LLM_MODELS_PRETTY_NAME_MAP.get(llm_model_pretty_name, "gemini-2.5-flash")
-    if hasattr(agent, 'model'):
-        agent.model = llm_model
+    return get_agent_for_model(agent, llm_model)
+
+# Serviço de sessões padrão (SESSION_STORE_URL); mesmo caminho de session_store.DEFAULT_SESSION_DB_PATH
+DEFAULT_SESSION_STORE_URL = f"sqlite:///{os.path.join('.cache', 'sessions.sqlite3')}"
+
+def create_session_service(url: Optional[str] = None) -> "BaseSessionService":
+    """
+    Cria o serviço de sessões a partir de uma URL.
+
+    - "memory://": sessões em memória (InMemorySessionService)
+    - "sqlite:///caminho.sqlite3": SQLiteSessionService, com arquivos fora do banco, histórico
+      limitado e remoção de sessões inativas (configurado por SESSION_MAX_HISTORY_EVENTS,
+      SESSION_BLOB_HISTORY_TURNS e SESSION_IDLE_TTL_SECONDS)
+    - Outras URLs de banco (ex.: "postgresql://..."): DatabaseSessionService do Google ADK (requer SQLAlchemy)
+
+    Args:
+        url: URL do serviço (padrão: SESSION_STORE_URL ou DEFAULT_SESSION_STORE_URL)
 
-    runner = Runner(
-        agent=agent,
-        app_name=session.app_name,
-        session_service=session_service
+    Returns:
+        BaseSessionService: Serviço de sessões
+    """
+    from google.adk.sessions import InMemorySessionService
+    from src.agents.session_store import (
+        SQLiteSessionService,
+        DEFAULT_MAX_HISTORY_EVENTS,
+        DEFAULT_BLOB_HISTORY_TURNS,
+        DEFAULT_IDLE_TTL_SECONDS
     )
 
-    # logger.info(f"Sending message to agent: {user_input}")
+    url = url or os.getenv("SESSION_STORE_URL", DEFAULT_SESSION_STORE_URL)
 
-    final_response_text = "Nenhuma resposta recebida do agente."
+    if url.startswith("memory://"):
+        return InMemorySessionService()
+
+    if url.startswith("sqlite:///"):
+        return SQLiteSessionService(
+            db_path=url.removeprefix("sqlite:///"),
+            max_history_events=int(os.getenv("SESSION_MAX_HISTORY_EVENTS", DEFAULT_MAX_HISTORY_EVENTS)),
+            blob_history_turns=int(os.getenv("SESSION_BLOB_HISTORY_TURNS", DEFAULT_BLOB_HISTORY_TURNS)),
+            idle_ttl_seconds=float(os.getenv("SESSION_IDLE_TTL_SECONDS", DEFAULT_IDLE_TTL_SECONDS))
+        )
+
+    from google.adk.sessions import DatabaseSessionService
+    return DatabaseSessionService(db_url=url)
+
+_session_service: Optional["BaseSessionService"] = None
+_session_service_lock = threading.Lock()
+
+def get_session_service() -> "BaseSessionService":
+    """
+    Retorna o serviço de sessões do processo (compartilhado por todas as abas do chat), criado na primeira chamada.
+
+    Returns:
+        BaseSessionService: Serviço de sessões
+    """
+    global _session_service
+
+    with _session_service_lock:
+        if _session_service is None:
+            _session_service = create_session_service()
+    return _session_service
+
+# Cache de Runners - (agente, app, serviço de sessões): Runner
+MAX_CACHED_RUNNERS = 128
+_runner_cache = OrderedDict()
+_runner_cache_lock = threading.Lock()
+
+def get_runner(agent: "Agent", app_name: str, session_service: "BaseSessionService") -> "Runner":
+    """
+    Retorna um Runner reutilizável para o agente, criando-o na primeira chamada.
+    Os Runners menos usados recentemente são descartados acima de MAX_CACHED_RUNNERS.
+
+    Args:
+        agent: Agente a ser executado
+        app_name: Nome da aplicação das sessões
+        session_service: Serviço de sessões usado pelo Runner
+
+    Returns:
+        Runner: Runner do agente
+    """
+    key = (id(agent), app_name, id(session_service))
+    with _runner_cache_lock:
+        cached = _runner_cache.get(key)
+        # Confere a identidade para não reaproveitar um id() de objeto já coletado
+        if cached is not None and cached.agent is agent and cached.session_service is session_service:
+            _runner_cache.move_to_end(key)
+            return cached
+
+        from google.adk.runners import Runner
+        # Registra o modelo Gemini com cliente HTTP compartilhado antes da primeira execução
+        from src.agents import gemini_backend
+
+        runner = Runner(
+            agent=agent,
+            app_name=app_name,
+            session_service=session_service
+        )
+        _runner_cache[key] = runner
+        if len(_runner_cache) > MAX_CACHED_RUNNERS:
+            _runner_cache.popitem(last=False)
+        return runner
+
+# Chave do estado da sessão que pede o resumo narrativo do LLM (em vez do relatório montado localmente)
+NARRATIVE_STATE_KEY = "resumo_narrativo"
+
+# Rótulos exibidos quando uma etapa do pipeline grava seu resultado no estado da sessão
+STAGE_LABELS = {
+    "nota_fiscal_data": "Extração dos dados da Nota Fiscal concluída",
+    "icms_result": "Cálculo do ICMS concluído",
+    "document_data": "Extração dos dados do documento concluída",
+}
+
+@dataclass
+class AgentStreamEvent:
+    """
+    Evento emitido por `stream_agent_query`.
+
+    Attributes:
+        kind: "text" para trechos da resposta, "stage" para etapas concluídas do pipeline
+        author: Nome do agente que gerou o evento
+        text: Trecho de texto (kind="text") ou rótulo da etapa (kind="stage")
+        state_key: Chave do estado da sessão gravada pela etapa (kind="stage")
+        data: Valor gravado no estado pela etapa (kind="stage")
+    """
+    kind: str
+    author: str
+    text: str = ""
+    state_key: Optional[str] = None
+    data: Any = None
+
+def build_pdf_parts(pdf_bytes: bytes) -> List["types.Part"]:
+    """
+    Converte um PDF em partes da mensagem: o XML da NF-e anexado ao PDF (se houver)
+    e um PDF de uma página por página do documento. Todas as partes vão na mesma mensagem;
+    a extração em partes do agente de NFe (`chunked_extraction`) envia cada página em uma chamada.
+
+    Args:
+        pdf_bytes: Bytes do PDF
+
+    Returns:
+        List[types.Part]: Partes da mensagem
+    """
+    from google.genai import types
+
+    parts = [
+        types.Part(inline_data=types.Blob(mime_type='text/xml', data=xml_bytes))
+        for _, xml_bytes in extract_pdf_attachments(pdf_bytes)
+    ]
+    parts.extend(
+        types.Part(inline_data=types.Blob(mime_type='application/pdf', data=page_bytes))
+        for page_bytes in split_pdf_pages(pdf_bytes)
+    )
+    return parts
+
+# Monta a mensagem do usuário (Texto, Imagens, PDFs e XML) no formato do Google ADK
+async def build_user_message(agent: "BaseAgent", user_input: str, files: List[bytes] = None) -> "types.Content":
+    """
+    Monta a mensagem do usuário, pré-processando as imagens conforme o perfil do agente.
+
+    Args:
+        agent: Agente que receberá a mensagem
+        user_input: Texto do usuário
+        files: Bytes dos arquivos enviados (imagens, PDFs e XML)
+
+    Returns:
+        types.Content: Mensagem do usuário
+    """
+    from google.genai import types
 
     # Preparar as partes da mensagem
     parts = []
@@ -90,32 +328,70 @@ async def run_agent_query(agent: Agent, session_service: InMemorySessionService,
     if user_input.strip():
         parts.append(types.Part(text=user_input))
 
-    # Adicionar arquivos se existirem (imagens e PDFs)
+    # Adicionar arquivos se existirem (imagens, PDFs e XML)
     if files:
+        image_profile = get_image_profile(agent)
         for file_bytes in files:
-            # Detectar o tipo MIME do arquivo
-            mime_type = detect_file_mime_type(file_bytes)
-
-            # Verificar se é um tipo suportado
-            if mime_type.startswith(('image/', 'application/pdf')):
-                # Converter bytes do arquivo para o formato esperado pelo Google ADK
-                parts.append(types.Part(
-                    inline_data=types.Blob(
-                        mime_type=mime_type,
-                        data=file_bytes
-                    )
-                ))
-            else:
-                # Para outros tipos, converter para texto ou ignorar
-                logger.warning(f"Tipo MIME não suportado: {mime_type}")
-
-    user_message = types.Content(role="user", parts=parts)
-
-    async for event in runner.run_async(
-        session_id=session.id,
-        user_id=session.user_id,
-        new_message=user_message
-    ):
+            # Identifica o tipo pelos magic numbers, aplica os limites do tipo e converte TIFF/BMP/HEIC
+            # (arquivos recusados levantam IngestionError em vez de serem descartados)
+            for ingested in await asyncio.to_thread(ingest_file, file_bytes):
+                file_bytes, mime_type = ingested.data, ingested.mime_type
+
+                # Pré-processar imagens (GIFs animados e PDFs são enviados sem alteração)
+                if mime_type.startswith('image/'):
+                    file_bytes, processed_mime_type = await asyncio.to_thread(preprocess_image, file_bytes, image_profile)
+                    mime_type = processed_mime_type or mime_type
+
+                # PDFs viram um PDF de uma página por página (todos nesta mensagem), junto com o XML da NF-e embutido (se houver)
+                if mime_type == 'application/pdf':
+                    parts.extend(await asyncio.to_thread(build_pdf_parts, file_bytes))
+                    continue
+
+                # Imagens e XML da NF-e (enviado como texto estruturado)
+                parts.append(types.Part(inline_data=types.Blob(mime_type=mime_type, data=file_bytes)))
+
+            # Todos os arquivos vão na mesma requisição: recusa a mensagem antes de passar do limite de dados inline
+            check_message_size(sum(len(part.inline_data.data) for part in parts if part.inline_data))
+
+    return types.Content(role="user", parts=parts)
+
+# Executa o Runner registrando as métricas de cada evento (autor, tempo, tokens e tamanho)
+async def _run_with_metrics(agent: "BaseAgent", runner: "Runner", session: "Session", user_message: "types.Content", llm_model_pretty_name: Optional[str], metrics: Optional[TurnMetrics], run_config: Optional["RunConfig"] = None, state: Optional[dict] = None) -> AsyncGenerator["Event", None]:
+    metrics = metrics if metrics is not None else TurnMetrics()
+    metrics.begin(agent, DEFAULT_LLM_MODELS_PRETTY_NAME_MAP.get(llm_model_pretty_name) if llm_model_pretty_name else None, user_message)
+
+    error = None
+    try:
+        async for event in runner.run_async(
+            session_id=session.id,
+            user_id=session.user_id,
+            new_message=user_message,
+            state_delta=state,
+            run_config=run_config
+        ):
+            metrics.record_event(event)
+            yield event
+    except Exception as e:
+        error = e
+        raise
+    finally:
+        metrics.finish(error)
+
+# Executa uma chamada ao agente com base na entrada do usuário (Texto, Imagens, PDFs e XML)
+async def run_agent_query(agent: "Agent", session_service: "BaseSessionService", session: "Session", user_input: str, llm_model_pretty_name: Optional[str] = "Gemini 2.5 Flash", files: List[bytes] = None, metrics: Optional[TurnMetrics] = None, state: Optional[dict] = None):
+
+    # Seleciona a árvore de agentes com o modelo LLM escolhido (sem alterar os agentes compartilhados)
+    agent = resolve_agent_model(agent, llm_model_pretty_name)
+
+    runner = get_runner(agent, session.app_name, session_service)
+
+    # logger.info(f"Sending message to agent: {user_input}")
+
+    final_response_text = "Nenhuma resposta recebida do agente."
+
+    user_message = await build_user_message(agent, user_input, files)
+
+    async for event in _run_with_metrics(agent, runner, session, user_message, llm_model_pretty_name, metrics, state=state):
         if event.is_final_response():
             if event.content and event.content.parts:
                 final_response_text = event.content.parts[0].text
@@ -124,15 +400,78 @@ async def run_agent_query(agent: Agent, session_service: InMemorySessionService,
 
     return final_response_text
 
+# Executa uma chamada ao agente emitindo a resposta de forma incremental
+async def stream_agent_query(agent: "Agent", session_service: "BaseSessionService", session: "Session", user_input: str, llm_model_pretty_name: Optional[str] = "Gemini 2.5 Flash", files: List[bytes] = None, metrics: Optional[TurnMetrics] = None, state: Optional[dict] = None) -> AsyncGenerator[AgentStreamEvent, None]:
+    """
+    Variante de `run_agent_query` que emite os trechos de texto à medida que o modelo os gera
+    e um evento a cada etapa do pipeline que grava seu resultado no estado da sessão.
+
+    A saída JSON dos agentes com `output_schema` não é emitida como texto; ela chega pelo
+    evento de etapa correspondente (ex.: "nota_fiscal_data").
+
+    Args:
+        agent: Agente a ser executado
+        session_service: Serviço de sessões
+        session: Sessão da conversa
+        user_input: Texto do usuário
+        llm_model_pretty_name: Nome do modelo LLM (ver DEFAULT_MODELS_PRETTY_NAME) ou None para usar os modelos do agente
+        files: Bytes dos arquivos enviados (imagens, PDFs e XML)
+        metrics: Coletor das métricas do turno (opcional; as métricas são sempre registradas no log)
+        state: Valores gravados no estado da sessão antes da execução (ex.: {"resumo_narrativo": True})
+
+    Yields:
+        AgentStreamEvent: Trechos de texto e etapas concluídas
+    """
+    from google.adk.agents.run_config import RunConfig, StreamingMode
+
+    agent = resolve_agent_model(agent, llm_model_pretty_name)
+
+    runner = get_runner(agent, session.app_name, session_service)
+    user_message = await build_user_message(agent, user_input, files)
+
+    streamed_authors = set()
+    last_text_author = None
+
+    async for event in _run_with_metrics(agent, runner, session, user_message, llm_model_pretty_name, metrics, RunConfig(streaming_mode=StreamingMode.SSE), state):
+        # Etapas concluídas (resultado gravado no estado da sessão)
+        if not event.partial and event.actions and event.actions.state_delta:
+            for key, value in event.actions.state_delta.items():
+                if key in STAGE_LABELS:
+                    yield AgentStreamEvent(kind="stage", author=event.author, text=STAGE_LABELS[key], state_key=key, data=value)
+
+        if not event.content or not event.content.parts:
+            continue
+
+        text = "".join(part.text for part in event.content.parts if part.text and not part.thought)
+        author_agent = agent.find_agent(event.author)
+        if not text or getattr(author_agent, "output_schema", None) is not None:
+            continue
+
+        # O evento final de um agente que já emitiu trechos parciais repete o texto completo
+        if event.partial:
+            streamed_authors.add(event.author)
+        elif event.author in streamed_authors:
+            continue
+
+        if last_text_author is not None and last_text_author != event.author:
+            text = "\n\n" + text
+        last_text_author = event.author
+
+        yield AgentStreamEvent(kind="text", author=event.author, text=text)
+
 if __name__ == "__main__":
     from src.agents.nfe_sequential_agent.agent import root_agent
+    from src.agents.execution_service import get_execution_service
 
     if os.path.exists('.env'):
         dotenv.load_dotenv(override=True)
     
+    from google.adk.sessions import InMemorySessionService
+
+    execution_service = get_execution_service()
     session_service = InMemorySessionService()
 
-    session = asyncio.run(
+    session = execution_service.run(
         session_service.create_session(
             session_id="lab_lia",
             app_name="agents",
@@ -142,5 +481,5 @@ if __name__ == "__main__":
 
     user_input = "Olá, quem é você ?"
 
-    response = asyncio.run(run_agent_query(root_agent, session_service, session, user_input))
+    response = execution_service.run(run_agent_query(root_agent, session_service, session, user_input))
     print(response)
\ No newline at end of file
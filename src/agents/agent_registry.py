@@ -0,0 +1,164 @@
+import ast
+import importlib
+import logging
+import threading
+
+from dataclasses import dataclass
+from functools import lru_cache
+from pathlib import Path
+from typing import TYPE_CHECKING, Dict, List, Optional
+
+if TYPE_CHECKING:
+    from google.adk.agents import BaseAgent
+
+logger = logging.getLogger(__name__)
+
+# Diretório varrido em busca de módulos de agentes (src/agents/<pacote>/agent.py)
+AGENTS_DIR = Path(__file__).resolve().parent
+AGENT_MODULE_FILE = "agent.py"
+
+# Variável de cada agent.py com os agentes expostos na interface e na API, ex.:
+# EXPORTED_AGENTS = [{"name": "calculador_de_ICMS_NFe", "attribute": "root_agent", "order": 0}]
+EXPORTED_AGENTS_VARIABLE = "EXPORTED_AGENTS"
+
+# Posição dos agentes que não informam "order" (exibidos depois dos que informam)
+DEFAULT_AGENT_ORDER = 100
+
+
+@dataclass(frozen=True)
+class AgentSpec:
+    """
+    Agente registrado, descrito sem importar o seu módulo.
+
+    Attributes:
+        name: Nome do agente (o mesmo `name` do BaseAgent)
+        module: Módulo que define o agente (ex.: "src.agents.nfe_sequential_agent.agent")
+        attribute: Variável do módulo com o agente (ex.: "root_agent")
+        description: Descrição exibida na interface e na API
+        order: Posição na lista de agentes (menor primeiro)
+    """
+    name: str
+    module: str
+    attribute: str
+    description: str = ""
+    order: int = DEFAULT_AGENT_ORDER
+
+
+def _read_exported_agents(path: Path) -> List[Dict]:
+    # Lê EXPORTED_AGENTS pela árvore sintática do arquivo, sem executar o módulo
+    tree = ast.parse(path.read_text(encoding="utf-8"), filename=str(path))
+    for node in tree.body:
+        if isinstance(node, ast.Assign) and any(isinstance(target, ast.Name) and target.id == EXPORTED_AGENTS_VARIABLE for target in node.targets):
+            return ast.literal_eval(node.value)
+    return []
+
+
+def discover_agents(agents_dir: Path = AGENTS_DIR, package: str = "src.agents") -> List[AgentSpec]:
+    """
+    Procura os agentes declarados em EXPORTED_AGENTS nos arquivos `<pacote>/agent.py` do diretório.
+
+    Os módulos não são importados; a declaração precisa ser um literal (lista de dicionários com
+    "name", "attribute" e, opcionalmente, "description" e "order").
+
+    Args:
+        agents_dir: Diretório com os pacotes de agentes
+        package: Nome do pacote Python correspondente ao diretório
+
+    Returns:
+        List[AgentSpec]: Agentes encontrados, ordenados por "order" e nome
+    """
+    specs = []
+    for path in sorted(agents_dir.glob(f"*/{AGENT_MODULE_FILE}")):
+        module = f"{package}.{path.parent.name}.{path.stem}"
+        try:
+            declared = _read_exported_agents(path)
+        except (SyntaxError, ValueError) as e:
+            logger.warning(f"{EXPORTED_AGENTS_VARIABLE} inválido em {path}: {e}")
+            continue
+        for entry in declared:
+            specs.append(AgentSpec(
+                name=entry["name"],
+                module=module,
+                attribute=entry["attribute"],
+                description=entry.get("description", ""),
+                order=entry.get("order", DEFAULT_AGENT_ORDER)
+            ))
+    return sorted(specs, key=lambda spec: (spec.order, spec.name))
+
+
+class AgentRegistry:
+    """
+    Registro dos agentes por nome. A árvore de um agente (e o módulo que a define, com o Google ADK)
+    só é importada e montada quando o agente é usado pela primeira vez (`load`).
+    """
+
+    def __init__(self, specs: List[AgentSpec]):
+        self._specs = {spec.name: spec for spec in specs}
+        self._agents: Dict[str, "BaseAgent"] = {}
+        self._lock = threading.Lock()
+
+    @property
+    def names(self) -> List[str]:
+        return list(self._specs)
+
+    @property
+    def specs(self) -> List[AgentSpec]:
+        return list(self._specs.values())
+
+    def get_spec(self, name: str) -> Optional[AgentSpec]:
+        return self._specs.get(name)
+
+    def __contains__(self, name: str) -> bool:
+        return name in self._specs
+
+    def register(self, agent: "BaseAgent", order: int = DEFAULT_AGENT_ORDER):
+        """
+        Registra um agente já montado (ex.: agentes criados em scripts e testes).
+
+        Args:
+            agent: Agente
+            order: Posição na lista de agentes (menor primeiro)
+        """
+        with self._lock:
+            self._specs[agent.name] = AgentSpec(
+                name=agent.name,
+                module=type(agent).__module__,
+                attribute="",
+                description=agent.description,
+                order=order
+            )
+            self._agents[agent.name] = agent
+
+    def load(self, name: str) -> "BaseAgent":
+        """
+        Importa o módulo do agente (na primeira chamada) e retorna o agente.
+
+        Args:
+            name: Nome do agente
+
+        Returns:
+            BaseAgent: Agente
+
+        Raises:
+            KeyError: Se o agente não está registrado
+            ValueError: Se o nome do agente importado não é o declarado em EXPORTED_AGENTS
+        """
+        spec = self._specs[name]
+        with self._lock:
+            agent = self._agents.get(name)
+            if agent is None:
+                logger.info(f"Carregando o agente {name} ({spec.module})")
+                agent = getattr(importlib.import_module(spec.module), spec.attribute)
+                if agent.name != name:
+                    raise ValueError(f"{spec.module}.{spec.attribute} tem o nome {agent.name!r}, mas foi registrado como {name!r}")
+                self._agents[name] = agent
+            return agent
+
+
+@lru_cache(maxsize=1)
+def get_agent_registry() -> AgentRegistry:
+    """
+    Returns:
+        AgentRegistry: Registro com os agentes de src/agents (descobertos uma vez por processo)
+    """
+    return AgentRegistry(discover_agents())
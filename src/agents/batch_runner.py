@@ -0,0 +1,367 @@
+import argparse
+import asyncio
+import json
+import logging
+import math
+import os
+import time
+import uuid
+
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Set
+
+import dotenv
+from google.adk.agents import BaseAgent
+from google.adk.sessions import InMemorySessionService
+
+from src.agents.agent_config import run_agent_query, DEFAULT_MODELS_PRETTY_NAME
+from src.agents.agent_registry import get_agent_registry
+from src.agents.execution_service import get_execution_service
+from src.agents.ingestion import read_file_guarded, IngestionError
+from src.agents.rate_limiter import is_retryable_error, retries_exhausted, backoff_delay, set_request_priority, BATCH_PRIORITY
+from src.agents.worker_pool import AgentWorkerPool, WorkerJob
+
+logger = logging.getLogger(__name__)
+
+# Extensões aceitas ao varrer um diretório de Notas Fiscais
+SUPPORTED_EXTENSIONS = {".png", ".jpg", ".jpeg", ".gif", ".webp", ".tif", ".tiff", ".bmp", ".heic", ".heif", ".pdf", ".xml"}
+
+# Mensagem enviada junto com cada documento
+DEFAULT_BATCH_PROMPT = "Processar esta nota fiscal"
+
+# Chaves do estado da sessão copiadas para o resultado de cada documento
+DEFAULT_STATE_KEYS = ["nota_fiscal_data", "icms_result"]
+
+# Novas tentativas de um documento inteiro; os erros temporários do Gemini já são repetidos em cada
+# chamada ao modelo (GEMINI_MAX_RETRIES), então o documento só é repetido pelos demais
+DEFAULT_DOCUMENT_RETRIES = 2
+
+def discover_inputs(source: str) -> List[Path]:
+    """
+    Lista os documentos a processar a partir de um diretório ou de um manifesto.
+
+    O manifesto pode ser um arquivo texto (um caminho por linha) ou JSONL
+    (um objeto por linha com a chave "arquivo"). Caminhos relativos são
+    resolvidos a partir do diretório do manifesto.
+
+    Args:
+        source: Caminho do diretório ou do manifesto
+
+    Returns:
+        List[Path]: Documentos encontrados, em ordem determinística
+    """
+    source_path = Path(source)
+
+    if source_path.is_dir():
+        return sorted(
+            path for path in source_path.rglob("*")
+            if path.is_file() and path.suffix.lower() in SUPPORTED_EXTENSIONS
+        )
+
+    inputs = []
+    with open(source_path, encoding="utf-8") as manifest:
+        for line in manifest:
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            if source_path.suffix.lower() == ".jsonl":
+                line = json.loads(line)["arquivo"]
+            path = Path(line)
+            if not path.is_absolute():
+                path = source_path.parent / path
+            inputs.append(path)
+
+    return inputs
+
+
+def input_key(path: Path) -> str:
+    """
+    Retorna a identificação de um documento no JSONL de resultados (chave "arquivo").
+
+    O caminho é absoluto e normalizado, para que a retomada reconheça o mesmo documento
+    mesmo que o lote seja chamado de outro diretório ou com outra grafia do caminho.
+
+    Args:
+        path: Caminho do documento
+
+    Returns:
+        str: Caminho absoluto normalizado
+    """
+    return str(Path(path).resolve())
+
+
+def load_completed_inputs(output_path: str) -> Set[str]:
+    """
+    Lê o JSONL de saída de uma execução anterior e retorna os documentos já concluídos.
+
+    Linhas incompletas ou corrompidas (por exemplo, escritas durante uma queda do processo) são ignoradas.
+
+    Args:
+        output_path: Caminho do arquivo JSONL de resultados
+
+    Returns:
+        Set[str]: Caminhos normalizados (ver `input_key`) dos documentos processados com sucesso
+    """
+    completed = set()
+    if not os.path.exists(output_path):
+        return completed
+
+    # Lido em bytes para que uma linha com UTF-8 inválido não interrompa a leitura do arquivo
+    with open(output_path, "rb") as output_file:
+        for line in output_file:
+            try:
+                record = json.loads(line)
+            except (json.JSONDecodeError, UnicodeDecodeError):
+                continue
+            if isinstance(record, dict) and record.get("status") == "ok" and isinstance(record.get("arquivo"), str):
+                completed.add(input_key(Path(record["arquivo"])))
+
+    return completed
+
+
+def _ensure_trailing_newline(output_path: str):
+    # Uma linha cortada no fim do arquivo (queda do processo) não pode se juntar ao próximo registro
+    if not os.path.exists(output_path) or os.path.getsize(output_path) == 0:
+        return
+    with open(output_path, "rb+") as output_file:
+        output_file.seek(-1, os.SEEK_END)
+        if output_file.read(1) != b"\n":
+            output_file.write(b"\n")
+
+
+async def _run_in_process(agent: BaseAgent, session_service: InMemorySessionService, prompt: str, llm_model_pretty_name: str, file_bytes: bytes, state_keys: Iterable[str]):
+    # Cada tentativa usa uma sessão nova para não herdar eventos da tentativa anterior
+    session = await session_service.create_session(
+        app_name="agents",
+        user_id="batch",
+        session_id=str(uuid.uuid4())
+    )
+    try:
+        response = await run_agent_query(
+            agent,
+            session_service,
+            session,
+            prompt,
+            llm_model_pretty_name,
+            files=[file_bytes]
+        )
+        session = await session_service.get_session(
+            app_name=session.app_name,
+            user_id=session.user_id,
+            session_id=session.id
+        )
+        return response, {key: session.state.get(key) for key in state_keys}
+    finally:
+        await session_service.delete_session(
+            app_name=session.app_name,
+            user_id=session.user_id,
+            session_id=session.id
+        )
+
+
+async def process_document(
+    path: Path,
+    agent: BaseAgent,
+    session_service: InMemorySessionService,
+    llm_model_pretty_name: str,
+    prompt: str = DEFAULT_BATCH_PROMPT,
+    state_keys: Iterable[str] = DEFAULT_STATE_KEYS,
+    max_retries: int = DEFAULT_DOCUMENT_RETRIES,
+    base_delay: float = 2.0,
+    max_delay: float = 60.0,
+    pool: Optional[AgentWorkerPool] = None,
+) -> Dict:
+    """
+    Executa o agente sobre um único documento, em uma sessão própria, com novas tentativas.
+
+    Args:
+        path: Caminho do documento
+        agent: Agente a ser executado
+        session_service: Serviço de sessões compartilhado pelo lote
+        llm_model_pretty_name: Nome do modelo LLM (ver DEFAULT_MODELS_PRETTY_NAME)
+        prompt: Mensagem enviada junto com o documento
+        state_keys: Chaves do estado da sessão incluídas no resultado
+        max_retries: Número máximo de novas tentativas do documento em erros temporários que a chamada
+            ao modelo não repetiu (os já repetidos por ela, ver GEMINI_MAX_RETRIES, não são tentados de novo)
+        base_delay: Espera base do backoff em segundos
+        max_delay: Espera máxima do backoff em segundos
+        pool: Pool de processos que executa o agente (None para executar neste processo)
+
+    Returns:
+        Dict: Registro do resultado (uma linha do JSONL de saída)
+    """
+    # As chamadas ao modelo do lote cedem a cota ao chat (ver rate_limiter)
+    set_request_priority(BATCH_PRIORITY)
+    started = time.perf_counter()
+    arquivo = input_key(path)
+    try:
+        # Arquivos de tipo não suportado ou acima do limite são recusados sem ler o arquivo inteiro
+        file_bytes = await asyncio.to_thread(read_file_guarded, path)
+    except IngestionError as e:
+        logger.error(f"Arquivo recusado {path}: {e}")
+        return {
+            "arquivo": arquivo,
+            "status": "erro",
+            "erro": str(e),
+            "tentativas": 0,
+            "duracao_segundos": round(time.perf_counter() - started, 3),
+        }
+    attempt = 0
+
+    while True:
+        attempt += 1
+        try:
+            if pool is not None:
+                result = await pool.run(WorkerJob(
+                    agent_name=agent.name,
+                    message=prompt,
+                    model=llm_model_pretty_name,
+                    files=[file_bytes],
+                    state_keys=list(state_keys),
+                    priority=BATCH_PRIORITY
+                ))
+                response, state = result.response, {key: result.state.get(key) for key in state_keys}
+            else:
+                response, state = await _run_in_process(agent, session_service, prompt, llm_model_pretty_name, file_bytes, state_keys)
+            return {
+                "arquivo": arquivo,
+                "status": "ok",
+                "resposta": response,
+                "estado": state,
+                "tentativas": attempt,
+                "duracao_segundos": round(time.perf_counter() - started, 3),
+            }
+        except Exception as e:
+            if attempt > max_retries or not is_retryable_error(e) or retries_exhausted(e):
+                logger.error(f"Falha ao processar {path}: {e}")
+                return {
+                    "arquivo": arquivo,
+                    "status": "erro",
+                    "erro": str(e),
+                    "tentativas": attempt,
+                    "duracao_segundos": round(time.perf_counter() - started, 3),
+                }
+            delay = backoff_delay(attempt, base_delay, max_delay)
+            logger.warning(f"Erro temporário em {path} (tentativa {attempt}): {e}. Nova tentativa em {delay:.1f}s")
+            await asyncio.sleep(delay)
+
+
+async def run_batch(
+    inputs: List[Path],
+    output_path: str,
+    agent: BaseAgent,
+    llm_model_pretty_name: str = "Gemini 2.5 Flash",
+    concurrency: int = 4,
+    prompt: str = DEFAULT_BATCH_PROMPT,
+    max_retries: int = DEFAULT_DOCUMENT_RETRIES,
+    resume: bool = True,
+    processes: int = 1,
+) -> Dict[str, int]:
+    """
+    Processa um lote de documentos com concorrência limitada, gravando um resultado JSONL por documento.
+
+    Cada linha é gravada (e sincronizada em disco) assim que o documento termina, de modo
+    que uma execução interrompida pode ser retomada pulando os documentos já concluídos.
+
+    Args:
+        inputs: Documentos a processar
+        output_path: Caminho do arquivo JSONL de resultados
+        agent: Agente a ser executado em cada documento
+        llm_model_pretty_name: Nome do modelo LLM (ver DEFAULT_MODELS_PRETTY_NAME)
+        concurrency: Número máximo de documentos processados ao mesmo tempo
+        prompt: Mensagem enviada junto com cada documento
+        max_retries: Número máximo de novas tentativas por documento
+        resume: Se True, pula documentos já concluídos no arquivo de saída
+        processes: Número de processos que executam o agente (ver `worker_pool`); com mais de um,
+            os documentos em andamento são divididos entre os processos
+
+    Returns:
+        Dict[str, int]: Contagem de documentos por status ("ok", "erro", "ignorado")
+
+    Raises:
+        ValueError: Se `processes` > 1 e o agente não está no registro de agentes
+    """
+    completed = load_completed_inputs(output_path) if resume else set()
+    pending = [path for path in inputs if input_key(path) not in completed]
+    summary = {"ok": 0, "erro": 0, "ignorado": len(inputs) - len(pending)}
+
+    if summary["ignorado"]:
+        logger.info(f"Retomando lote: {summary['ignorado']} documento(s) já processado(s)")
+
+    pool = None
+    if processes > 1:
+        # Os processos carregam o agente pelo nome, a partir do registro
+        if agent.name not in get_agent_registry():
+            raise ValueError(f"O agente {agent.name} não está no registro de agentes e não pode ser executado em processos separados")
+        pool = AgentWorkerPool(processes, concurrency=math.ceil(concurrency / processes))
+
+    if resume:
+        _ensure_trailing_newline(output_path)
+
+    session_service = InMemorySessionService()
+    semaphore = asyncio.Semaphore(concurrency)
+    write_lock = asyncio.Lock()
+
+    with open(output_path, "a" if resume else "w", encoding="utf-8") as output_file:
+
+        async def worker(path: Path):
+            async with semaphore:
+                record = await process_document(
+                    path,
+                    agent,
+                    session_service,
+                    llm_model_pretty_name,
+                    prompt=prompt,
+                    max_retries=max_retries,
+                    pool=pool
+                )
+            async with write_lock:
+                output_file.write(json.dumps(record, ensure_ascii=False, default=str) + "\n")
+                output_file.flush()
+                os.fsync(output_file.fileno())
+                summary[record["status"]] += 1
+                logger.info(f"[{sum(summary.values())}/{len(inputs)}] {path}: {record['status']}")
+
+        try:
+            await asyncio.gather(*(worker(path) for path in pending))
+        finally:
+            if pool is not None:
+                await asyncio.to_thread(pool.shutdown)
+
+    return summary
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Processamento em lote de Notas Fiscais com o agente calculador de ICMS")
+    parser.add_argument("entrada", help="Diretório com os documentos ou manifesto (.txt ou .jsonl)")
+    parser.add_argument("-o", "--saida", default="resultados.jsonl", help="Arquivo JSONL de resultados")
+    parser.add_argument("-c", "--concorrencia", type=int, default=4, help="Documentos processados ao mesmo tempo")
+    parser.add_argument("-m", "--modelo", default=DEFAULT_MODELS_PRETTY_NAME[0], choices=DEFAULT_MODELS_PRETTY_NAME, help="Modelo LLM")
+    parser.add_argument("--mensagem", default=DEFAULT_BATCH_PROMPT, help="Mensagem enviada junto com cada documento")
+    parser.add_argument("--tentativas", type=int, default=DEFAULT_DOCUMENT_RETRIES, help="Novas tentativas do documento em erros temporários (429/5xx) não repetidos pela chamada ao modelo")
+    parser.add_argument("--sem-retomar", action="store_true", help="Reprocessa tudo, sobrescrevendo o arquivo de saída")
+    parser.add_argument("-p", "--processos", type=int, default=1, help="Processos que executam o agente (cada um com seu event loop e núcleo de CPU)")
+    args = parser.parse_args(argv)
+
+    if os.path.exists('.env'):
+        dotenv.load_dotenv(override=True)
+
+    from src.agents.nfe_sequential_agent.agent import root_agent
+
+    inputs = discover_inputs(args.entrada)
+    summary = get_execution_service().run(run_batch(
+        inputs,
+        args.saida,
+        root_agent,
+        llm_model_pretty_name=args.modelo,
+        concurrency=args.concorrencia,
+        prompt=args.mensagem,
+        max_retries=args.tentativas,
+        resume=not args.sem_retomar,
+        processes=args.processos
+    ))
+    print(json.dumps(summary, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,9 @@
 # from .pydantic_schema import OutputSchema
 from .pydantic_schema import CNHdata, RGdata
+from .classifier import DocumentRouterAgent
 from google.adk.agents import LlmAgent, SequentialAgent
+from src.agents.extraction_cache import load_extraction_from_cache, save_extraction_to_cache
+from src.agents.state_projection import projected_instruction, keep_user_text_only
 import textwrap
 
 # Extração de Dados de Documentos
@@ -24,7 +27,9 @@ user_view_agent = LlmAgent(
     name="user_view_agent",
     model="gemini-2.5-flash",
     description="Descreve os dados encontrados do documento em formato legível ao usuário",
-    instruction=user_view_text_agent_inst
+    # Os dados já extraídos vão na instrução; a imagem do documento não é reenviada
+    instruction=projected_instruction(user_view_text_agent_inst, {"document_data": None}),
+    before_model_callback=keep_user_text_only
 )
 
 """Agente responsável por extrair dados de uma CNH"""
@@ -49,7 +54,9 @@ cnh_agent = LlmAgent(
     output_schema=CNHdata,
     output_key="document_data",
     disallow_transfer_to_parent=True, 
-    disallow_transfer_to_peers=True
+    disallow_transfer_to_peers=True,
+    before_agent_callback=load_extraction_from_cache,
+    after_agent_callback=save_extraction_to_cache
 )
 
 """Agente responsável por extrair dados de um RG"""
@@ -74,7 +81,9 @@ rg_agent = LlmAgent(
     output_schema=RGdata,
     output_key="document_data",
     disallow_transfer_to_parent=True, 
-    disallow_transfer_to_peers=True
+    disallow_transfer_to_peers=True,
+    before_agent_callback=load_extraction_from_cache,
+    after_agent_callback=save_extraction_to_cache
 )
 
 # --- Insira aqui agentes extratores de dados adicionais ---
@@ -103,10 +112,26 @@ coordinator = LlmAgent(
     model="gemini-2.5-flash",
     description="Coordena agentes extratores de dados de documentos",
     instruction=coordinator_instruction,
+    disallow_transfer_to_parent=True,
     sub_agents=[ 
         cnh_agent,
         rg_agent,
         user_view_agent
         # Adicione os agentes aqui
     ]
-)
\ No newline at end of file
+)
+
+"""Agente responsável por encaminhar o documento sem o LLM do coordenador quando possível"""
+# Definição do agente
+document_router = DocumentRouterAgent(
+    name="extracao_rapida_dados_documentos",
+    description="Classifica o documento localmente e chama o agente extrator direto, usando o coordenador apenas com baixa confiança",
+    sub_agents=[coordinator]
+)
+
+"""Agentes expostos na interface e na API"""
+# Lido sem importar este módulo (ver src/agents/agent_registry.py); mantenha como literal
+EXPORTED_AGENTS = [
+    {"name": "extracao_rapida_dados_documentos", "attribute": "document_router", "order": 2,
+     "description": "Classifica o documento (CNH ou RG) e extrai os seus dados"},
+]
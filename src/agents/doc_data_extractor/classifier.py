@@ -0,0 +1,438 @@
+import argparse
+import asyncio
+import io
+import json
+import logging
+import os
+import re
+import unicodedata
+
+from collections import Counter
+from dataclasses import dataclass
+from pathlib import Path
+from typing import AsyncGenerator, Dict, List, Optional, Tuple
+
+from google.adk.agents import BaseAgent
+from google.adk.agents.invocation_context import InvocationContext
+from google.adk.events import Event
+from google.genai import types
+from PIL import Image, ImageOps, UnidentifiedImageError
+from pydantic import ValidationError
+
+from .report import render_document_report
+from src.agents.agent_config import NARRATIVE_STATE_KEY
+from src.agents.extraction_cache import store_extraction
+
+logger = logging.getLogger(__name__)
+
+# Galeria de layouts conhecidos (dHash das imagens de exemplo de cada tipo de documento)
+LAYOUT_GALLERY_PATH = Path(__file__).parent / "layout_gallery.json"
+
+# Palavras-chave (sem acentos, em minúsculas) que identificam o documento na mensagem do usuário.
+# "identidade" sozinha não identifica o RG (ex.: "documento de identidade: CNH"); mensagens que citam
+# os dois tipos (ex.: "carteira de identidade de motorista") ficam com o coordenador
+DOCUMENT_KEYWORDS = {
+    "carteira_nacional_de_habilitacao_cnh": ["cnh", "carteira nacional de habilitacao", "habilitacao", "motorista"],
+    "carteira_de_identidade_rg": ["rg", "carteira de identidade", "registro geral"],
+}
+
+# Tamanho do dHash em bits e distância de Hamming máxima para considerar o mesmo layout
+HASH_BITS = 64
+MAX_LAYOUT_DISTANCE = 12
+
+# Layouts de cada tipo de documento necessários para a galeria decidir sozinha: com menos, um documento
+# de um tipo sem exemplos (ex.: RG) pode ficar perto de um layout de outro tipo sem que a ambiguidade
+# seja percebida, então a confiança fica limitada a UNVERIFIED_LAYOUT_CONFIDENCE (abaixo de `min_confidence`)
+MIN_LAYOUTS_PER_TYPE = 3
+UNVERIFIED_LAYOUT_CONFIDENCE = 0.6
+
+
+@dataclass
+class DocumentClassification:
+    """
+    Resultado da classificação local de um documento.
+
+    Attributes:
+        agent_name: Nome do agente extrator do tipo de documento
+        confidence: Confiança da classificação (0 a 1)
+        reason: Sinal que decidiu a classificação (para logs)
+    """
+    agent_name: str
+    confidence: float
+    reason: str
+
+
+def _normalize_text(text: str) -> str:
+    # Remove acentos e converte para minúsculas
+    decomposed = unicodedata.normalize("NFKD", text)
+    return "".join(char for char in decomposed if not unicodedata.combining(char)).lower()
+
+
+def classify_by_keywords(text: str) -> Optional[DocumentClassification]:
+    """
+    Classifica o documento pelas palavras-chave da mensagem do usuário (ex.: "extraia os dados da CNH").
+
+    Args:
+        text: Mensagem do usuário
+
+    Returns:
+        Optional[DocumentClassification]: Classificação, ou None se nenhum (ou mais de um) tipo for citado
+    """
+    normalized = _normalize_text(text)
+    matches = [
+        agent_name for agent_name, keywords in DOCUMENT_KEYWORDS.items()
+        if any(re.search(rf"\b{re.escape(keyword)}\b", normalized) for keyword in keywords)
+    ]
+    if len(matches) != 1:
+        return None
+    return DocumentClassification(agent_name=matches[0], confidence=0.9, reason="palavra-chave na mensagem")
+
+
+def difference_hash(image_bytes: bytes) -> Optional[int]:
+    """
+    Calcula o dHash (hash perceptual por diferença de 64 bits) de uma imagem.
+    Resistente a redimensionamento, recompressão e pequenas variações de cor.
+
+    Args:
+        image_bytes: Bytes da imagem
+
+    Returns:
+        Optional[int]: Hash da imagem, ou None se não for uma imagem legível
+    """
+    try:
+        with Image.open(io.BytesIO(image_bytes)) as image:
+            image = ImageOps.exif_transpose(image)
+            pixels = image.convert("L").resize((9, 8), Image.Resampling.LANCZOS).tobytes()
+    except (UnidentifiedImageError, OSError):
+        return None
+
+    value = 0
+    for row in range(8):
+        for column in range(8):
+            left, right = pixels[row * 9 + column], pixels[row * 9 + column + 1]
+            value = (value << 1) | (left > right)
+    return value
+
+
+def load_layout_gallery(path: Path = LAYOUT_GALLERY_PATH) -> List[Dict]:
+    """
+    Carrega a galeria de layouts conhecidos.
+
+    Args:
+        path: Caminho do arquivo JSON da galeria
+
+    Returns:
+        List[Dict]: Layouts com as chaves "agente", "hash" (hexadecimal) e "origem"
+    """
+    if not path.exists():
+        return []
+    return json.loads(path.read_text(encoding="utf-8"))
+
+
+def classify_by_layout(image_bytes: bytes, gallery: List[Dict]) -> Optional[DocumentClassification]:
+    """
+    Classifica a imagem pelo layout mais próximo da galeria (distância de Hamming entre dHashes).
+
+    Se a galeria não tem MIN_LAYOUTS_PER_TYPE layouts de todos os tipos de DOCUMENT_KEYWORDS,
+    a confiança é limitada a UNVERIFIED_LAYOUT_CONFIDENCE.
+
+    Args:
+        image_bytes: Bytes da imagem do documento
+        gallery: Layouts conhecidos (ver `load_layout_gallery`)
+
+    Returns:
+        Optional[DocumentClassification]: Classificação, ou None se nenhum layout estiver próximo o suficiente
+    """
+    image_hash = difference_hash(image_bytes)
+    if image_hash is None or not gallery:
+        return None
+
+    best_distance, best_agent = min(
+        (bin(image_hash ^ int(layout["hash"], 16)).count("1"), layout["agente"])
+        for layout in gallery
+    )
+    if best_distance > MAX_LAYOUT_DISTANCE:
+        return None
+
+    # Layouts de outros tipos quase tão próximos quanto o melhor tornam a classificação ambígua
+    if any(
+        layout["agente"] != best_agent and bin(image_hash ^ int(layout["hash"], 16)).count("1") <= best_distance + 2
+        for layout in gallery
+    ):
+        return None
+
+    confidence = 1 - best_distance / HASH_BITS
+    reason = f"layout conhecido (distância {best_distance})"
+    layout_counts = Counter(layout["agente"] for layout in gallery)
+    if any(layout_counts[agent_name] < MIN_LAYOUTS_PER_TYPE for agent_name in DOCUMENT_KEYWORDS):
+        confidence = min(confidence, UNVERIFIED_LAYOUT_CONFIDENCE)
+        reason += f", galeria sem {MIN_LAYOUTS_PER_TYPE} layouts de cada tipo"
+
+    return DocumentClassification(agent_name=best_agent, confidence=confidence, reason=reason)
+
+
+def classify_document(user_content: Optional[types.Content], gallery: Optional[List[Dict]] = None) -> Optional[DocumentClassification]:
+    """
+    Classifica localmente o documento enviado pelo usuário, sem chamar o LLM.
+
+    Só classifica mensagens com imagem; a menção explícita do tipo na mensagem tem prioridade
+    sobre o layout da imagem.
+
+    Args:
+        user_content: Mensagem do usuário (texto e imagens)
+        gallery: Layouts conhecidos (padrão: `load_layout_gallery()`)
+
+    Returns:
+        Optional[DocumentClassification]: Classificação, ou None se não houver sinal suficiente
+    """
+    if user_content is None or not user_content.parts:
+        return None
+
+    text = " ".join(part.text for part in user_content.parts if part.text)
+    images = [
+        part.inline_data.data for part in user_content.parts
+        if part.inline_data and part.inline_data.data and (part.inline_data.mime_type or "").startswith("image/")
+    ]
+    if not images:
+        return None
+
+    classification = classify_by_keywords(text)
+    if classification is not None:
+        return classification
+
+    gallery = load_layout_gallery() if gallery is None else gallery
+    # Todas as imagens precisam apontar para o mesmo tipo (ex.: frente e verso do documento)
+    classifications = [classify_by_layout(image, gallery) for image in images]
+    if any(item is None for item in classifications) or len({item.agent_name for item in classifications}) != 1:
+        return None
+    return min(classifications, key=lambda item: item.confidence)
+
+
+def _extracted_value(agent: BaseAgent, events: List[Event]) -> Optional[object]:
+    # Última saída gravada pelo agente no seu output_key
+    return next((
+        event.actions.state_delta[agent.output_key] for event in reversed(events)
+        if event.actions and event.actions.state_delta and agent.output_key in event.actions.state_delta
+    ), None)
+
+
+def score_extraction(agent: BaseAgent, events: List[Event]) -> Tuple[int, int, int]:
+    """
+    Avalia a saída de um agente extrator executado de forma especulativa.
+
+    Args:
+        agent: Agente extrator (com `output_schema` e `output_key`)
+        events: Eventos gerados pelo agente
+
+    Returns:
+        Tuple[int, int, int]: (saída válida no schema, tipo do documento extraído corresponde ao agente,
+            campos preenchidos); maior é melhor
+    """
+    value = _extracted_value(agent, events)
+    if not isinstance(value, dict):
+        return (0, 0, 0)
+
+    try:
+        agent.output_schema.model_validate(value)
+        valid = 1
+    except ValidationError:
+        valid = 0
+
+    document_type = classify_by_keywords(str(value.get("tipo_do_documento", "")))
+    type_matches = int(document_type is not None and document_type.agent_name == agent.name)
+    filled = sum(1 for name in agent.output_schema.model_fields if value.get(name))
+    return (valid, type_matches, filled)
+
+
+async def _collect_events(agent: BaseAgent, ctx: InvocationContext) -> List[Event]:
+    # Executa o agente em um ramo isolado, guardando os eventos sem repassá-los ao Runner
+    # (nada é gravado na sessão até o vencedor ser escolhido)
+    branch_ctx = ctx.model_copy()
+    branch_ctx.branch = f"{ctx.branch}.{agent.name}" if ctx.branch else agent.name
+    return [event async for event in agent.run_async(branch_ctx)]
+
+
+async def _classify_with_coordinator(coordinator: BaseAgent, ctx: InvocationContext) -> Optional[str]:
+    # Executa o coordenador só até a sua decisão (chamada a transfer_to_agent), sem a transferência
+    branch_ctx = ctx.model_copy()
+    branch_ctx.branch = f"{ctx.branch}.{coordinator.name}" if ctx.branch else coordinator.name
+    events = coordinator.run_async(branch_ctx)
+    try:
+        async for event in events:
+            for function_call in event.get_function_calls():
+                if function_call.name == "transfer_to_agent":
+                    return (function_call.args or {}).get("agent_name")
+    finally:
+        await events.aclose()
+    return None
+
+
+class DocumentRouterAgent(BaseAgent):
+    """
+    Encaminha o documento direto ao agente extrator do seu tipo quando o classificador local
+    tem confiança suficiente, evitando a chamada ao LLM do coordenador apenas para escolher o agente.
+    Com baixa confiança, executa o coordenador (primeiro sub-agente), que decide via LLM.
+
+    No modo especulativo (`speculative` ou SPECULATIVE_EXTRACTION=1), os extratores começam junto
+    com a decisão do coordenador, trocando tokens extras por uma chamada a menos no caminho crítico:
+    vale a escolha do coordenador e, sem ela (ou se o extrator escolhido falhar), a saída que melhor
+    valida no schema do extrator. Se todos os extratores falharem, o coordenador é executado normalmente.
+
+    Ao final, os dados extraídos são apresentados por template (`report.py`), sem LLM; com o
+    resumo narrativo pedido (NARRATIVE_STATE_KEY), o agente `narrator_name` os descreve via LLM.
+    """
+
+    min_confidence: float = 0.8
+    speculative: Optional[bool] = None
+    narrator_name: str = "user_view_agent"
+
+    async def _run_async_impl(self, ctx: InvocationContext) -> AsyncGenerator[Event, None]:
+        async for event in self._run_extraction(ctx):
+            yield event
+        async for event in self._present_result(ctx):
+            yield event
+
+    def _find_extraction(self, ctx: InvocationContext) -> Optional[Tuple[BaseAgent, object]]:
+        # Extrator que gravou o seu output_key nesta invocação (direto, pelo coordenador ou especulativo)
+        for event in reversed(ctx.session.events):
+            if event.invocation_id != ctx.invocation_id:
+                break
+            agent = self.find_agent(event.author)
+            output_key = getattr(agent, "output_key", None)
+            if output_key and getattr(agent, "output_schema", None) is not None and output_key in event.actions.state_delta:
+                return agent, event.actions.state_delta[output_key]
+        return None
+
+    async def _present_result(self, ctx: InvocationContext) -> AsyncGenerator[Event, None]:
+        extraction = self._find_extraction(ctx)
+        if extraction is None:
+            return
+        extractor, document_data = extraction
+
+        if ctx.session.state.get(NARRATIVE_STATE_KEY):
+            narrator = self.find_agent(self.narrator_name)
+            if narrator is not None:
+                async for event in narrator.run_async(ctx):
+                    yield event
+            return
+
+        report = render_document_report(extractor.output_schema, document_data)
+        if report is not None:
+            yield Event(
+                invocation_id=ctx.invocation_id,
+                author=self.name,
+                branch=ctx.branch,
+                content=types.Content(role="model", parts=[types.Part(text=report)])
+            )
+
+    async def _run_extraction(self, ctx: InvocationContext) -> AsyncGenerator[Event, None]:
+        coordinator = self.sub_agents[0]
+
+        classification = await asyncio.to_thread(classify_document, ctx.user_content)
+        if classification is not None and classification.confidence >= self.min_confidence:
+            extractor = coordinator.find_agent(classification.agent_name)
+            if extractor is not None:
+                logger.info(
+                    f"Documento encaminhado para '{extractor.name}' sem o coordenador "
+                    f"({classification.reason}, confiança {classification.confidence:.2f})"
+                )
+                async for event in extractor.run_async(ctx):
+                    yield event
+                return
+
+        speculative = self.speculative if self.speculative is not None else os.getenv("SPECULATIVE_EXTRACTION", "0") == "1"
+        extractors = [agent for agent in map(coordinator.find_agent, DOCUMENT_KEYWORDS) if agent is not None]
+        if speculative and extractors:
+            async for event in self._run_speculative(ctx, coordinator, extractors):
+                yield event
+            return
+
+        async for event in coordinator.run_async(ctx):
+            yield event
+
+    async def _run_speculative(self, ctx: InvocationContext, coordinator: BaseAgent, extractors: List[BaseAgent]) -> AsyncGenerator[Event, None]:
+        classification_task = asyncio.create_task(_classify_with_coordinator(coordinator, ctx))
+        extraction_tasks = {agent.name: asyncio.create_task(_collect_events(agent, ctx)) for agent in extractors}
+        extractors_by_name = {agent.name: agent for agent in extractors}
+        tasks = [classification_task, *extraction_tasks.values()]
+
+        winner = None
+        choice = None
+        try:
+            while winner is None:
+                pending = [task for task in tasks if not task.done()]
+                if pending:
+                    await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+
+                # Decisão do coordenador: vale quando o extrator escolhido termina sem erro
+                # (os outros seguem até lá, para servirem de alternativa)
+                if choice is None and classification_task.done() and not classification_task.cancelled() and classification_task.exception() is None:
+                    choice = classification_task.result()
+                chosen_task = extraction_tasks.get(choice)
+                if chosen_task is not None and chosen_task.done():
+                    if chosen_task.exception() is None:
+                        winner = choice
+                        reason = "escolha do coordenador"
+                        continue
+                    logger.warning(f"Extrator '{choice}' escolhido pelo coordenador falhou: {chosen_task.exception()!r}")
+                    choice = ""
+
+                # Sem decisão válida do coordenador: vence a saída que melhor valida no schema do extrator
+                if all(task.done() for task in extraction_tasks.values()):
+                    scores = {
+                        name: score_extraction(extractors_by_name[name], task.result())
+                        for name, task in extraction_tasks.items() if task.exception() is None
+                    }
+                    if not scores:
+                        break
+                    winner = max(scores, key=scores.get)
+                    reason = f"validação do schema {scores[winner]}"
+
+            if winner is not None:
+                events = await extraction_tasks[winner]
+                logger.info(
+                    f"Extração especulativa: '{winner}' mantido ({reason}); "
+                    f"descartado(s): {', '.join(name for name in extraction_tasks if name != winner)}"
+                )
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+        if winner is None:
+            # Todos os extratores falharam: segue o caminho normal, com o coordenador transferindo ao extrator
+            logger.warning("Extração especulativa sem saída válida; executando o coordenador")
+            async for event in coordinator.run_async(ctx):
+                yield event
+            return
+
+        # O after_agent_callback do extrator executou antes de os eventos chegarem à sessão:
+        # a saída do vencedor é armazenada no cache aqui
+        value = _extracted_value(extractors_by_name[winner], events)
+        if value is not None:
+            await store_extraction(extractors_by_name[winner], ctx.user_content, value)
+
+        for event in events:
+            yield event
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Adiciona imagens de exemplo à galeria de layouts do classificador de documentos")
+    parser.add_argument("agente", choices=list(DOCUMENT_KEYWORDS), help="Agente extrator do tipo de documento")
+    parser.add_argument("imagens", nargs="+", help="Imagens de exemplo do layout")
+    args = parser.parse_args(argv)
+
+    gallery = load_layout_gallery()
+    for image_path in args.imagens:
+        image_hash = difference_hash(Path(image_path).read_bytes())
+        if image_hash is None:
+            print(f"Imagem ilegível, ignorada: {image_path}")
+            continue
+        gallery.append({"agente": args.agente, "hash": f"{image_hash:016x}", "origem": Path(image_path).name})
+
+    LAYOUT_GALLERY_PATH.write_text(json.dumps(gallery, ensure_ascii=False, indent=2) + "\n", encoding="utf-8")
+    print(f"Galeria com {len(gallery)} layout(s): {LAYOUT_GALLERY_PATH}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,44 @@
+import json
+import logging
+
+from pathlib import Path
+from typing import Dict, Optional, Type, Union
+
+from pydantic import BaseModel, ValidationError
+
+from .pydantic_schema import CNHdata, RGdata
+from src.agents.templating import render_template
+
+logger = logging.getLogger(__name__)
+
+# Templates Markdown dos resumos montados sem LLM
+TEMPLATE_DIR = Path(__file__).resolve().parent / "templates"
+
+# Template do resumo por schema de saída do agente extrator
+DOCUMENT_TEMPLATES: Dict[Type[BaseModel], str] = {
+    CNHdata: "cnh.md.j2",
+    RGdata: "rg.md.j2",
+}
+
+
+def render_document_report(output_schema: Optional[Type[BaseModel]], document_data: Union[str, Dict]) -> Optional[str]:
+    """
+    Monta, sem LLM, o resumo em Markdown dos dados extraídos de um documento.
+
+    Args:
+        output_schema: Schema de saída do agente extrator (ex.: CNHdata)
+        document_data: Dados do documento (estado "document_data")
+
+    Returns:
+        Optional[str]: Resumo, ou None se não houver template para o schema ou os dados não couberem nele
+    """
+    template = DOCUMENT_TEMPLATES.get(output_schema)
+    if template is None:
+        return None
+
+    try:
+        documento = output_schema.model_validate(json.loads(document_data) if isinstance(document_data, str) else document_data)
+    except (ValueError, ValidationError) as e:
+        logger.warning(f"Dados do documento fora do schema {output_schema.__name__}: {e}")
+        return None
+    return render_template(TEMPLATE_DIR, template, documento=documento)
@@ -0,0 +1,254 @@
+import asyncio
+import json
+import logging
+import os
+import time
+import uuid
+import weakref
+
+from dataclasses import dataclass, field
+from typing import Any, AsyncGenerator, Dict, List, Optional, Tuple
+
+from google.adk.agents import BaseAgent
+from google.adk.events import Event, EventActions
+from google.adk.sessions import BaseSessionService, Session
+from google.genai import types
+
+from src.agents.agent_config import stream_agent_query
+from src.agents.instrumentation import TurnMetrics
+
+logger = logging.getLogger(__name__)
+
+# Documentos de um mesmo usuário processados ao mesmo tempo (somando todos os turnos em andamento)
+DEFAULT_MAX_DOCUMENTS_PER_USER = 4
+
+# Semáforos por (event loop, usuário); cada um existe enquanto algum turno do usuário o estiver usando
+_user_semaphores: "weakref.WeakValueDictionary[Tuple[int, str], asyncio.Semaphore]" = weakref.WeakValueDictionary()
+
+
+def get_user_semaphore(user_id: str, max_concurrency: Optional[int] = None) -> asyncio.Semaphore:
+    """
+    Retorna o semáforo que limita os documentos processados ao mesmo tempo por um usuário.
+
+    Deve ser chamado dentro do event loop onde os documentos serão executados.
+
+    Args:
+        user_id: Identificador do usuário (ex.: o operador de uma aba do chat)
+        max_concurrency: Limite do usuário (padrão: variável MAX_DOCUMENTS_PER_USER ou DEFAULT_MAX_DOCUMENTS_PER_USER)
+
+    Returns:
+        asyncio.Semaphore: Semáforo compartilhado pelos turnos do usuário
+    """
+    key = (id(asyncio.get_running_loop()), user_id)
+    semaphore = _user_semaphores.get(key)
+    if semaphore is None:
+        if max_concurrency is None:
+            max_concurrency = int(os.getenv("MAX_DOCUMENTS_PER_USER", DEFAULT_MAX_DOCUMENTS_PER_USER))
+        semaphore = _user_semaphores[key] = asyncio.Semaphore(max(max_concurrency, 1))
+    return semaphore
+
+
+@dataclass
+class DocumentProgressEvent:
+    """
+    Evento emitido por `stream_documents_query`.
+
+    Attributes:
+        kind: "waiting" (na fila do usuário), "started", "stage" (etapa concluída), "done", "error"
+            ou "summary" (resposta agregada de todos os documentos, sempre o último evento)
+        index: Posição do documento na lista enviada (None para kind="summary")
+        name: Nome do arquivo do documento
+        text: Rótulo da etapa, resposta do documento, mensagem de erro ou resposta agregada
+        state_key: Chave do estado da sessão gravada pela etapa (kind="stage")
+        data: Valor gravado no estado pela etapa (kind="stage")
+    """
+    kind: str
+    index: Optional[int] = None
+    name: str = ""
+    text: str = ""
+    state_key: Optional[str] = None
+    data: Any = None
+
+
+@dataclass
+class DocumentResult:
+    """
+    Resultado da execução do pipeline sobre um documento.
+
+    Attributes:
+        name: Nome do arquivo do documento
+        response: Resposta final do agente
+        state: Resultados das etapas gravados no estado da sessão do documento
+        error: Mensagem de erro, se a execução falhou
+    """
+    name: str
+    response: str = ""
+    state: Dict[str, Any] = field(default_factory=dict)
+    error: Optional[str] = None
+
+
+def aggregate_document_results(results: List[DocumentResult]) -> str:
+    """
+    Junta as respostas de cada documento em uma única resposta em Markdown.
+
+    Args:
+        results: Resultados na ordem dos documentos enviados
+
+    Returns:
+        str: Resposta agregada
+    """
+    errors = sum(1 for result in results if result.error is not None)
+    header = f"**{len(results)} documento(s) processado(s)**"
+    if errors:
+        header += f" ({errors} com erro)"
+
+    sections = [header]
+    for position, result in enumerate(results, start=1):
+        if result.error is not None:
+            body = f"❌ Erro ao processar o documento: {result.error}"
+        elif result.response:
+            body = result.response
+        elif result.state:
+            # Agentes com `output_schema` só gravam o resultado no estado (ex.: "document_data")
+            body = "\n\n".join(
+                f"```json\n{json.dumps(value, ensure_ascii=False, indent=2, default=str)}\n```" for value in result.state.values()
+            )
+        else:
+            body = "Nenhuma resposta recebida do agente."
+        sections.append(f"### 📄 {position}. {result.name}\n\n{body}")
+    return "\n\n---\n\n".join(sections)
+
+
+async def _record_turn(session_service: BaseSessionService, session: Session, agent: BaseAgent, user_input: str, results: List[DocumentResult], response: str):
+    # Registra o turno na sessão da conversa (mensagem e resposta agregada) para que as perguntas
+    # seguintes tenham o resultado no histórico; os documentos não são copiados para a sessão
+    session = await session_service.get_session(app_name=session.app_name, user_id=session.user_id, session_id=session.id)
+    if session is None:
+        return
+
+    invocation_id = f"e-{uuid.uuid4()}"
+    file_list = ", ".join(result.name for result in results)
+    await session_service.append_event(session, Event(
+        invocation_id=invocation_id,
+        author="user",
+        content=types.Content(role="user", parts=[types.Part(text=f"{user_input}\n\n[Documentos enviados: {file_list}]".strip())])
+    ))
+    await session_service.append_event(session, Event(
+        invocation_id=invocation_id,
+        author=agent.name,
+        content=types.Content(role="model", parts=[types.Part(text=response)]),
+        actions=EventActions(state_delta={"documentos_processados": [
+            {"arquivo": result.name, "estado": result.state, "erro": result.error} for result in results
+        ]})
+    ))
+
+
+async def stream_documents_query(
+    agent: BaseAgent,
+    session_service: BaseSessionService,
+    session: Session,
+    user_input: str,
+    documents: List[Tuple[str, bytes]],
+    llm_model_pretty_name: Optional[str] = "Gemini 2.5 Flash",
+    state: Optional[dict] = None,
+    max_concurrency: Optional[int] = None,
+    concurrency_key: Optional[str] = None,
+    metrics: Optional[TurnMetrics] = None,
+) -> AsyncGenerator[DocumentProgressEvent, None]:
+    """
+    Executa o pipeline do agente sobre cada documento em paralelo, cada um em uma sessão própria,
+    emitindo o progresso de cada documento e, ao final, a resposta agregada.
+
+    O número de documentos executados ao mesmo tempo é limitado por usuário (`get_user_semaphore`),
+    valendo para todos os turnos em andamento do mesmo usuário (`concurrency_key`).
+
+    Args:
+        agent: Agente a ser executado em cada documento
+        session_service: Serviço de sessões
+        session: Sessão da conversa (recebe a mensagem e a resposta agregada)
+        user_input: Texto do usuário, enviado junto com cada documento
+        documents: Nome e bytes de cada documento
+        llm_model_pretty_name: Nome do modelo LLM (ver DEFAULT_MODELS_PRETTY_NAME) ou None para usar os modelos do agente
+        state: Valores gravados no estado da sessão de cada documento (ex.: {"resumo_narrativo": True})
+        max_concurrency: Limite de documentos simultâneos do usuário (ver `get_user_semaphore`)
+        concurrency_key: Identificador do usuário no limite (padrão: `session.user_id`)
+        metrics: Coletor das métricas do turno, com as etapas de todos os documentos somadas
+            (as métricas de cada documento são sempre registradas no log)
+
+    Yields:
+        DocumentProgressEvent: Progresso de cada documento e a resposta agregada
+    """
+    semaphore = get_user_semaphore(concurrency_key or session.user_id, max_concurrency)
+    started_at = time.perf_counter()
+    events: asyncio.Queue = asyncio.Queue()
+    results = [DocumentResult(name=name) for name, _ in documents]
+
+    async def run_document(index: int, name: str, file_bytes: bytes):
+        result = results[index]
+        if semaphore.locked():
+            events.put_nowait(DocumentProgressEvent(kind="waiting", index=index, name=name, text="Aguardando"))
+
+        async with semaphore:
+            events.put_nowait(DocumentProgressEvent(kind="started", index=index, name=name, text="Processando"))
+            document_session = None
+            document_metrics = TurnMetrics()
+            try:
+                document_session = await session_service.create_session(
+                    app_name=session.app_name,
+                    user_id=session.user_id,
+                    session_id=f"{session.id}-doc-{uuid.uuid4().hex[:12]}"
+                )
+                texts = []
+                async for event in stream_agent_query(
+                    agent,
+                    session_service,
+                    document_session,
+                    user_input,
+                    llm_model_pretty_name,
+                    files=[file_bytes],
+                    metrics=document_metrics,
+                    state=state
+                ):
+                    if event.kind == "stage":
+                        result.state[event.state_key] = event.data
+                        events.put_nowait(DocumentProgressEvent(
+                            kind="stage", index=index, name=name, text=event.text, state_key=event.state_key, data=event.data
+                        ))
+                    else:
+                        texts.append(event.text)
+                result.response = "".join(texts).strip()
+                events.put_nowait(DocumentProgressEvent(kind="done", index=index, name=name, text=result.response))
+            except Exception as e:
+                logger.error(f"Falha ao processar o documento {name}: {e}")
+                result.error = str(e)
+                events.put_nowait(DocumentProgressEvent(kind="error", index=index, name=name, text=result.error))
+            finally:
+                if metrics is not None and document_metrics.total_time_s is not None:
+                    metrics.merge(document_metrics)
+                if document_session is not None:
+                    await session_service.delete_session(
+                        app_name=document_session.app_name,
+                        user_id=document_session.user_id,
+                        session_id=document_session.id
+                    )
+
+    tasks = [asyncio.create_task(run_document(index, name, file_bytes)) for index, (name, file_bytes) in enumerate(documents)]
+    try:
+        pending = len(tasks)
+        while pending:
+            event = await events.get()
+            if event.kind in ("done", "error"):
+                pending -= 1
+            yield event
+    finally:
+        # Consumidor interrompido (ex.: página fechada): cancela os documentos ainda em execução
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    if metrics is not None:
+        metrics.total_time_s = time.perf_counter() - started_at
+
+    response = aggregate_document_results(results)
+    await _record_turn(session_service, session, agent, user_input, results, response)
+    yield DocumentProgressEvent(kind="summary", text=response)
@@ -0,0 +1,120 @@
+import asyncio
+import concurrent.futures
+import logging
+import queue
+import threading
+
+from typing import Any, AsyncIterator, Coroutine, Iterator, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class AgentExecutionService:
+    """
+    Serviço de execução de longa duração: mantém um único event loop em uma thread de fundo,
+    onde todas as execuções de agentes do processo são agendadas.
+
+    Manter o mesmo loop entre turnos permite reutilizar Runners, o cliente Gemini compartilhado
+    e suas conexões HTTP, em vez de criar e destruir um loop a cada `asyncio.run`.
+    """
+
+    def __init__(self, name: str = "agent-execution-loop"):
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._run_loop, name=name, daemon=True)
+        self._thread.start()
+
+    def _run_loop(self):
+        asyncio.set_event_loop(self._loop)
+        self._loop.run_forever()
+
+    @property
+    def loop(self) -> asyncio.AbstractEventLoop:
+        return self._loop
+
+    def submit(self, coro: Coroutine) -> concurrent.futures.Future:
+        """
+        Agenda uma corrotina no loop do serviço sem bloquear a thread atual.
+
+        Args:
+            coro: Corrotina a ser executada
+
+        Returns:
+            concurrent.futures.Future: Futuro com o resultado da corrotina
+        """
+        return asyncio.run_coroutine_threadsafe(coro, self._loop)
+
+    def run(self, coro: Coroutine, timeout: Optional[float] = None) -> Any:
+        """
+        Executa uma corrotina no loop do serviço e aguarda o resultado.
+
+        Args:
+            coro: Corrotina a ser executada
+            timeout: Tempo máximo de espera em segundos (None para aguardar indefinidamente)
+
+        Returns:
+            Any: Resultado da corrotina
+        """
+        if threading.current_thread() is self._thread:
+            raise RuntimeError("AgentExecutionService.run não pode ser chamado de dentro do loop do serviço")
+        return self.submit(coro).result(timeout)
+
+    def iterate(self, async_iterator: AsyncIterator) -> Iterator:
+        """
+        Consome um gerador assíncrono no loop do serviço, entregando seus itens de forma síncrona
+        à thread atual à medida que são produzidos (ex.: para `st.write_stream`).
+
+        Se o consumidor parar antes do fim (ou a thread for interrompida), o gerador é cancelado.
+
+        Args:
+            async_iterator: Gerador assíncrono a ser consumido
+
+        Yields:
+            Any: Itens produzidos pelo gerador
+        """
+        items = queue.Queue()
+        done = object()
+
+        async def pump():
+            try:
+                async for item in async_iterator:
+                    items.put((False, item))
+            except Exception as e:
+                items.put((True, e))
+            finally:
+                items.put((False, done))
+
+        future = self.submit(pump())
+        try:
+            while True:
+                is_error, item = items.get()
+                if is_error:
+                    raise item
+                if item is done:
+                    break
+                yield item
+        finally:
+            future.cancel()
+
+    def shutdown(self):
+        """Encerra o loop do serviço."""
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+
+
+_execution_service: Optional[AgentExecutionService] = None
+_execution_service_lock = threading.Lock()
+
+
+def get_execution_service() -> AgentExecutionService:
+    """
+    Retorna o serviço de execução do processo, criado na primeira chamada.
+
+    Returns:
+        AgentExecutionService: Serviço compartilhado
+    """
+    global _execution_service
+
+    with _execution_service_lock:
+        if _execution_service is None:
+            _execution_service = AgentExecutionService()
+    return _execution_service
@@ -0,0 +1,336 @@
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+from typing import TYPE_CHECKING, Any, Dict, List, Optional
+
+from google.adk.agents.callback_context import CallbackContext
+from google.genai import types
+
+if TYPE_CHECKING:
+    from google.adk.agents import LlmAgent
+
+logger = logging.getLogger(__name__)
+
+# Configuração padrão do cache (pode ser sobrescrita por variáveis de ambiente)
+DEFAULT_CACHE_PATH = os.path.join(".cache", "extraction_cache.sqlite3")
+DEFAULT_CACHE_MAX_ENTRIES = 5000
+DEFAULT_CACHE_TTL_SECONDS = 30 * 24 * 60 * 60
+
+# Chave do estado que faz os extratores ignorarem o cache (ex.: nova tentativa após falha na validação)
+BYPASS_CACHE_STATE_KEY = "ignorar_cache_extracao"
+
+
+def make_cache_key(documents: List[bytes], agent_name: str, model_id: str, instruction: str) -> str:
+    """
+    Gera a chave do cache a partir do conteúdo dos documentos, do agente, do modelo e da instrução.
+
+    Args:
+        documents: Bytes de cada documento enviado, na ordem de envio
+        agent_name: Nome do agente extrator
+        model_id: Identificador do modelo LLM (ex.: "gemini-2.5-flash")
+        instruction: Instrução do agente (e demais dados que alteram a saída, como o schema)
+
+    Returns:
+        str: Hash SHA-256 hexadecimal
+    """
+    digest = hashlib.sha256()
+    for document in documents:
+        digest.update(hashlib.sha256(document).digest())
+    digest.update(b"\x00" + agent_name.encode())
+    digest.update(b"\x00" + model_id.encode())
+    digest.update(b"\x00" + hashlib.sha256(instruction.encode()).digest())
+    return digest.hexdigest()
+
+
+class ExtractionCache:
+    """
+    Cache persistente (SQLite) da saída estruturada dos agentes extratores.
+
+    As entradas expiram após `ttl_seconds` e, acima de `max_entries`, as menos acessadas
+    recentemente são removidas.
+    """
+
+    def __init__(self, db_path: str = DEFAULT_CACHE_PATH, max_entries: int = DEFAULT_CACHE_MAX_ENTRIES, ttl_seconds: float = DEFAULT_CACHE_TTL_SECONDS):
+        if os.path.dirname(db_path):
+            os.makedirs(os.path.dirname(db_path), exist_ok=True)
+
+        self.db_path = db_path
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.hits = 0
+        self.misses = 0
+
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(db_path, check_same_thread=False)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("""
+            CREATE TABLE IF NOT EXISTS extraction_cache (
+                key TEXT PRIMARY KEY,
+                agent_name TEXT NOT NULL,
+                model_id TEXT NOT NULL,
+                value TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                last_access REAL NOT NULL
+            )""")
+        self._connection.execute("CREATE INDEX IF NOT EXISTS idx_extraction_cache_last_access ON extraction_cache (last_access)")
+        self._connection.commit()
+
+    def get(self, key: str) -> Optional[Any]:
+        """
+        Busca uma entrada válida no cache, atualizando seu último acesso.
+
+        Args:
+            key: Chave gerada por `make_cache_key`
+
+        Returns:
+            Optional[Any]: Valor armazenado ou None se ausente/expirado
+        """
+        now = time.time()
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT value FROM extraction_cache WHERE key = ? AND created_at >= ?",
+                (key, now - self.ttl_seconds)
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self._connection.execute("UPDATE extraction_cache SET last_access = ? WHERE key = ?", (now, key))
+            self._connection.commit()
+            self.hits += 1
+        return json.loads(row[0])
+
+    def put(self, key: str, agent_name: str, model_id: str, value: Any):
+        """
+        Armazena a saída de um agente extrator e aplica a política de remoção.
+
+        Args:
+            key: Chave gerada por `make_cache_key`
+            agent_name: Nome do agente extrator
+            model_id: Identificador do modelo LLM
+            value: Saída estruturada (serializável em JSON)
+        """
+        now = time.time()
+        with self._lock:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO extraction_cache (key, agent_name, model_id, value, created_at, last_access) VALUES (?, ?, ?, ?, ?, ?)",
+                (key, agent_name, model_id, json.dumps(value, ensure_ascii=False), now, now)
+            )
+            self._evict(now)
+            self._connection.commit()
+
+    def delete(self, key: str):
+        """
+        Remove uma entrada do cache (ex.: saída rejeitada na validação).
+
+        Args:
+            key: Chave gerada por `make_cache_key`
+        """
+        with self._lock:
+            self._connection.execute("DELETE FROM extraction_cache WHERE key = ?", (key,))
+            self._connection.commit()
+
+    def _evict(self, now: float):
+        # Remove entradas expiradas e, se necessário, as menos acessadas recentemente
+        self._connection.execute("DELETE FROM extraction_cache WHERE created_at < ?", (now - self.ttl_seconds,))
+        self._connection.execute(
+            """DELETE FROM extraction_cache WHERE key IN (
+                SELECT key FROM extraction_cache ORDER BY last_access DESC LIMIT -1 OFFSET ?
+            )""",
+            (self.max_entries,)
+        )
+
+    def clear(self):
+        """Remove todas as entradas e zera os contadores."""
+        with self._lock:
+            self._connection.execute("DELETE FROM extraction_cache")
+            self._connection.commit()
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self) -> Dict[str, float]:
+        """
+        Retorna os contadores do cache.
+
+        Returns:
+            Dict[str, float]: Acertos, falhas, taxa de acerto e número de entradas
+        """
+        with self._lock:
+            entries = self._connection.execute("SELECT COUNT(*) FROM extraction_cache").fetchone()[0]
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "entries": entries,
+        }
+
+
+_extraction_cache: Optional[ExtractionCache] = None
+_extraction_cache_lock = threading.Lock()
+
+
+def get_extraction_cache() -> Optional[ExtractionCache]:
+    """
+    Retorna o cache de extração do processo, criado na primeira chamada.
+
+    Configuração via ambiente: EXTRACTION_CACHE_ENABLED ("0" desativa), EXTRACTION_CACHE_PATH,
+    EXTRACTION_CACHE_MAX_ENTRIES e EXTRACTION_CACHE_TTL_SECONDS.
+
+    Returns:
+        Optional[ExtractionCache]: Cache ou None se desativado
+    """
+    global _extraction_cache
+
+    if os.getenv("EXTRACTION_CACHE_ENABLED", "1") == "0":
+        return None
+
+    with _extraction_cache_lock:
+        if _extraction_cache is None:
+            _extraction_cache = ExtractionCache(
+                db_path=os.getenv("EXTRACTION_CACHE_PATH", DEFAULT_CACHE_PATH),
+                max_entries=int(os.getenv("EXTRACTION_CACHE_MAX_ENTRIES", DEFAULT_CACHE_MAX_ENTRIES)),
+                ttl_seconds=float(os.getenv("EXTRACTION_CACHE_TTL_SECONDS", DEFAULT_CACHE_TTL_SECONDS))
+            )
+    return _extraction_cache
+
+
+def get_callback_agent(callback_context: CallbackContext) -> "LlmAgent":
+    """
+    Retorna o agente em execução no callback.
+
+    O CallbackContext do Google ADK expõe apenas o nome do agente (`agent_name`), mas os callbacks
+    dos extratores precisam da sua configuração (modelo, instrução, `output_key` e `output_schema`),
+    disponível só no contexto da invocação. O acesso fica concentrado aqui; um registro por nome
+    não serve, pois as cópias de `clone_agent_tree` têm o mesmo nome com outro modelo.
+
+    Args:
+        callback_context: Contexto do callback do Google ADK
+
+    Returns:
+        LlmAgent: Agente em execução
+    """
+    return callback_context._invocation_context.agent
+
+
+def _cache_key(agent: "LlmAgent", user_content: Optional[types.Content]) -> Optional[str]:
+    # Monta a chave a partir dos documentos da mensagem do usuário e da configuração do agente
+    documents = [
+        part.inline_data.data
+        for part in (user_content.parts if user_content and user_content.parts else [])
+        if part.inline_data and part.inline_data.data
+    ]
+    if not documents or not getattr(agent, "output_key", None):
+        return None
+
+    model_id = getattr(agent.model, "model", agent.model)
+    instruction = agent.instruction if isinstance(agent.instruction, str) else getattr(agent.instruction, "__qualname__", "")
+    if agent.output_schema is not None:
+        instruction += json.dumps(agent.output_schema.model_json_schema(), sort_keys=True)
+
+    return make_cache_key(documents, agent.name, str(model_id), instruction)
+
+
+def _store(cache: ExtractionCache, agent: "LlmAgent", user_content: Optional[types.Content], value: Any):
+    key = _cache_key(agent, user_content)
+    if key is not None:
+        cache.put(key, agent.name, str(getattr(agent.model, "model", agent.model)), value)
+
+
+def _discard(cache: ExtractionCache, agent: "LlmAgent", user_content: Optional[types.Content]):
+    key = _cache_key(agent, user_content)
+    if key is not None:
+        cache.delete(key)
+
+
+def _lookup(cache: ExtractionCache, agent: "LlmAgent", user_content: Optional[types.Content]) -> Optional[Any]:
+    key = _cache_key(agent, user_content)
+    return cache.get(key) if key is not None else None
+
+
+async def store_extraction(agent: "LlmAgent", user_content: Optional[types.Content], value: Any) -> None:
+    """
+    Armazena no cache a saída de um agente extrator para os documentos da mensagem do usuário.
+
+    Usado pelo `save_extraction_to_cache`, pela extração especulativa (cujos eventos só chegam
+    à sessão depois que o extrator vencedor é escolhido) e pela validação da NF-e, que só
+    armazena dados aprovados. O hash dos documentos e o SQLite rodam em uma thread.
+
+    Args:
+        agent: Agente extrator
+        user_content: Mensagem do usuário com os documentos
+        value: Saída estruturada gravada no `output_key` do agente
+    """
+    cache = get_extraction_cache()
+    if cache is not None:
+        await asyncio.to_thread(_store, cache, agent, user_content, value)
+
+
+async def discard_extraction(agent: "LlmAgent", user_content: Optional[types.Content]) -> None:
+    """
+    Remove do cache a saída de um agente extrator para os documentos da mensagem do usuário.
+
+    Args:
+        agent: Agente extrator
+        user_content: Mensagem do usuário com os documentos
+    """
+    cache = get_extraction_cache()
+    if cache is not None:
+        await asyncio.to_thread(_discard, cache, agent, user_content)
+
+
+async def load_extraction_from_cache(callback_context: CallbackContext) -> Optional[types.Content]:
+    """
+    before_agent_callback dos agentes extratores: em caso de acerto, grava a saída
+    armazenada no `output_key` do agente e pula a chamada ao LLM.
+
+    Args:
+        callback_context: Contexto do callback do Google ADK
+
+    Returns:
+        Optional[types.Content]: Resposta do agente recuperada do cache ou None para executar o agente
+    """
+    cache = get_extraction_cache()
+    if cache is None or callback_context.state.get(BYPASS_CACHE_STATE_KEY):
+        return None
+
+    agent = get_callback_agent(callback_context)
+    value = await asyncio.to_thread(_lookup, cache, agent, callback_context.user_content)
+    if value is None:
+        return None
+
+    logger.info(f"Extração recuperada do cache para o agente {agent.name}")
+    callback_context.state[agent.output_key] = value
+    return types.Content(role="model", parts=[types.Part(text=json.dumps(value, ensure_ascii=False))])
+
+
+async def save_extraction_to_cache(callback_context: CallbackContext) -> None:
+    """
+    after_agent_callback dos agentes extratores sem etapa de validação: armazena no cache a
+    saída gravada no `output_key`. O extrator da NF-e não usa este callback: os dados só vão
+    para o cache depois de aprovados pelo `NFeValidationAgent`.
+
+    Na extração especulativa os eventos do extrator ainda não estão na sessão quando este
+    callback executa; a saída do vencedor é armazenada pelo `DocumentRouterAgent`.
+
+    Args:
+        callback_context: Contexto do callback do Google ADK
+    """
+    if get_extraction_cache() is None:
+        return None
+
+    agent = get_callback_agent(callback_context)
+
+    # Considera apenas a saída gravada pelo agente nesta invocação (e não um valor de turnos anteriores)
+    for event in reversed(callback_context.session.events):
+        if event.invocation_id != callback_context.invocation_id:
+            break
+        if event.author == agent.name and agent.output_key in event.actions.state_delta:
+            await store_extraction(agent, callback_context.user_content, event.actions.state_delta[agent.output_key])
+            break
+    return None
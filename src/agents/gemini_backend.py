@@ -0,0 +1,122 @@
+import asyncio
+import logging
+import os
+import threading
+import weakref
+
+from typing import AsyncGenerator, Dict, Optional
+
+from google.adk.models import Gemini, LlmRequest, LlmResponse
+from google.adk.models.registry import LLMRegistry
+from google.genai import Client, types
+
+from src.agents.rate_limiter import (
+    get_rate_limiter, get_request_priority, select_model_async, estimate_request_tokens,
+    is_retryable_error, is_quota_error, retry_delay_from_error, backoff_delay, mark_retries_exhausted, SLOW_ACQUIRE_SECONDS
+)
+
+logger = logging.getLogger(__name__)
+
+# Clientes compartilhados por event loop: o pool HTTP assíncrono do cliente fica preso
+# ao loop em que foi usado pela primeira vez, então cada loop recebe o seu. Dentro de um loop,
+# há um cliente por configuração de `retry_options` do modelo
+_clients_by_loop: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, Dict[str, Client]]" = weakref.WeakKeyDictionary()
+_clients_without_loop: Dict[str, Client] = {}
+_clients_lock = threading.Lock()
+
+# Novas tentativas de uma chamada ao modelo em erros temporários (GEMINI_MAX_RETRIES) e espera do backoff
+DEFAULT_MAX_RETRIES = 5
+RETRY_BASE_DELAY_SECONDS = 2.0
+RETRY_MAX_DELAY_SECONDS = 60.0
+
+
+def _create_client(headers: dict, retry_options: Optional[types.HttpRetryOptions] = None) -> Client:
+    # Mesmas opções HTTP do cliente criado pelo Gemini do ADK
+    return Client(http_options=types.HttpOptions(headers=headers, retry_options=retry_options))
+
+
+class PooledGemini(Gemini):
+    """
+    Modelo Gemini que reutiliza um único cliente `google.genai` (e suas conexões HTTP/TLS)
+    por event loop, em vez de criar um cliente novo a cada chamada ao modelo.
+
+    O Google ADK instancia o modelo a partir do nome (ex.: "gemini-2.5-flash") a cada
+    requisição; registrar esta classe no `LLMRegistry` faz todos os agentes usarem o pool.
+
+    As chamadas passam pelo limitador de cota do modelo (ver `rate_limiter`), com novas tentativas
+    em erros temporários e troca para o modelo de `MODEL_FALLBACKS` quando a cota se esgota.
+    """
+
+    @property
+    def api_client(self) -> Client:
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            loop = None
+
+        retry_key = self.retry_options.model_dump_json(exclude_none=True) if self.retry_options else ""
+        with _clients_lock:
+            if loop is None:
+                clients = _clients_without_loop
+            else:
+                clients = _clients_by_loop.setdefault(loop, {})
+
+            client = clients.get(retry_key)
+            if client is None:
+                if loop is not None:
+                    logger.info("Criando cliente Gemini compartilhado para o event loop atual")
+                client = _create_client(self._tracking_headers, self.retry_options)
+                clients[retry_key] = client
+            return client
+
+    async def generate_content_async(self, llm_request: LlmRequest, stream: bool = False) -> AsyncGenerator[LlmResponse, None]:
+        model_id = llm_request.model or self.model
+        priority = get_request_priority()
+        estimated_tokens = estimate_request_tokens(llm_request)
+        max_retries = int(os.getenv("GEMINI_MAX_RETRIES", DEFAULT_MAX_RETRIES))
+        attempt = 0
+
+        while True:
+            attempt += 1
+            llm_request.model = await select_model_async(model_id)
+            limiter = get_rate_limiter(llm_request.model)
+            if limiter is not None:
+                waited = await limiter.acquire(estimated_tokens, priority)
+                if waited >= SLOW_ACQUIRE_SECONDS:
+                    logger.info(f"Chamada ao {llm_request.model} aguardou {waited:.1f}s pela cota (prioridade {priority})")
+
+            yielded = False
+            try:
+                async for response in super().generate_content_async(llm_request, stream):
+                    yielded = True
+                    if limiter is not None and not response.partial and response.usage_metadata and response.usage_metadata.total_token_count:
+                        await limiter.settle_async(estimated_tokens, response.usage_metadata.total_token_count)
+                    yield response
+                return
+            except Exception as e:
+                # Uma resposta já entregue em parte não pode ser repetida
+                if yielded or attempt > max_retries or not is_retryable_error(e):
+                    if not yielded and max_retries > 0 and is_retryable_error(e):
+                        mark_retries_exhausted(e)
+                    raise
+
+                delay = backoff_delay(attempt, RETRY_BASE_DELAY_SECONDS, RETRY_MAX_DELAY_SECONDS)
+                if is_quota_error(e) and limiter is not None:
+                    await limiter.block_async(retry_delay_from_error(e) or delay)
+                    next_model = await select_model_async(model_id)
+                    if next_model != llm_request.model:
+                        logger.warning(f"Cota do {llm_request.model} esgotada; usando {next_model}")
+                        continue
+
+                logger.warning(f"Erro temporário do {llm_request.model} (tentativa {attempt}): {e}. Nova tentativa em {delay:.1f}s")
+                await asyncio.sleep(delay)
+
+
+def register_pooled_gemini():
+    """Registra `PooledGemini` no `LLMRegistry` do Google ADK para os modelos Gemini."""
+    LLMRegistry.register(PooledGemini)
+    # A resolução de nomes de modelo é memorizada; limpa para valer o novo registro
+    LLMRegistry.resolve.cache_clear()
+
+
+register_pooled_gemini()
@@ -0,0 +1,172 @@
+import io
+import logging
+
+from dataclasses import dataclass
+from typing import List, Optional, Tuple
+
+from PIL import Image, ImageChops, ImageOps, UnidentifiedImageError
+
+logger = logging.getLogger(__name__)
+
+# Formatos de saída suportados e seus tipos MIME
+OUTPUT_MIME_TYPES = {
+    "WEBP": "image/webp",
+    "JPEG": "image/jpeg",
+}
+
+
+@dataclass(frozen=True)
+class ImageProfile:
+    """
+    Perfil de pré-processamento de imagens enviadas a um agente.
+
+    Attributes:
+        max_long_edge: Tamanho máximo (em pixels) do maior lado da imagem
+        grayscale: Converte a imagem para tons de cinza
+        crop_to_document: Recorta as bordas de fundo ao redor do documento
+        output_format: Formato de saída ("WEBP" ou "JPEG")
+        quality: Qualidade da compressão (1-100)
+    """
+    max_long_edge: int = 2048
+    grayscale: bool = False
+    crop_to_document: bool = True
+    output_format: str = "JPEG"
+    quality: int = 85
+
+
+def _crop_to_document(image: Image.Image, threshold: int = 40, margin: float = 0.02) -> Image.Image:
+    # Estima a cor de fundo pelos cantos e recorta a região que difere dela
+    gray = image.convert("L")
+    width, height = gray.size
+    corners = [gray.getpixel((0, 0)), gray.getpixel((width - 1, 0)), gray.getpixel((0, height - 1)), gray.getpixel((width - 1, height - 1))]
+    background = sorted(corners)[len(corners) // 2]
+
+    mask = ImageChops.difference(gray, Image.new("L", gray.size, background)).point(lambda p: 255 if p > threshold else 0)
+    bbox = mask.getbbox()
+    if bbox is None:
+        return image
+
+    left, top, right, bottom = bbox
+    area_ratio = ((right - left) * (bottom - top)) / (width * height)
+    # Ignora recortes irrelevantes (quase a imagem toda) ou suspeitos (fragmentos pequenos)
+    if area_ratio > 0.9 or area_ratio < 0.2:
+        return image
+
+    pad_x, pad_y = int(width * margin), int(height * margin)
+    return image.crop((max(0, left - pad_x), max(0, top - pad_y), min(width, right + pad_x), min(height, bottom + pad_y)))
+
+
+def preprocess_image(file_bytes: bytes, profile: ImageProfile) -> Tuple[bytes, Optional[str]]:
+    """
+    Aplica o perfil de pré-processamento a uma imagem: orientação pelo EXIF, recorte do documento,
+    redução de resolução, tons de cinza e recompressão.
+
+    Se a imagem não puder ser lida (ou for animada) ou o resultado não for menor que o original,
+    os bytes originais são mantidos.
+
+    Args:
+        file_bytes: Bytes da imagem original
+        profile: Perfil de pré-processamento
+
+    Returns:
+        Tuple[bytes, Optional[str]]: Bytes da imagem resultante e seu tipo MIME (None se a original foi mantida)
+    """
+    try:
+        image = Image.open(io.BytesIO(file_bytes))
+        if getattr(image, "is_animated", False):
+            return file_bytes, None
+        image = ImageOps.exif_transpose(image)
+    except (UnidentifiedImageError, OSError, Image.DecompressionBombError) as e:
+        logger.warning(f"Não foi possível pré-processar a imagem: {e}")
+        return file_bytes, None
+
+    original_size = image.size
+
+    if profile.crop_to_document:
+        image = _crop_to_document(image)
+
+    if max(image.size) > profile.max_long_edge:
+        image.thumbnail((profile.max_long_edge, profile.max_long_edge), Image.Resampling.LANCZOS)
+
+    if profile.grayscale:
+        image = image.convert("L")
+    elif image.mode not in ("RGB", "L"):
+        image = image.convert("RGB")
+
+    output = io.BytesIO()
+    image.save(output, format=profile.output_format, quality=profile.quality)
+    processed_bytes = output.getvalue()
+
+    if len(processed_bytes) >= len(file_bytes):
+        return file_bytes, None
+
+    logger.info(
+        f"Imagem pré-processada: {original_size[0]}x{original_size[1]} -> {image.size[0]}x{image.size[1]}, "
+        f"{len(file_bytes) / 1024:.0f} KB -> {len(processed_bytes) / 1024:.0f} KB"
+    )
+    return processed_bytes, OUTPUT_MIME_TYPES[profile.output_format]
+
+
+def make_thumbnail(file_bytes: bytes, max_edge: int = 256, quality: int = 70) -> Optional[bytes]:
+    """
+    Gera uma miniatura JPEG da imagem (ex.: para o histórico do chat).
+
+    Args:
+        file_bytes: Bytes da imagem original
+        max_edge: Tamanho máximo (em pixels) do maior lado da miniatura
+        quality: Qualidade da compressão JPEG (1-100)
+
+    Returns:
+        Optional[bytes]: Bytes da miniatura ou None se a imagem não puder ser lida
+    """
+    try:
+        image = ImageOps.exif_transpose(Image.open(io.BytesIO(file_bytes)))
+        image.thumbnail((max_edge, max_edge), Image.Resampling.LANCZOS)
+        if image.mode not in ("RGB", "L"):
+            image = image.convert("RGB")
+        output = io.BytesIO()
+        image.save(output, format="JPEG", quality=quality)
+    except (UnidentifiedImageError, OSError, Image.DecompressionBombError) as e:
+        logger.warning(f"Não foi possível gerar a miniatura: {e}")
+        return None
+    return output.getvalue()
+
+
+def split_image_tiles(file_bytes: bytes, max_aspect: float = 1.5, overlap: float = 0.08, quality: int = 85) -> List[bytes]:
+    """
+    Divide uma imagem alta (ex.: foto de uma DANFE longa) em faixas horizontais sobrepostas,
+    cada uma com altura de até `max_aspect` vezes a largura. Linhas cortadas na divisão
+    aparecem inteiras em pelo menos uma das faixas.
+
+    Args:
+        file_bytes: Bytes da imagem
+        max_aspect: Razão altura/largura máxima de cada faixa
+        overlap: Fração da altura da faixa repetida na faixa seguinte
+        quality: Qualidade da compressão JPEG das faixas (1-100)
+
+    Returns:
+        List[bytes]: Bytes JPEG das faixas, de cima para baixo, ou `[file_bytes]` se a imagem
+            não precisar ser dividida (ou não puder ser lida)
+    """
+    try:
+        image = Image.open(io.BytesIO(file_bytes))
+        width, height = image.size
+        tile_height = int(width * max_aspect)
+        if height <= tile_height:
+            return [file_bytes]
+
+        if image.mode not in ("RGB", "L"):
+            image = image.convert("RGB")
+        step = max(int(tile_height * (1 - overlap)), 1)
+        tiles = []
+        for top in range(0, height, step):
+            bottom = min(top + tile_height, height)
+            output = io.BytesIO()
+            image.crop((0, top, width, bottom)).save(output, format="JPEG", quality=quality)
+            tiles.append(output.getvalue())
+            if bottom >= height:
+                break
+    except (UnidentifiedImageError, OSError, Image.DecompressionBombError) as e:
+        logger.warning(f"Não foi possível dividir a imagem: {e}")
+        return [file_bytes]
+    return tiles
@@ -0,0 +1,359 @@
+import io
+import logging
+import mimetypes
+import os
+
+from dataclasses import dataclass
+from pathlib import Path
+from typing import BinaryIO, List, Optional, Tuple, Union
+
+from PIL import Image, ImageSequence, UnidentifiedImageError
+
+logger = logging.getLogger(__name__)
+
+# Bytes lidos do início do arquivo para identificar o tipo
+SNIFF_BYTES = 64
+
+# Assinaturas (magic numbers) dos tipos aceitos: tipo MIME e sequências (deslocamento, bytes) que precisam coincidir
+MAGIC_SIGNATURES: List[Tuple[str, Tuple[Tuple[int, bytes], ...]]] = [
+    ("application/pdf", ((0, b"%PDF-"),)),
+    ("image/jpeg", ((0, b"\xff\xd8\xff"),)),
+    ("image/png", ((0, b"\x89PNG\r\n\x1a\n"),)),
+    ("image/gif", ((0, b"GIF87a"),)),
+    ("image/gif", ((0, b"GIF89a"),)),
+    ("image/webp", ((0, b"RIFF"), (8, b"WEBP"))),
+    ("image/tiff", ((0, b"II*\x00"),)),
+    ("image/tiff", ((0, b"MM\x00*"),)),
+    ("image/bmp", ((0, b"BM"),)),
+    # HEIC/HEIF (fotos de celular): caixa "ftyp" com a marca do formato
+    *(("image/heic", ((4, b"ftyp" + brand),)) for brand in (b"heic", b"heix", b"hevc", b"hevx", b"heim", b"heis")),
+    *(("image/heif", ((4, b"ftyp" + brand),)) for brand in (b"mif1", b"msf1")),
+]
+
+# Início de um XML (ex.: NF-e), após BOM e espaços opcionais
+XML_PREFIXES = (b"<?xml", b"<nfeProc", b"<NFe")
+
+# Tipos enviados ao modelo sem conversão
+SUPPORTED_MIME_TYPES = {"application/pdf", "image/jpeg", "image/png", "image/gif", "image/webp", "text/xml"}
+
+# Tipos de scanners e celulares convertidos para JPEG antes do envio (cada página de um TIFF vira uma imagem)
+CONVERTED_MIME_TYPES = {"image/tiff", "image/bmp", "image/heic", "image/heif"}
+
+MB = 1024 * 1024
+
+
+@dataclass(frozen=True)
+class IngestionLimits:
+    """
+    Limites de um tipo de arquivo.
+
+    Attributes:
+        max_bytes: Tamanho máximo do arquivo enviado
+        max_pages: Número máximo de páginas (PDF e TIFF) ou None sem limite
+    """
+    max_bytes: int
+    max_pages: Optional[int] = None
+
+
+# Soma dos dados inline de uma mensagem ao modelo, após o pré-processamento (INGESTION_MAX_MESSAGE_MB);
+# a requisição ao Gemini aceita ~20 MB, e os dados crescem 4/3 com a codificação base64
+DEFAULT_MAX_MESSAGE_BYTES = 14 * MB
+
+# Tipos enviados ao modelo como recebidos (sem redução): o limite do tipo fica abaixo do limite da mensagem
+INLINE_MIME_TYPES = {"application/pdf", "image/gif", "text/xml"}
+
+# Limites por tipo: imagens são reduzidas antes do envio, mas as páginas dos PDFs seguem como
+# dados inline na mesma mensagem
+FILE_TYPE_LIMITS = {
+    "application/pdf": IngestionLimits(max_bytes=12 * MB, max_pages=50),
+    "image/tiff": IngestionLimits(max_bytes=50 * MB, max_pages=50),
+    "image/heic": IngestionLimits(max_bytes=30 * MB),
+    "image/heif": IngestionLimits(max_bytes=30 * MB),
+    "image/gif": IngestionLimits(max_bytes=8 * MB),
+    "text/xml": IngestionLimits(max_bytes=5 * MB),
+}
+DEFAULT_FILE_LIMITS = IngestionLimits(max_bytes=30 * MB)
+
+# Qualidade JPEG das imagens convertidas (o pré-processamento do agente reduz e recomprime depois)
+CONVERTED_JPEG_QUALITY = 92
+
+
+class IngestionError(ValueError):
+    """Arquivo recusado na entrada (tipo não suportado, grande demais ou com páginas demais)."""
+
+
+class UnsupportedFileTypeError(IngestionError):
+    """Tipo de arquivo não reconhecido ou não aceito pelos agentes."""
+
+
+class FileTooLargeError(IngestionError):
+    """Arquivo acima do limite de tamanho ou de páginas do seu tipo."""
+
+
+@dataclass
+class IngestedFile:
+    """
+    Arquivo pronto para a mensagem do agente.
+
+    Attributes:
+        mime_type: Tipo MIME enviado ao modelo
+        data: Bytes do arquivo (convertidos, quando necessário)
+    """
+    mime_type: str
+    data: bytes
+
+
+def sniff_mime_type(head: bytes, filename: Optional[str] = None) -> Optional[str]:
+    """
+    Identifica o tipo do arquivo pelos primeiros bytes (tabela MAGIC_SIGNATURES) e, se não
+    reconhecido, pela extensão do nome do arquivo.
+
+    Args:
+        head: Primeiros bytes do arquivo (ao menos SNIFF_BYTES, se houver)
+        filename: Nome do arquivo (opcional)
+
+    Returns:
+        Optional[str]: Tipo MIME ou None se desconhecido
+    """
+    for mime_type, checks in MAGIC_SIGNATURES:
+        if all(head[offset:offset + len(magic)] == magic for offset, magic in checks):
+            return mime_type
+    if head.lstrip(b"\xef\xbb\xbf \t\r\n").startswith(XML_PREFIXES):
+        return "text/xml"
+
+    if filename:
+        mime_type, _ = mimetypes.guess_type(filename)
+        if mime_type in ("application/xml", "text/xml"):
+            return "text/xml"
+        if mime_type in SUPPORTED_MIME_TYPES | CONVERTED_MIME_TYPES:
+            return mime_type
+    return None
+
+
+def get_message_limit() -> int:
+    """
+    Returns:
+        int: Soma máxima dos dados inline de uma mensagem (INGESTION_MAX_MESSAGE_MB ou DEFAULT_MAX_MESSAGE_BYTES)
+    """
+    max_message_mb = os.getenv("INGESTION_MAX_MESSAGE_MB")
+    return int(float(max_message_mb) * MB) if max_message_mb else DEFAULT_MAX_MESSAGE_BYTES
+
+
+def get_file_limits(mime_type: Optional[str]) -> IngestionLimits:
+    """
+    Limites do tipo de arquivo. INGESTION_MAX_FILE_MB, se definido, reduz o tamanho máximo de todos os tipos;
+    os tipos enviados sem redução (INLINE_MIME_TYPES) também não passam do limite da mensagem.
+
+    Args:
+        mime_type: Tipo MIME do arquivo
+
+    Returns:
+        IngestionLimits: Limites do tipo
+    """
+    limits = FILE_TYPE_LIMITS.get(mime_type, DEFAULT_FILE_LIMITS)
+    max_bytes = limits.max_bytes
+    max_file_mb = os.getenv("INGESTION_MAX_FILE_MB")
+    if max_file_mb:
+        max_bytes = min(max_bytes, int(float(max_file_mb) * MB))
+    if mime_type in INLINE_MIME_TYPES:
+        max_bytes = min(max_bytes, get_message_limit())
+    if max_bytes != limits.max_bytes:
+        limits = IngestionLimits(max_bytes=max_bytes, max_pages=limits.max_pages)
+    return limits
+
+
+def check_message_size(inline_bytes: int):
+    """
+    Confere a soma dos dados inline de uma mensagem ao modelo (arquivos já convertidos e pré-processados).
+
+    Args:
+        inline_bytes: Soma dos bytes dos arquivos da mensagem
+
+    Raises:
+        FileTooLargeError: Se a soma passa do limite da mensagem (ver `get_message_limit`)
+    """
+    limit = get_message_limit()
+    if inline_bytes > limit:
+        raise FileTooLargeError(
+            f"Os arquivos da mensagem somam {inline_bytes / MB:.3g} MB após o preparo; o limite por mensagem é {limit / MB:.3g} MB "
+            "(envie menos arquivos por mensagem)"
+        )
+
+
+def check_file_header(head: bytes, size: Optional[int], filename: Optional[str] = None) -> str:
+    """
+    Confere o tipo e o tamanho de um arquivo antes de lê-lo por inteiro.
+
+    Args:
+        head: Primeiros bytes do arquivo
+        size: Tamanho total do arquivo em bytes (None se ainda desconhecido)
+        filename: Nome do arquivo (opcional, usado nas mensagens e como alternativa na identificação)
+
+    Returns:
+        str: Tipo MIME do arquivo
+
+    Raises:
+        IngestionError: Se o tipo não é suportado ou o arquivo passa do limite do tipo
+    """
+    label = filename or "arquivo"
+    mime_type = sniff_mime_type(head, filename)
+    if mime_type is None:
+        raise UnsupportedFileTypeError(f"Tipo de arquivo não suportado: {label} (aceitos: imagens, PDF e XML da NF-e)")
+
+    limits = get_file_limits(mime_type)
+    if size is not None and size > limits.max_bytes:
+        raise FileTooLargeError(f"{label} tem {size / MB:.3g} MB; o limite para {mime_type} é {limits.max_bytes / MB:.3g} MB")
+    return mime_type
+
+
+def read_file_guarded(source: Union[str, Path, BinaryIO], filename: Optional[str] = None, size: Optional[int] = None, chunk_size: int = MB) -> bytes:
+    """
+    Lê um arquivo (caminho ou arquivo aberto) recusando-o antes da leitura completa quando o tipo
+    não é suportado ou o tamanho passa do limite. Sem tamanho conhecido, lê em blocos e
+    interrompe ao passar do limite.
+
+    Args:
+        source: Caminho ou arquivo binário aberto
+        filename: Nome do arquivo (padrão: nome do caminho)
+        size: Tamanho informado pelo cliente (padrão: tamanho do arquivo no disco, se disponível)
+        chunk_size: Tamanho dos blocos lidos
+
+    Returns:
+        bytes: Conteúdo do arquivo
+
+    Raises:
+        IngestionError: Se o arquivo é recusado
+    """
+    if isinstance(source, (str, Path)):
+        path = Path(source)
+        with path.open("rb") as file:
+            return read_file_guarded(file, filename or path.name, os.fstat(file.fileno()).st_size, chunk_size)
+
+    head = source.read(SNIFF_BYTES)
+    limits = get_file_limits(check_file_header(head, size, filename))
+
+    chunks = [head]
+    total = len(head)
+    while True:
+        chunk = source.read(chunk_size)
+        if not chunk:
+            break
+        total += len(chunk)
+        if total > limits.max_bytes:
+            raise FileTooLargeError(f"{filename or 'arquivo'} passa do limite de {limits.max_bytes / MB:.3g} MB")
+        chunks.append(chunk)
+    return b"".join(chunks)
+
+
+def _open_heif(file_bytes: bytes) -> Image.Image:
+    # HEIC/HEIF exige o pacote opcional `pillow-heif`
+    try:
+        import pillow_heif
+    except ImportError:
+        raise UnsupportedFileTypeError("Imagens HEIC/HEIF exigem o pacote 'pillow-heif' (pip install pillow-heif)")
+    pillow_heif.register_heif_opener()
+    return Image.open(io.BytesIO(file_bytes))
+
+
+def convert_image_pages(file_bytes: bytes, mime_type: str, max_pages: Optional[int] = None) -> List[bytes]:
+    """
+    Converte imagens de scanners e celulares (TIFF, BMP, HEIC) para JPEG, uma imagem por página.
+
+    Args:
+        file_bytes: Bytes da imagem
+        mime_type: Tipo MIME identificado
+        max_pages: Número máximo de páginas
+
+    Returns:
+        List[bytes]: Bytes JPEG de cada página
+
+    Raises:
+        IngestionError: Se a imagem não pode ser lida ou tem páginas demais
+    """
+    try:
+        image = _open_heif(file_bytes) if mime_type in ("image/heic", "image/heif") else Image.open(io.BytesIO(file_bytes))
+        page_count = getattr(image, "n_frames", 1)
+        if max_pages is not None and page_count > max_pages:
+            raise FileTooLargeError(f"Imagem com {page_count} páginas; o limite é {max_pages}")
+
+        pages = []
+        for frame in ImageSequence.Iterator(image):
+            output = io.BytesIO()
+            frame.convert("RGB").save(output, format="JPEG", quality=CONVERTED_JPEG_QUALITY)
+            pages.append(output.getvalue())
+    except Image.DecompressionBombError as e:
+        raise FileTooLargeError(f"Imagem {mime_type} com resolução acima do limite: {e}")
+    except (UnidentifiedImageError, OSError) as e:
+        raise IngestionError(f"Imagem {mime_type} não pôde ser lida: {e}")
+    return pages
+
+
+def check_image_resolution(file_bytes: bytes, label: str):
+    """
+    Recusa imagens com pixels demais para serem decodificadas (Image.MAX_IMAGE_PIXELS), lendo só o cabeçalho.
+    Imagens que não podem ser lidas seguem sem alteração (ver `preprocess_image`).
+
+    Args:
+        file_bytes: Bytes da imagem
+        label: Nome do arquivo usado na mensagem de erro
+
+    Raises:
+        FileTooLargeError: Se a resolução passa do limite
+    """
+    try:
+        Image.open(io.BytesIO(file_bytes))
+    except Image.DecompressionBombError as e:
+        raise FileTooLargeError(f"{label} tem resolução acima do limite: {e}")
+    except (UnidentifiedImageError, OSError):
+        pass
+
+
+def count_pdf_pages(pdf_bytes: bytes) -> int:
+    """
+    Args:
+        pdf_bytes: Bytes do PDF
+
+    Returns:
+        int: Número de páginas
+    """
+    from pypdf import PdfReader
+    from pypdf.errors import PdfReadError
+
+    try:
+        return len(PdfReader(io.BytesIO(pdf_bytes)).pages)
+    except (PdfReadError, ValueError) as e:
+        raise IngestionError(f"PDF não pôde ser lido: {e}")
+
+
+def ingest_file(file_bytes: bytes, filename: Optional[str] = None) -> List[IngestedFile]:
+    """
+    Valida um arquivo enviado e o prepara para a mensagem do agente: identifica o tipo pelos
+    magic numbers, aplica os limites de tamanho e de páginas do tipo e converte TIFF, BMP e HEIC para JPEG.
+
+    Args:
+        file_bytes: Bytes do arquivo
+        filename: Nome do arquivo (opcional)
+
+    Returns:
+        List[IngestedFile]: Arquivos para a mensagem (mais de um para TIFFs com várias páginas)
+
+    Raises:
+        IngestionError: Se o arquivo é recusado
+    """
+    label = filename or "arquivo"
+    mime_type = check_file_header(file_bytes[:SNIFF_BYTES], len(file_bytes), filename)
+    limits = get_file_limits(mime_type)
+
+    if mime_type in CONVERTED_MIME_TYPES:
+        logger.info(f"Convertendo {mime_type} para JPEG")
+        return [IngestedFile("image/jpeg", page) for page in convert_image_pages(file_bytes, mime_type, limits.max_pages)]
+
+    if mime_type == "application/pdf" and limits.max_pages is not None:
+        page_count = count_pdf_pages(file_bytes)
+        if page_count > limits.max_pages:
+            raise FileTooLargeError(f"{label} tem {page_count} páginas; o limite para PDFs é {limits.max_pages}")
+
+    if mime_type.startswith("image/"):
+        check_image_resolution(file_bytes, label)
+
+    return [IngestedFile(mime_type, file_bytes)]
@@ -0,0 +1,310 @@
+import json
+import logging
+import os
+import threading
+import time
+
+from abc import ABC, abstractmethod
+from dataclasses import dataclass, asdict
+from typing import TYPE_CHECKING, Dict, List, Optional
+
+if TYPE_CHECKING:
+    from google.adk.agents import BaseAgent
+    from google.adk.events import Event
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class StageMetrics:
+    """
+    Métricas acumuladas de um agente (etapa) durante um turno.
+
+    Attributes:
+        author: Nome do agente que gerou os eventos
+        model_id: Modelo LLM do agente (None para agentes sem LLM)
+        events: Número de eventos gerados
+        wall_time_s: Tempo de relógio atribuído ao agente (desde o evento anterior)
+        prompt_tokens: Tokens de entrada informados pelo modelo
+        response_tokens: Tokens de saída informados pelo modelo
+        cached_tokens: Tokens de entrada atendidos pelo cache de contexto
+        payload_bytes: Tamanho do conteúdo dos eventos (texto e dados inline)
+    """
+    author: str
+    model_id: Optional[str] = None
+    events: int = 0
+    wall_time_s: float = 0.0
+    prompt_tokens: int = 0
+    response_tokens: int = 0
+    cached_tokens: int = 0
+    payload_bytes: int = 0
+
+
+def _content_size(content) -> int:
+    # Soma o tamanho do texto e dos dados inline de um Content
+    if content is None or not content.parts:
+        return 0
+    size = 0
+    for part in content.parts:
+        if part.text:
+            size += len(part.text.encode("utf-8"))
+        if part.inline_data and part.inline_data.data:
+            size += len(part.inline_data.data)
+    return size
+
+
+class TurnMetrics:
+    """
+    Coleta as métricas de um turno (uma chamada a `run_agent_query`/`stream_agent_query`),
+    agrupadas pelo agente autor de cada evento de `runner.run_async`.
+    """
+
+    def __init__(self):
+        self.agent_name: Optional[str] = None
+        self.model_id: Optional[str] = None
+        self.upload_bytes = 0
+        self.started_at: Optional[float] = None
+        self.first_event_s: Optional[float] = None
+        self.total_time_s: Optional[float] = None
+        self.error: Optional[str] = None
+        self.stages: Dict[str, StageMetrics] = {}
+        self._root_agent: Optional["BaseAgent"] = None
+        self._last_event_at: Optional[float] = None
+
+    def begin(self, agent: "BaseAgent", model_id: Optional[str], user_content=None):
+        """
+        Inicia a medição do turno.
+
+        Args:
+            agent: Agente raiz executado (usado para identificar o modelo de cada etapa)
+            model_id: Modelo LLM selecionado para o turno
+            user_content: Mensagem do usuário (para medir o tamanho do envio)
+        """
+        self._root_agent = agent
+        self.agent_name = agent.name
+        self.model_id = model_id
+        self.upload_bytes = _content_size(user_content)
+        self.started_at = self._last_event_at = time.perf_counter()
+
+    def record_event(self, event: "Event"):
+        """
+        Registra um evento de `runner.run_async`, atribuindo ao seu autor o tempo desde o evento anterior.
+
+        Args:
+            event: Evento gerado pelo Runner
+        """
+        now = time.perf_counter()
+        if self.first_event_s is None:
+            # Inclui o envio da mensagem (e das imagens) até a primeira resposta
+            self.first_event_s = now - self.started_at
+
+        stage = self.stages.get(event.author)
+        if stage is None:
+            author_agent = self._root_agent.find_agent(event.author) if self._root_agent else None
+            model = getattr(author_agent, "model", None) or None
+            stage = self.stages[event.author] = StageMetrics(author=event.author, model_id=getattr(model, "model", model))
+
+        stage.events += 1
+        stage.wall_time_s += now - self._last_event_at
+        self._last_event_at = now
+
+        # Eventos parciais (streaming) repetem o conteúdo e o uso no evento final
+        if event.partial:
+            return
+
+        stage.payload_bytes += _content_size(event.content)
+        usage = event.usage_metadata
+        if usage is not None:
+            stage.prompt_tokens += usage.prompt_token_count or 0
+            stage.response_tokens += usage.candidates_token_count or 0
+            stage.cached_tokens += usage.cached_content_token_count or 0
+
+    def finish(self, error: Optional[Exception] = None):
+        """
+        Encerra a medição e envia o turno para os coletores registrados.
+
+        Args:
+            error: Exceção que interrompeu o turno, se houver
+        """
+        self.total_time_s = time.perf_counter() - self.started_at
+        self.error = str(error) if error else None
+        emit_turn_metrics(self)
+
+    def to_dict(self) -> Dict:
+        """
+        Returns:
+            Dict: Métricas do turno em formato serializável
+        """
+        return {
+            "agent": self.agent_name,
+            "model_id": self.model_id,
+            "upload_bytes": self.upload_bytes,
+            "first_event_s": round(self.first_event_s, 4) if self.first_event_s is not None else None,
+            "total_time_s": round(self.total_time_s, 4) if self.total_time_s is not None else None,
+            "error": self.error,
+            "stages": [
+                {**asdict(stage), "wall_time_s": round(stage.wall_time_s, 4)}
+                for stage in self.stages.values()
+            ],
+        }
+
+    def merge(self, turn: "TurnMetrics"):
+        """
+        Acumula as métricas de outro turno neste (ex.: um turno por documento, executados em paralelo).
+        Etapas do mesmo agente são somadas; o tempo total não é somado, já que os turnos se sobrepõem.
+
+        Args:
+            turn: Métricas do turno encerrado
+        """
+        self.agent_name = self.agent_name or turn.agent_name
+        self.model_id = self.model_id or turn.model_id
+        self.upload_bytes += turn.upload_bytes
+        if turn.first_event_s is not None:
+            self.first_event_s = turn.first_event_s if self.first_event_s is None else min(self.first_event_s, turn.first_event_s)
+        self.error = self.error or turn.error
+        for author, stage in turn.stages.items():
+            total = self.stages.get(author)
+            if total is None:
+                self.stages[author] = StageMetrics(**asdict(stage))
+                continue
+            total.events += stage.events
+            total.wall_time_s += stage.wall_time_s
+            total.prompt_tokens += stage.prompt_tokens
+            total.response_tokens += stage.response_tokens
+            total.cached_tokens += stage.cached_tokens
+            total.payload_bytes += stage.payload_bytes
+
+    @classmethod
+    def from_dict(cls, data: Dict) -> "TurnMetrics":
+        """
+        Reconstrói as métricas de um turno a partir de `to_dict` (ex.: turnos executados em outro processo).
+
+        Args:
+            data: Métricas do turno em formato serializável
+
+        Returns:
+            TurnMetrics: Métricas do turno (já encerrado)
+        """
+        turn = cls()
+        turn.agent_name = data["agent"]
+        turn.model_id = data["model_id"]
+        turn.upload_bytes = data["upload_bytes"]
+        turn.first_event_s = data["first_event_s"]
+        turn.total_time_s = data["total_time_s"]
+        turn.error = data["error"]
+        turn.stages = {stage["author"]: StageMetrics(**stage) for stage in data["stages"]}
+        return turn
+
+
+class MetricsSink(ABC):
+    """Destino das métricas de cada turno."""
+
+    @abstractmethod
+    def emit(self, turn: TurnMetrics):
+        """
+        Args:
+            turn: Métricas do turno encerrado
+        """
+
+
+class LoggingMetricsSink(MetricsSink):
+    """Registra cada turno como uma linha JSON no log."""
+
+    def emit(self, turn: TurnMetrics):
+        logger.info(json.dumps({"event": "agent_turn_metrics", **turn.to_dict()}, ensure_ascii=False))
+
+
+class PrometheusMetricsSink(MetricsSink):
+    """
+    Exporta as métricas no formato do Prometheus (requer o pacote opcional `prometheus_client`).
+
+    Args:
+        port: Se informado, inicia o servidor HTTP de métricas nessa porta
+    """
+
+    def __init__(self, port: Optional[int] = None):
+        from prometheus_client import Counter, Histogram, start_http_server
+
+        labels = ["agent", "stage", "model_id"]
+        self.stage_latency = Histogram("agent_stage_latency_seconds", "Tempo de relógio por etapa do agente", labels)
+        self.stage_tokens = Counter("agent_stage_tokens_total", "Tokens por etapa do agente", labels + ["kind"])
+        self.turn_latency = Histogram("agent_turn_latency_seconds", "Tempo total do turno", ["agent", "model_id"])
+        self.turn_errors = Counter("agent_turn_errors_total", "Turnos encerrados com erro", ["agent", "model_id"])
+
+        if port is not None:
+            start_http_server(port)
+
+    def emit(self, turn: TurnMetrics):
+        model_id = turn.model_id or ""
+        self.turn_latency.labels(turn.agent_name, model_id).observe(turn.total_time_s)
+        if turn.error:
+            self.turn_errors.labels(turn.agent_name, model_id).inc()
+        for stage in turn.stages.values():
+            labels = (turn.agent_name, stage.author, stage.model_id or "")
+            self.stage_latency.labels(*labels).observe(stage.wall_time_s)
+            self.stage_tokens.labels(*labels, "prompt").inc(stage.prompt_tokens)
+            self.stage_tokens.labels(*labels, "response").inc(stage.response_tokens)
+            self.stage_tokens.labels(*labels, "cached").inc(stage.cached_tokens)
+
+
+_metrics_sinks: Optional[List[MetricsSink]] = None
+_metrics_sinks_lock = threading.Lock()
+
+
+def _default_metrics_sinks() -> List[MetricsSink]:
+    # Log estruturado sempre; Prometheus quando PROMETHEUS_METRICS_PORT estiver definido
+    sinks = [LoggingMetricsSink()]
+    port = os.getenv("PROMETHEUS_METRICS_PORT")
+    if port:
+        try:
+            sinks.append(PrometheusMetricsSink(port=int(port)))
+        except ImportError:
+            logger.warning("PROMETHEUS_METRICS_PORT definido, mas o pacote 'prometheus_client' não está instalado")
+    return sinks
+
+
+def register_metrics_sink(sink: MetricsSink):
+    """
+    Adiciona um coletor às métricas de turno do processo.
+
+    Args:
+        sink: Coletor a ser adicionado
+    """
+    global _metrics_sinks
+    with _metrics_sinks_lock:
+        if _metrics_sinks is None:
+            _metrics_sinks = _default_metrics_sinks()
+        _metrics_sinks.append(sink)
+
+
+def set_metrics_sinks(sinks: List[MetricsSink]):
+    """
+    Substitui os coletores das métricas de turno do processo (ex.: lista vazia nos processos
+    de `worker_pool`, cujas métricas são enviadas ao processo principal).
+
+    Args:
+        sinks: Coletores
+    """
+    global _metrics_sinks
+    with _metrics_sinks_lock:
+        _metrics_sinks = list(sinks)
+
+
+def emit_turn_metrics(turn: TurnMetrics):
+    """
+    Envia as métricas de um turno para todos os coletores registrados.
+
+    Args:
+        turn: Métricas do turno
+    """
+    global _metrics_sinks
+    with _metrics_sinks_lock:
+        if _metrics_sinks is None:
+            _metrics_sinks = _default_metrics_sinks()
+        sinks = list(_metrics_sinks)
+
+    for sink in sinks:
+        try:
+            sink.emit(turn)
+        except Exception as e:
+            logger.warning(f"Falha ao exportar métricas para {type(sink).__name__}: {e}")
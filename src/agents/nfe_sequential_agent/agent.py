@@ -1,5 +1,12 @@
 # from .pydantic_schema import OutputSchema
-from .pydantic_schema import NotaFiscalData, NFeTax
+from .pydantic_schema import NotaFiscalData
+from .icms_calculator import LocalICMSCalculatorAgent
+from .local_extraction import load_nota_fiscal_from_document
+from .report import render_report_without_llm
+from .validation import NFeValidationAgent, normalize_extractor_response
+from .chunked_extraction import extract_in_chunks
+from src.agents.extraction_cache import load_extraction_from_cache
+from src.agents.state_projection import projected_instruction, keep_user_text_only
 from google.adk.agents import LlmAgent, SequentialAgent
 import textwrap
 
@@ -25,7 +32,8 @@ extractor_instruction = textwrap.dedent("""\
     - valor_ICMS: Valor total do ICMS da Nota.
     - produtos: Lista de produtos contidos na nota
     
-    Retorne sua resposta no formato JSON especificado, usando apenas os dados das imagens.""")
+    Retorne sua resposta no formato JSON especificado, usando apenas os dados das imagens.
+    {nfe_validation_hint?}""")
 
 # Definição do Agente
 extractor_agent = LlmAgent(
@@ -36,41 +44,34 @@ extractor_agent = LlmAgent(
     output_schema=NotaFiscalData,
     output_key="nota_fiscal_data",
     disallow_transfer_to_parent=True,
-    disallow_transfer_to_peers=True
+    disallow_transfer_to_peers=True,
+    # XML da NF-e e DANFEs com camada de texto são lidos localmente; só documentos digitalizados chegam ao LLM
+    before_agent_callback=[load_nota_fiscal_from_document, load_extraction_from_cache],
+    # Notas com muitas páginas: cabeçalho uma vez e produtos de cada página em paralelo
+    before_model_callback=extract_in_chunks,
+    # Valores monetários e quantidades são normalizados antes da validação do schema
+    after_model_callback=normalize_extractor_response
+    # Sem after_agent_callback de cache: os dados só são armazenados depois de aprovados pelo nfe_validation_agent
 )
 
-"""Agente Calculador de Impostos da NFe"""
-# Instrução do Agente
-calculator_instruction = textwrap.dedent("""\
-    Você é um especialista no cálculo de impostos relacionados a uma Nota Fiscal Eletrônica (NFe).
-    
-    [CONTEXTO]
-    Dados da Nota Fiscal:
-    ```json
-    {nota_fiscal_data}
-    ```
-    
-    [TAREFA]
-    Calcule o imposto contido nos produtos/serviços da NFe seguindo as seguintes etapas:
-    1 - Calcule a porcentagem do ICMS sobre o valor total da nota.
-    2 - Calcule o valor do ICMS sobre cada produto usando a porcentagem do ICMS calculada na etapa 1.
-    
-    Para cada produto indique:
-    1 - codigo: Código do Produto
-    2 - valor_icms: O valor do ICMS
-    
-    Responda usando o esquema JSON especificado, e utilizando APENAS o contexto dado.""")
+"""Validação da extração (sem LLM)"""
+# Normaliza valores e quantidades, confere as invariantes da nota e, se necessário,
+# pede uma nova extração apenas ao extrator, com a lista dos problemas encontrados
+nfe_validation_agent = NFeValidationAgent(
+    name='validador_de_dados_NFe',
+    description="Normaliza e valida os dados extraídos da Nota Fiscal, repetindo só a extração quando inconsistentes",
+    input_key="nota_fiscal_data",
+    extractor_name=extractor_agent.name,
+    max_repairs=1
+)
 
-# Definição do Agente
-nfe_calculator_agent = LlmAgent(
-    name='calculador_de_imposto_nfe',
-    model="gemini-2.5-flash",
-    description="Calcula o Imposto (ICMS) atribuido a uma Nota Fiscal Eletrônica",
-    instruction=calculator_instruction,
-    output_schema=NFeTax,
-    output_key="icms_result",
-    disallow_transfer_to_parent=True,
-    disallow_transfer_to_peers=True
+"""Calculador local de ICMS (sem LLM)"""
+# O cálculo é feito em Python com Decimal, sem uma chamada ao modelo e com valores em centavos reproduzíveis
+icms_calculator_agent = LocalICMSCalculatorAgent(
+    name='calculador_local_de_imposto_nfe',
+    description="Calcula o Imposto (ICMS) atribuido a uma Nota Fiscal Eletrônica sem uso de LLM",
+    input_key="nota_fiscal_data",
+    output_key="icms_result"
 )
 
 """Agente responsável pela exibição do resultado para o usuário"""
@@ -107,11 +108,27 @@ result_agent = LlmAgent(
     name='exibidor_de_resultado_NFe',
     model="gemini-2.5-flash",
     description="Exibe o resultado do cálculo de ICMS de uma NFe",
-    instruction=result_instruction
+    # Recebe só os campos exibidos (sem quantidade e preço unitário), sem as imagens nem a saída do extrator
+    instruction=projected_instruction(result_instruction, {
+        "nota_fiscal_data": ["destinatario_nome", "valor_total", "valor_ICMS", "produtos.codigo", "produtos.descricao", "produtos.preco_total"],
+        "icms_result": None
+    }),
+    before_model_callback=keep_user_text_only,
+    # O relatório é montado localmente por template, a menos que o usuário peça o resumo narrativo
+    before_agent_callback=render_report_without_llm
 )
 
 """Agente Sequencial - Cria Pipeline sequencial de agentes"""
-# Cria Pipeline sequencial (extração dos dados -> cálculo de impostos)
+# Cria Pipeline sequencial (extração dos dados -> validação -> cálculo de impostos)
 root_agent = SequentialAgent(
-    name="calculador_de_ICMS_NFe", sub_agents=[extractor_agent, nfe_calculator_agent, result_agent]
-)
\ No newline at end of file
+    name="calculador_de_ICMS_NFe", sub_agents=[extractor_agent, nfe_validation_agent, icms_calculator_agent, result_agent]
+)
+
+"""Agentes expostos na interface e na API"""
+# Lido sem importar este módulo (ver src/agents/agent_registry.py); mantenha como literal
+EXPORTED_AGENTS = [
+    {"name": "calculador_de_ICMS_NFe", "attribute": "root_agent", "order": 0,
+     "description": "Extrai os dados de uma Nota Fiscal Eletronica e calcula o ICMS"},
+    {"name": "extrator_de_dados_NFe", "attribute": "extractor_agent", "order": 1,
+     "description": "Extrai os dados de uma Nota Fiscal Eletronica"},
+]
@@ -0,0 +1,199 @@
+import asyncio
+import json
+import logging
+import os
+
+from typing import Dict, List, Optional, Tuple, Type
+
+from google.adk.agents.callback_context import CallbackContext
+from google.adk.models import BaseLlm, LlmRequest, LlmResponse
+from google.genai import types
+from pydantic import BaseModel
+
+from .pydantic_schema import CabecalhoNotaFiscal, ProdutosNotaFiscal
+from src.agents.extraction_cache import get_callback_agent
+from src.agents.image_preprocessing import split_image_tiles
+
+logger = logging.getLogger(__name__)
+
+# Número mínimo de partes (páginas do PDF ou faixas de imagens) para a extração em partes
+# (NFE_CHUNKED_MIN_PARTS; "0" desativa)
+DEFAULT_MIN_CHUNKS = 3
+
+# Chamadas ao modelo em andamento ao mesmo tempo em uma extração em partes
+MAX_PARALLEL_CHUNKS = 8
+
+HEADER_NOTE = (
+    "\n\n[EXTRAÇÃO EM PARTES]\n"
+    "Extraia apenas destinatario_nome, valor_total e valor_ICMS; os produtos são extraídos separadamente."
+)
+
+ITEMS_NOTE = (
+    "\n\n[EXTRAÇÃO EM PARTES]\n"
+    "A imagem enviada é a parte {position} de {total} da Nota Fiscal. Extraia apenas os produtos "
+    "que aparecem nesta parte. Linhas cortadas na borda da imagem podem ser ignoradas."
+)
+
+
+def split_document_chunks(parts: List[types.Part]) -> List[Tuple[types.Part, bool]]:
+    """
+    Separa os documentos da mensagem do usuário em partes para a extração dos produtos:
+    cada página do PDF e cada faixa de uma imagem alta (ver `split_image_tiles`).
+
+    Args:
+        parts: Partes da mensagem do usuário
+
+    Returns:
+        List[Tuple[types.Part, bool]]: Uma parte por página ou faixa, na ordem do documento, e se
+            ela repete o final da parte anterior (faixas seguintes de uma mesma imagem)
+    """
+    chunks = []
+    for part in parts:
+        blob = part.inline_data
+        if blob is None or not blob.data:
+            continue
+        if blob.mime_type == "application/pdf":
+            chunks.append((part, False))
+        elif blob.mime_type and blob.mime_type.startswith("image/"):
+            tiles = split_image_tiles(blob.data)
+            if len(tiles) == 1:
+                chunks.append((part, False))
+            else:
+                chunks.extend(
+                    (types.Part(inline_data=types.Blob(mime_type="image/jpeg", data=tile)), position > 0)
+                    for position, tile in enumerate(tiles)
+                )
+    return chunks
+
+
+def merge_chunk_products(chunk_products: List[List[Dict]], overlaps_previous: Optional[List[bool]] = None) -> List[Dict]:
+    """
+    Junta os produtos extraídos de cada parte. Quando uma parte repete o final da anterior
+    (faixas sobrepostas de uma imagem), os produtos idênticos a um produto da parte anterior
+    são descartados; os demais são mantidos, mesmo com `codigo` repetido (a mesma mercadoria
+    pode aparecer em mais de uma linha da nota, com quantidades ou valores diferentes).
+
+    Args:
+        chunk_products: Produtos de cada parte, na ordem do documento
+        overlaps_previous: Se cada parte repete o final da anterior (padrão: nenhuma, como páginas de um PDF)
+
+    Returns:
+        List[Dict]: Produtos da nota, na ordem em que aparecem
+    """
+    merged = []
+    previous: List[Dict] = []
+    for position, products in enumerate(chunk_products):
+        # Cada produto da parte anterior descarta no máximo uma linha repetida
+        repeatable = list(previous) if overlaps_previous and overlaps_previous[position] else []
+        for product in products:
+            if product in repeatable:
+                repeatable.remove(product)
+                continue
+            merged.append(product)
+        previous = products
+    return merged
+
+
+def _chunk_request(llm_request: LlmRequest, contents: List[types.Content], schema: Type[BaseModel], note: str) -> LlmRequest:
+    # Mesma requisição do extrator (modelo, instrução e configuração), com outro conteúdo e schema de saída
+    config = llm_request.config or types.GenerateContentConfig()
+    system_instruction = config.system_instruction if isinstance(config.system_instruction, str) else ""
+    return llm_request.model_copy(update={
+        "contents": contents,
+        "config": config.model_copy(update={
+            "system_instruction": system_instruction + note,
+            "response_schema": schema,
+            "response_mime_type": "application/json"
+        })
+    })
+
+
+async def _generate(llm: BaseLlm, llm_request: LlmRequest, schema: Type[BaseModel], semaphore: asyncio.Semaphore) -> Tuple[BaseModel, Optional[types.GenerateContentResponseUsageMetadata]]:
+    async with semaphore:
+        response = None
+        async for response in llm.generate_content_async(llm_request, stream=False):
+            pass
+
+    if response is None or response.content is None or not response.content.parts:
+        raise ValueError(f"resposta vazia do modelo ({response.error_message if response else 'sem resposta'})")
+    text = "".join(part.text for part in response.content.parts if part.text and not part.thought)
+    return schema.model_validate(json.loads(text)), response.usage_metadata
+
+
+def _sum_usage(usages: List[Optional[types.GenerateContentResponseUsageMetadata]]) -> types.GenerateContentResponseUsageMetadata:
+    usages = [usage for usage in usages if usage is not None]
+    return types.GenerateContentResponseUsageMetadata(
+        prompt_token_count=sum(usage.prompt_token_count or 0 for usage in usages),
+        candidates_token_count=sum(usage.candidates_token_count or 0 for usage in usages),
+        cached_content_token_count=sum(usage.cached_content_token_count or 0 for usage in usages),
+        total_token_count=sum(usage.total_token_count or 0 for usage in usages)
+    )
+
+
+async def extract_in_chunks(callback_context: CallbackContext, llm_request: LlmRequest) -> Optional[LlmResponse]:
+    """
+    before_model_callback do extrator de NFe: em notas com muitas páginas, extrai o cabeçalho
+    (destinatario_nome, valor_total e valor_ICMS) uma vez e os produtos de cada página ou faixa
+    de imagem em paralelo, juntando tudo em uma única resposta `NotaFiscalData`.
+
+    Evita respostas truncadas pelo limite de tokens de saída em notas com centenas de itens.
+    A resposta segue pelo mesmo caminho da extração normal (normalização, validação do schema,
+    cache e validação das invariantes). Se alguma parte falhar, as demais são canceladas e a
+    extração normal é usada.
+
+    Args:
+        callback_context: Contexto do callback do Google ADK
+        llm_request: Requisição ao modelo montada pelo extrator
+
+    Returns:
+        Optional[LlmResponse]: Resposta com os dados da nota ou None para a extração normal
+    """
+    min_chunks = int(os.getenv("NFE_CHUNKED_MIN_PARTS", DEFAULT_MIN_CHUNKS))
+    user_content = callback_context.user_content
+    if min_chunks <= 0 or user_content is None or not user_content.parts:
+        return None
+
+    chunks = await asyncio.to_thread(split_document_chunks, user_content.parts)
+    if len(chunks) < min_chunks:
+        return None
+
+    agent = get_callback_agent(callback_context)
+    llm = agent.canonical_model
+    text_parts = [part for part in user_content.parts if part.text]
+    semaphore = asyncio.Semaphore(MAX_PARALLEL_CHUNKS)
+    logger.info(f"Extração da Nota Fiscal em {len(chunks)} parte(s) pelo agente {agent.name}")
+
+    header_request = _chunk_request(llm_request, llm_request.contents, CabecalhoNotaFiscal, HEADER_NOTE)
+    item_requests = [
+        _chunk_request(
+            llm_request,
+            [types.Content(role="user", parts=text_parts + [chunk])],
+            ProdutosNotaFiscal,
+            ITEMS_NOTE.format(position=position, total=len(chunks))
+        )
+        for position, (chunk, _) in enumerate(chunks, start=1)
+    ]
+
+    tasks = [asyncio.create_task(_generate(llm, header_request, CabecalhoNotaFiscal, semaphore))]
+    tasks.extend(asyncio.create_task(_generate(llm, request, ProdutosNotaFiscal, semaphore)) for request in item_requests)
+    try:
+        (header, header_usage), *items = await asyncio.gather(*tasks)
+    except Exception as e:
+        # Qualquer falha de uma parte (resposta inválida, erro da API, limite de uso) leva à extração normal
+        logger.warning(f"Extração em partes falhou ({type(e).__name__}: {e}); usando a extração normal")
+        return None
+    finally:
+        # Interrompe as partes ainda em andamento quando uma delas falha ou a execução é cancelada
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    value = header.model_dump()
+    value["produtos"] = merge_chunk_products(
+        [[product.model_dump() for product in page.produtos] for page, _ in items],
+        [overlaps for _, overlaps in chunks]
+    )
+    return LlmResponse(
+        content=types.Content(role="model", parts=[types.Part(text=json.dumps(value, ensure_ascii=False))]),
+        usage_metadata=_sum_usage([header_usage] + [usage for _, usage in items])
+    )
@@ -0,0 +1,115 @@
+import json
+import re
+
+from decimal import Decimal, InvalidOperation, ROUND_HALF_UP
+from typing import AsyncGenerator, Union
+
+from google.adk.agents import BaseAgent
+from google.adk.agents.invocation_context import InvocationContext
+from google.adk.events import Event, EventActions
+
+from .pydantic_schema import NotaFiscalData, NFeTax, ImpostoProduto
+
+# Cálculo determinístico do ICMS de uma Nota Fiscal
+
+CENTAVOS = Decimal("0.01")
+
+# Milhar com ponto sem parte decimal, ex.: "1.234" ou "12.345.678"
+_THOUSANDS_ONLY_PATTERN = re.compile(r"^\d{1,3}(\.\d{3})+$")
+
+
+def parse_brl_decimal(value: Union[str, int, float, Decimal]) -> Decimal:
+    """
+    Converte um valor monetário/numérico para Decimal.
+    Aceita o formato brasileiro ("R$ 1.234,56"), o formato com ponto decimal ("1234.56") e números.
+
+    Args:
+        value: Valor a ser convertido
+
+    Returns:
+        Decimal: Valor exato
+
+    Raises:
+        ValueError: Se o valor não puder ser interpretado como número
+    """
+    if isinstance(value, Decimal):
+        return value
+    if isinstance(value, (int, float)):
+        return Decimal(str(value))
+
+    text = re.sub(r"[^\d,.\-]", "", str(value))
+
+    if "," in text and "." in text:
+        # O último separador é o decimal, o outro é de milhar
+        if text.rfind(",") > text.rfind("."):
+            text = text.replace(".", "").replace(",", ".")
+        else:
+            text = text.replace(",", "")
+    elif "," in text:
+        text = text.replace(".", "").replace(",", ".")
+    elif _THOUSANDS_ONLY_PATTERN.match(text.lstrip("-")):
+        text = text.replace(".", "")
+
+    try:
+        return Decimal(text)
+    except InvalidOperation:
+        raise ValueError(f"Valor numérico inválido: {value!r}")
+
+
+def calculate_icms(nota_fiscal: NotaFiscalData) -> NFeTax:
+    """
+    Calcula a porcentagem do ICMS sobre o valor total da nota e o ICMS proporcional de cada produto.
+
+    O ICMS de cada produto é calculado a partir da razão exata (valor_ICMS / valor_total),
+    e arredondado para centavos apenas no final.
+
+    Args:
+        nota_fiscal: Dados extraídos da Nota Fiscal
+
+    Returns:
+        NFeTax: Porcentagem do ICMS e valor do ICMS por produto
+    """
+    valor_total = parse_brl_decimal(nota_fiscal.valor_total)
+    valor_icms = parse_brl_decimal(nota_fiscal.valor_ICMS)
+
+    aliquota = valor_icms / valor_total if valor_total else Decimal(0)
+
+    imposto_produtos = [
+        ImpostoProduto(
+            codigo=produto.codigo,
+            valor_icms=float((parse_brl_decimal(produto.preco_total) * aliquota).quantize(CENTAVOS, ROUND_HALF_UP))
+        )
+        for produto in nota_fiscal.produtos
+    ]
+
+    return NFeTax(
+        porcentagem_icms=float((aliquota * 100).quantize(CENTAVOS, ROUND_HALF_UP)),
+        imposto_produtos=imposto_produtos
+    )
+
+
+class LocalICMSCalculatorAgent(BaseAgent):
+    """
+    Etapa sem LLM do pipeline de NFe: lê os dados da Nota Fiscal do estado da sessão,
+    calcula o ICMS com `calculate_icms` e grava o resultado no estado.
+    """
+
+    input_key: str = "nota_fiscal_data"
+    output_key: str = "icms_result"
+
+    async def _run_async_impl(self, ctx: InvocationContext) -> AsyncGenerator[Event, None]:
+        nota_fiscal_data = ctx.session.state.get(self.input_key)
+        if nota_fiscal_data is None:
+            raise ValueError(f"Dados da Nota Fiscal ('{self.input_key}') não encontrados no estado da sessão")
+
+        if isinstance(nota_fiscal_data, str):
+            nota_fiscal_data = json.loads(nota_fiscal_data)
+
+        icms_result = calculate_icms(NotaFiscalData.model_validate(nota_fiscal_data))
+
+        yield Event(
+            invocation_id=ctx.invocation_id,
+            author=self.name,
+            branch=ctx.branch,
+            actions=EventActions(state_delta={self.output_key: icms_result.model_dump()})
+        )
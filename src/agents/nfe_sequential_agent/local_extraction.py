@@ -0,0 +1,288 @@
+import asyncio
+import io
+import json
+import logging
+import re
+import unicodedata
+import xml.etree.ElementTree as ElementTree
+
+from decimal import Decimal, InvalidOperation, ROUND_HALF_UP
+from typing import BinaryIO, List, Optional, Set, Union
+
+from google.adk.agents.callback_context import CallbackContext
+from google.genai import types
+from pydantic import ValidationError
+
+from .icms_calculator import parse_brl_decimal, CENTAVOS
+from .pydantic_schema import NotaFiscalData, Produto
+from src.agents.extraction_cache import get_callback_agent
+from src.agents.pdf_ingestion import extract_pdf_text
+
+logger = logging.getLogger(__name__)
+
+# Namespace do leiaute da NF-e
+NFE_NAMESPACE = "{http://www.portalfiscal.inf.br/nfe}"
+
+# Tipos MIME tratados como XML da NF-e
+XML_MIME_TYPES = {"text/xml", "application/xml"}
+
+# Chave do estado com o id da invocação em que os dados da nota foram lidos do próprio documento (sem o LLM)
+LOCAL_EXTRACTION_STATE_KEY = "nota_fiscal_extraida_localmente"
+
+# Campos da DANFE (texto sem acentos, em maiúsculas). O valor pode estar na mesma linha ou na seguinte
+DANFE_VALOR_TOTAL = re.compile(r"VALOR\s+TOTAL\s+DA\s+NOTA\s*:?\s*(?:R\$\s*)?([\d.]+,\d{2})")
+DANFE_VALOR_ICMS = re.compile(r"VALOR\s+DO\s+ICMS\s*:?\s*(?:R\$\s*)?([\d.]+,\d{2})")
+DANFE_DESTINATARIO = re.compile(
+    r"DESTINATARIO\s*/\s*REMETENTE.*?NOME\s*/\s*RAZAO\s+SOCIAL\s*:?\s*\n?\s*(?P<nome>[^\n]+?)\s*(?:\s{2,}|CNPJ|CPF|\n)",
+    re.DOTALL
+)
+
+# Linha de produto da DANFE: código, descrição, NCM, CST, CFOP, unidade, quantidade, valor unitário e valor total
+DANFE_PRODUTO = re.compile(
+    r"^(?P<codigo>\S+)\s+(?P<descricao>.+?)\s+\d{8}\s+\d{3,4}\s+\d{4}\s+[A-Z]{1,6}\s+"
+    r"(?P<quantidade>[\d.]+(?:,\d+)?)\s+(?P<unitario>[\d.]+,\d+)\s+(?P<total>[\d.]+,\d{2})\b",
+    re.MULTILINE
+)
+
+
+def format_brl_decimal(value: Decimal) -> str:
+    """
+    Formata um valor no padrão brasileiro (ex.: Decimal("1234.5") -> "1.234,50").
+
+    Args:
+        value: Valor a formatar
+
+    Returns:
+        str: Valor com separador de milhar "." e decimal ","
+    """
+    return f"{value.quantize(CENTAVOS, ROUND_HALF_UP):,.2f}".replace(",", "_").replace(".", ",").replace("_", ".")
+
+
+def _build_product(codigo: str, descricao: str, quantidade: Decimal, preco_unidade: Decimal, preco_total: Decimal) -> Produto:
+    return Produto(
+        codigo=codigo,
+        descricao=descricao,
+        preco_unidade=float(preco_unidade),
+        quantidade=float(quantidade),
+        preco_total=format_brl_decimal(preco_total)
+    )
+
+
+def _is_consistent(nota_fiscal: NotaFiscalData) -> bool:
+    # Confere quantidade x valor unitário de cada produto, para descartar leituras desalinhadas do texto
+    for produto in nota_fiscal.produtos:
+        quantidade = Decimal(str(produto.quantidade))
+        expected = Decimal(str(produto.preco_unidade)) * quantidade
+        if abs(expected - parse_brl_decimal(produto.preco_total)) > Decimal("0.01") * max(quantidade, 1):
+            return False
+    return bool(nota_fiscal.produtos)
+
+
+def _nfe_tags(name: str) -> Set[str]:
+    # Tag com e sem o namespace do leiaute da NF-e
+    return {f"{NFE_NAMESPACE}{name}", name}
+
+
+INF_NFE_TAGS = _nfe_tags("infNFe")
+DET_TAGS = _nfe_tags("det")
+DEST_TAGS = _nfe_tags("dest")
+ICMS_TOT_TAGS = _nfe_tags("ICMSTot")
+
+
+def _child_text(element, name: str) -> str:
+    for tag in _nfe_tags(name):
+        value = element.findtext(tag)
+        if value is not None and value.strip():
+            return value.strip()
+    raise ValueError(f"Campo obrigatório ausente no XML da NF-e: {_local_tag(element.tag)}/{name}")
+
+
+def _local_tag(tag: str) -> str:
+    # Remove o namespace da tag ("{http://...}prod" -> "prod")
+    return tag.rsplit("}", 1)[-1]
+
+
+def parse_nfe_xml(source: Union[bytes, BinaryIO]) -> NotaFiscalData:
+    """
+    Converte o XML da NF-e (NFe ou nfeProc) nos dados da Nota Fiscal.
+
+    A leitura é incremental (iterparse): cada <det> é convertido em Produto e descartado
+    assim que termina, de modo que notas com milhares de itens não mantêm a árvore XML em memória.
+
+    Args:
+        source: Conteúdo do XML ou arquivo aberto em modo binário
+
+    Returns:
+        NotaFiscalData: Dados da Nota Fiscal
+
+    Raises:
+        ValueError: Se o XML não for uma NF-e válida
+    """
+    if isinstance(source, (bytes, bytearray)):
+        source = io.BytesIO(source)
+
+    inf_nfe = None
+    destinatario_nome = None
+    icms_tot = None
+    produtos = []
+
+    try:
+        for event, element in ElementTree.iterparse(source, events=("start", "end")):
+            if event == "start":
+                if inf_nfe is None and element.tag in INF_NFE_TAGS:
+                    inf_nfe = element
+                continue
+
+            tag = element.tag
+            if tag in DET_TAGS and inf_nfe is not None:
+                prod = element.find(f"{NFE_NAMESPACE}prod")
+                if prod is None:
+                    prod = element.find("prod")
+                if prod is None:
+                    raise ValueError("Campo obrigatório ausente no XML da NF-e: det/prod")
+                produtos.append(_build_product(
+                    codigo=_child_text(prod, "cProd"),
+                    descricao=_child_text(prod, "xProd"),
+                    quantidade=Decimal(_child_text(prod, "qCom")),
+                    preco_unidade=Decimal(_child_text(prod, "vUnCom")),
+                    preco_total=Decimal(_child_text(prod, "vProd"))
+                ))
+                # Item já convertido: descarta o elemento para manter a memória constante
+                inf_nfe.remove(element)
+            elif tag in DEST_TAGS:
+                destinatario_nome = _child_text(element, "xNome")
+            elif tag in ICMS_TOT_TAGS:
+                icms_tot = {name: _child_text(element, name) for name in ("vNF", "vICMS")}
+    except ElementTree.ParseError as e:
+        raise ValueError(f"XML inválido: {e}") from e
+
+    if inf_nfe is None:
+        raise ValueError("O XML não contém uma NF-e (infNFe)")
+    if destinatario_nome is None:
+        raise ValueError("Campo obrigatório ausente no XML da NF-e: dest/xNome")
+    if icms_tot is None:
+        raise ValueError("Campo obrigatório ausente no XML da NF-e: total/ICMSTot")
+
+    return NotaFiscalData(
+        destinatario_nome=destinatario_nome,
+        valor_total=format_brl_decimal(Decimal(icms_tot["vNF"])),
+        valor_ICMS=format_brl_decimal(Decimal(icms_tot["vICMS"])),
+        produtos=produtos
+    )
+
+
+def _fold_char(char: str) -> str:
+    # Remove o acento e converte para maiúscula, mantendo um caractere por caractere do texto
+    folded = "".join(c for c in unicodedata.normalize("NFKD", char) if not unicodedata.combining(c)).upper()
+    return folded if len(folded) == 1 else char
+
+
+def parse_danfe_text(text: str) -> Optional[NotaFiscalData]:
+    """
+    Extrai os dados da Nota Fiscal da camada de texto de uma DANFE gerada digitalmente.
+
+    Args:
+        text: Texto de todas as páginas da DANFE
+
+    Returns:
+        Optional[NotaFiscalData]: Dados da Nota Fiscal, ou None se algum campo não for encontrado
+            ou os produtos lidos forem inconsistentes
+    """
+    # Os rótulos são procurados no texto sem acentos e em maiúsculas; os valores (nome e descrições)
+    # são lidos do texto original nas mesmas posições
+    text = unicodedata.normalize("NFC", text)
+    labels = "".join(_fold_char(char) for char in text)
+
+    valor_total = DANFE_VALOR_TOTAL.search(labels)
+    valor_icms = DANFE_VALOR_ICMS.search(labels)
+    destinatario = DANFE_DESTINATARIO.search(labels)
+    if not (valor_total and valor_icms and destinatario):
+        return None
+
+    try:
+        produtos = []
+        for match in DANFE_PRODUTO.finditer(labels):
+            produtos.append(_build_product(
+                codigo=text[match.start("codigo"):match.end("codigo")],
+                descricao=text[match.start("descricao"):match.end("descricao")].strip(),
+                quantidade=parse_brl_decimal(match.group("quantidade")),
+                preco_unidade=parse_brl_decimal(match.group("unitario")),
+                preco_total=parse_brl_decimal(match.group("total"))
+            ))
+
+        nota_fiscal = NotaFiscalData(
+            destinatario_nome=text[destinatario.start("nome"):destinatario.end("nome")].strip(),
+            valor_total=format_brl_decimal(parse_brl_decimal(valor_total.group(1))),
+            valor_ICMS=format_brl_decimal(parse_brl_decimal(valor_icms.group(1))),
+            produtos=produtos
+        )
+    except (ValueError, InvalidOperation, ValidationError) as e:
+        logger.info(f"Texto da DANFE não pôde ser convertido: {e}")
+        return None
+
+    return nota_fiscal if _is_consistent(nota_fiscal) else None
+
+
+def extract_nota_fiscal(parts: List[types.Part]) -> Optional[NotaFiscalData]:
+    """
+    Extrai localmente os dados da Nota Fiscal das partes da mensagem do usuário: primeiro do XML
+    da NF-e (enviado ou embutido no PDF), depois da camada de texto das páginas do PDF.
+
+    Args:
+        parts: Partes da mensagem do usuário
+
+    Returns:
+        Optional[NotaFiscalData]: Dados da Nota Fiscal, ou None se for preciso usar o modelo
+            (imagens, páginas digitalizadas ou layouts não reconhecidos)
+    """
+    blobs = [part.inline_data for part in parts if part.inline_data and part.inline_data.data]
+
+    for blob in blobs:
+        if blob.mime_type in XML_MIME_TYPES:
+            try:
+                return parse_nfe_xml(blob.data)
+            except (ValueError, InvalidOperation, ValidationError) as e:
+                logger.info(f"XML da NF-e não pôde ser convertido: {e}")
+
+    # Imagens precisam do modelo; cada página do PDF precisa ter camada de texto
+    if not blobs or any(blob.mime_type != "application/pdf" for blob in blobs if blob.mime_type not in XML_MIME_TYPES):
+        return None
+
+    page_texts = []
+    for blob in blobs:
+        if blob.mime_type != "application/pdf":
+            continue
+        page_text = extract_pdf_text(blob.data)
+        if not page_text:
+            return None
+        page_texts.append(page_text)
+
+    return parse_danfe_text("\n".join(page_texts))
+
+
+async def load_nota_fiscal_from_document(callback_context: CallbackContext) -> Optional[types.Content]:
+    """
+    before_agent_callback do extrator de NFe: quando o documento traz o XML da NF-e ou uma
+    DANFE com camada de texto, grava os dados extraídos localmente no `output_key` do agente
+    e pula a chamada ao LLM. Documentos digitalizados seguem para o modelo multimodal.
+
+    Args:
+        callback_context: Contexto do callback do Google ADK
+
+    Returns:
+        Optional[types.Content]: Resposta do agente com os dados extraídos ou None para executar o agente
+    """
+    user_content = callback_context.user_content
+    if user_content is None or not user_content.parts:
+        return None
+
+    nota_fiscal = await asyncio.to_thread(extract_nota_fiscal, user_content.parts)
+    if nota_fiscal is None:
+        return None
+
+    agent = get_callback_agent(callback_context)
+    logger.info(f"Dados da Nota Fiscal extraídos localmente, sem o LLM, para o agente {agent.name}")
+    value = nota_fiscal.model_dump()
+    callback_context.state[agent.output_key] = value
+    callback_context.state[LOCAL_EXTRACTION_STATE_KEY] = callback_context.invocation_id
+    return types.Content(role="model", parts=[types.Part(text=json.dumps(value, ensure_ascii=False))])
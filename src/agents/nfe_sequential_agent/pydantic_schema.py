@@ -5,7 +5,7 @@ class Produto(BaseModel):
     codigo: str = Field(description="Código do Produto")
     descricao: str = Field(description="Descrição do Produto")
     preco_unidade: float = Field(description="Preço da unidade do produto")
-    quantidade: int = Field(description="Quantidade de unidades do Produto")
+    quantidade: float = Field(description="Quantidade do Produto (pode ser fracionária, ex.: 2.5 kg)")
     preco_total: str = Field(description="Preço Total")
 
 class NotaFiscalData(BaseModel):
@@ -20,4 +20,12 @@ class ImpostoProduto(BaseModel):
 
 class NFeTax(BaseModel):
     porcentagem_icms: float = Field(description="Porcentagem do ICMS sobre a NFe")
-    imposto_produtos: List[ImpostoProduto] = Field(description="Lista de Valores sobre os impostos dos produtos") 
\ No newline at end of file
+    imposto_produtos: List[ImpostoProduto] = Field(description="Lista de Valores sobre os impostos dos produtos") 
+
+class CabecalhoNotaFiscal(BaseModel):
+    destinatario_nome: str = Field(description="Nome do destinatário/remetendo")
+    valor_total: str = Field(description="Valor total da nota")
+    valor_ICMS: str = Field(description="Valor do ICMS")
+
+class ProdutosNotaFiscal(BaseModel):
+    produtos: List[Produto] = Field(description="Produtos que aparecem nesta parte da nota")
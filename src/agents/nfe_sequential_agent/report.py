@@ -0,0 +1,80 @@
+import json
+import logging
+
+from pathlib import Path
+from typing import Dict, Optional, Union
+
+from google.adk.agents.callback_context import CallbackContext
+from google.genai import types
+
+from .local_extraction import format_brl_decimal
+from .icms_calculator import parse_brl_decimal
+from src.agents.agent_config import NARRATIVE_STATE_KEY
+from src.agents.templating import render_template
+
+logger = logging.getLogger(__name__)
+
+# Templates Markdown dos relatórios montados sem LLM
+TEMPLATE_DIR = Path(__file__).resolve().parent / "templates"
+
+
+def _as_dict(value: Union[str, Dict]) -> Dict:
+    return json.loads(value) if isinstance(value, str) else value
+
+
+def render_nfe_report(nota_fiscal_data: Union[str, Dict], icms_result: Union[str, Dict]) -> str:
+    """
+    Monta, sem LLM, o relatório em Markdown da Nota Fiscal e do cálculo do ICMS
+    (template `templates/relatorio_nfe.md.j2`).
+
+    Args:
+        nota_fiscal_data: Dados da Nota Fiscal (estado "nota_fiscal_data")
+        icms_result: Resultado do cálculo do ICMS (estado "icms_result")
+
+    Returns:
+        str: Relatório em Markdown
+
+    Raises:
+        ValueError: Se o cálculo do ICMS não tiver um item por produto da nota
+    """
+    nota_fiscal_data = _as_dict(nota_fiscal_data)
+    icms_result = _as_dict(icms_result)
+
+    # `calculate_icms` gera um item por produto, na ordem da nota: o pareamento é por posição,
+    # pois o mesmo código pode aparecer em mais de uma linha com valores diferentes
+    produtos = [
+        {**produto, "valor_icms": f"R$ {format_brl_decimal(parse_brl_decimal(imposto['valor_icms']))}"}
+        for produto, imposto in zip(nota_fiscal_data["produtos"], icms_result["imposto_produtos"], strict=True)
+    ]
+
+    return render_template(
+        TEMPLATE_DIR,
+        "relatorio_nfe.md.j2",
+        nota_fiscal=nota_fiscal_data,
+        porcentagem_icms=format_brl_decimal(parse_brl_decimal(icms_result["porcentagem_icms"])),
+        produtos=produtos
+    )
+
+
+def render_report_without_llm(callback_context: CallbackContext) -> Optional[types.Content]:
+    """
+    before_agent_callback do agente de exibição: a menos que o usuário peça o resumo narrativo
+    (NARRATIVE_STATE_KEY), responde com o relatório montado localmente a partir dos dados já
+    estruturados e pula a chamada ao LLM.
+
+    Args:
+        callback_context: Contexto do callback do Google ADK
+
+    Returns:
+        Optional[types.Content]: Relatório ou None para executar o agente
+    """
+    if callback_context.state.get(NARRATIVE_STATE_KEY):
+        return None
+
+    nota_fiscal_data = callback_context.state.get("nota_fiscal_data")
+    icms_result = callback_context.state.get("icms_result")
+    if nota_fiscal_data is None or icms_result is None:
+        return None
+
+    logger.info("Relatório da NF-e montado localmente, sem o LLM")
+    return types.Content(role="model", parts=[types.Part(text=render_nfe_report(nota_fiscal_data, icms_result))])
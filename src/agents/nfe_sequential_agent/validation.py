@@ -0,0 +1,292 @@
+import json
+import logging
+
+from decimal import Decimal, InvalidOperation
+from typing import Any, AsyncGenerator, Dict, List, Optional, Tuple
+
+from google.adk.agents import BaseAgent
+from google.adk.agents.callback_context import CallbackContext
+from google.adk.agents.invocation_context import InvocationContext
+from google.adk.events import Event, EventActions
+from google.adk.models import LlmResponse
+from google.genai import types
+from pydantic import ValidationError
+
+from .icms_calculator import parse_brl_decimal
+from .local_extraction import LOCAL_EXTRACTION_STATE_KEY, format_brl_decimal
+from .pydantic_schema import NotaFiscalData
+from src.agents.extraction_cache import BYPASS_CACHE_STATE_KEY, discard_extraction, store_extraction
+
+logger = logging.getLogger(__name__)
+
+# Chave do estado com a dica de correção lida pela instrução do extrator ({nfe_validation_hint?})
+VALIDATION_HINT_KEY = "nfe_validation_hint"
+
+# Diferença relativa aceita entre a soma dos produtos e o valor total da nota (frete, descontos e arredondamentos)
+TOTAL_TOLERANCE = Decimal("0.02")
+
+# Número máximo de problemas descritos na dica de correção
+MAX_HINT_PROBLEMS = 5
+
+# Casas decimais das quantidades (a NF-e informa qCom com até 4 casas)
+QUANTITY_PLACES = Decimal("0.0001")
+
+
+def _parse_quantity(value: Any) -> Decimal:
+    quantity = parse_brl_decimal(value).quantize(QUANTITY_PLACES)
+    if quantity < 0:
+        raise ValueError(f"quantidade negativa ({value})")
+    return quantity
+
+
+def normalize_nota_fiscal(data: Dict) -> Tuple[Dict, List[str]]:
+    """
+    Normaliza os campos monetários e de quantidade da saída do extrator
+    (ex.: "R$ 1.234,5" -> "1.234,50", "2,5000" -> 2.5) e completa a quantidade ou o preço
+    unitário ausente a partir dos outros valores do produto.
+
+    Args:
+        data: Dados da Nota Fiscal como gravados pelo extrator
+
+    Returns:
+        Tuple[Dict, List[str]]: Dados normalizados e os problemas que não puderam ser corrigidos
+    """
+    problems = []
+    normalized = dict(data)
+
+    for field in ("valor_total", "valor_ICMS"):
+        try:
+            normalized[field] = format_brl_decimal(parse_brl_decimal(data[field]))
+        except KeyError:
+            problems.append(f"{field} ausente")
+        except (ValueError, InvalidOperation):
+            problems.append(f"{field} inválido ({data[field]!r})")
+
+    produtos = data.get("produtos")
+    if not isinstance(produtos, list) or not produtos:
+        problems.append("lista de produtos ausente ou vazia")
+        produtos = []
+
+    normalized["produtos"] = []
+    for position, produto in enumerate(produtos, start=1):
+        produto = dict(produto) if isinstance(produto, dict) else {}
+        label = f"produto {position} (codigo {produto.get('codigo', '?')})"
+        try:
+            preco_total = parse_brl_decimal(produto["preco_total"])
+            produto["preco_total"] = format_brl_decimal(preco_total)
+            has_quantity = produto.get("quantidade") not in (None, "")
+            has_unit_price = produto.get("preco_unidade") not in (None, "")
+
+            # Quantidade ou preço unitário ausente: deduzido dos outros dois campos
+            if has_quantity:
+                quantidade = _parse_quantity(produto["quantidade"])
+                produto["quantidade"] = float(quantidade)
+            if has_unit_price:
+                preco_unidade = parse_brl_decimal(produto["preco_unidade"])
+                produto["preco_unidade"] = float(preco_unidade)
+
+            if not has_quantity and has_unit_price and preco_unidade:
+                produto["quantidade"] = float(_parse_quantity(preco_total / preco_unidade))
+            elif not has_unit_price and has_quantity and quantidade:
+                produto["preco_unidade"] = float(preco_total / quantidade)
+            elif not (has_quantity and has_unit_price):
+                raise ValueError("quantidade e preco_unidade ausentes")
+        except KeyError as e:
+            problems.append(f"{label}: {e.args[0]} ausente")
+        except (ValueError, InvalidOperation) as e:
+            problems.append(f"{label}: {e}")
+        normalized["produtos"].append(produto)
+
+    return normalized, problems
+
+
+def normalize_extractor_response(callback_context: CallbackContext, llm_response: LlmResponse) -> Optional[LlmResponse]:
+    """
+    after_model_callback do extrator de NFe: normaliza o JSON gerado pelo modelo antes da validação
+    do `output_schema` pelo ADK, para que valores como "1.234,5" ou "2,5000" e quantidades ausentes
+    não interrompam o turno.
+
+    Args:
+        callback_context: Contexto do callback do Google ADK
+        llm_response: Resposta do modelo
+
+    Returns:
+        Optional[LlmResponse]: Resposta com o JSON normalizado ou None para mantê-la
+    """
+    if llm_response.partial or not llm_response.content or not llm_response.content.parts:
+        return None
+
+    text = "".join(part.text for part in llm_response.content.parts if part.text and not part.thought)
+    try:
+        data = json.loads(text)
+    except json.JSONDecodeError:
+        return None
+    if not isinstance(data, dict):
+        return None
+
+    normalized, _ = normalize_nota_fiscal(data)
+    if normalized == data:
+        return None
+
+    content = types.Content(role=llm_response.content.role, parts=[types.Part(text=json.dumps(normalized, ensure_ascii=False))])
+    return llm_response.model_copy(update={"content": content})
+
+
+def check_nota_fiscal(nota_fiscal: NotaFiscalData) -> List[str]:
+    """
+    Confere as invariantes da Nota Fiscal: ICMS não maior que o total, soma dos produtos
+    próxima do valor total e quantidade x preço unitário igual ao preço total de cada produto.
+
+    Args:
+        nota_fiscal: Dados da Nota Fiscal (já normalizados)
+
+    Returns:
+        List[str]: Problemas encontrados (vazia se a nota é consistente)
+    """
+    problems = []
+    valor_total = parse_brl_decimal(nota_fiscal.valor_total)
+    valor_icms = parse_brl_decimal(nota_fiscal.valor_ICMS)
+
+    if valor_icms > valor_total:
+        problems.append(f"valor_ICMS (R$ {nota_fiscal.valor_ICMS}) maior que valor_total (R$ {nota_fiscal.valor_total})")
+
+    soma_produtos = sum((parse_brl_decimal(produto.preco_total) for produto in nota_fiscal.produtos), Decimal(0))
+    if abs(soma_produtos - valor_total) > TOTAL_TOLERANCE * max(valor_total, soma_produtos):
+        problems.append(
+            f"soma de preco_total dos produtos (R$ {format_brl_decimal(soma_produtos)}) "
+            f"difere de valor_total (R$ {nota_fiscal.valor_total})"
+        )
+
+    for position, produto in enumerate(nota_fiscal.produtos, start=1):
+        quantidade = Decimal(str(produto.quantidade))
+        esperado = Decimal(str(produto.preco_unidade)) * quantidade
+        if abs(esperado - parse_brl_decimal(produto.preco_total)) > Decimal("0.01") * max(quantidade, 1):
+            problems.append(
+                f"produto {position} (codigo {produto.codigo}): quantidade x preco_unidade "
+                f"(R$ {format_brl_decimal(esperado)}) difere de preco_total (R$ {produto.preco_total})"
+            )
+
+    return problems
+
+
+def validate_nota_fiscal(data: Any) -> Tuple[Optional[Dict], List[str]]:
+    """
+    Normaliza e valida a saída do extrator no schema `NotaFiscalData` e nas invariantes da nota.
+
+    Args:
+        data: Dados da Nota Fiscal (dicionário ou JSON)
+
+    Returns:
+        Tuple[Optional[Dict], List[str]]: Dados normalizados (None se não couberem no schema) e os problemas encontrados
+    """
+    if isinstance(data, str):
+        try:
+            data = json.loads(data)
+        except json.JSONDecodeError as e:
+            return None, [f"JSON inválido: {e}"]
+    if not isinstance(data, dict):
+        return None, ["dados da Nota Fiscal ausentes"]
+
+    normalized, problems = normalize_nota_fiscal(data)
+    try:
+        nota_fiscal = NotaFiscalData.model_validate(normalized)
+    except ValidationError as e:
+        problems.extend(
+            f"{'.'.join(str(loc) for loc in error['loc'])}: {error['msg']}" for error in e.errors()
+        )
+        return None, list(dict.fromkeys(problems))
+
+    return nota_fiscal.model_dump(), problems + check_nota_fiscal(nota_fiscal)
+
+
+def format_validation_hint(problems: List[str]) -> str:
+    """
+    Monta a dica curta de correção incluída na instrução do extrator na nova tentativa.
+
+    Args:
+        problems: Problemas encontrados na extração anterior
+
+    Returns:
+        str: Dica de correção
+    """
+    lines = [f"- {problem}" for problem in problems[:MAX_HINT_PROBLEMS]]
+    if len(problems) > MAX_HINT_PROBLEMS:
+        lines.append(f"- e mais {len(problems) - MAX_HINT_PROBLEMS} problema(s)")
+    return "\n".join([
+        "",
+        "[CORREÇÃO]",
+        "A extração anterior foi rejeitada na validação:",
+        *lines,
+        "Refaça a extração a partir das imagens, corrigindo esses pontos."
+    ])
+
+
+class NFeValidationAgent(BaseAgent):
+    """
+    Etapa sem LLM do pipeline de NFe, entre o extrator e o cálculo do ICMS: normaliza os dados
+    da Nota Fiscal, confere o schema e as invariantes e, se algo falhar, executa de novo apenas
+    o extrator, com uma dica curta dos problemas na instrução (até `max_repairs` vezes).
+
+    Dados extraídos localmente do próprio documento (XML da NF-e, camada de texto da DANFE) só são
+    normalizados: diferenças como frete e descontos não são erros de leitura e não geram novas tentativas.
+    """
+
+    input_key: str = "nota_fiscal_data"
+    extractor_name: str = "extrator_de_dados_NFe"
+    max_repairs: int = 1
+
+    async def _run_async_impl(self, ctx: InvocationContext) -> AsyncGenerator[Event, None]:
+        extractor = self.root_agent.find_agent(self.extractor_name)
+        repairs = 0
+
+        try:
+            while True:
+                normalized, problems = validate_nota_fiscal(ctx.session.state.get(self.input_key))
+                from_document = ctx.session.state.get(LOCAL_EXTRACTION_STATE_KEY) == ctx.invocation_id
+
+                if not problems or (normalized is not None and from_document) or repairs >= self.max_repairs or extractor is None:
+                    break
+
+                repairs += 1
+                logger.info(f"Extração da Nota Fiscal rejeitada ({len(problems)} problema(s)); nova tentativa {repairs}/{self.max_repairs}")
+                # Remove a saída rejeitada do cache (ex.: entrada gravada por versões anteriores) para não reaproveitá-la
+                await discard_extraction(extractor, ctx.user_content)
+                yield Event(
+                    invocation_id=ctx.invocation_id,
+                    author=self.name,
+                    branch=ctx.branch,
+                    actions=EventActions(state_delta={VALIDATION_HINT_KEY: format_validation_hint(problems), BYPASS_CACHE_STATE_KEY: True})
+                )
+                async for event in extractor.run_async(ctx):
+                    yield event
+
+            if normalized is None:
+                raise ValueError(f"Dados da Nota Fiscal inválidos após {repairs} nova(s) tentativa(s): {'; '.join(problems)}")
+        except Exception:
+            # A dica e o desvio do cache valem só para esta invocação: limpa-os antes de propagar o erro,
+            # para que o próximo turno da sessão (talvez com outra nota) não os herde
+            if repairs:
+                yield Event(
+                    invocation_id=ctx.invocation_id,
+                    author=self.name,
+                    branch=ctx.branch,
+                    actions=EventActions(state_delta={VALIDATION_HINT_KEY: "", BYPASS_CACHE_STATE_KEY: False})
+                )
+            raise
+
+        if problems:
+            # Em dados lidos do próprio documento, diferenças como frete e descontos são esperadas
+            log = logger.info if from_document else logger.warning
+            log(f"Nota Fiscal aceita com inconsistências: {'; '.join(problems)}")
+
+        # Só dados aprovados sem ressalvas vão para o cache; os lidos do próprio documento não precisam dele
+        if not problems and not from_document and extractor is not None:
+            await store_extraction(extractor, ctx.user_content, normalized)
+
+        # Grava os dados normalizados e limpa a dica para os próximos turnos
+        yield Event(
+            invocation_id=ctx.invocation_id,
+            author=self.name,
+            branch=ctx.branch,
+            actions=EventActions(state_delta={self.input_key: normalized, VALIDATION_HINT_KEY: "", BYPASS_CACHE_STATE_KEY: False})
+        )
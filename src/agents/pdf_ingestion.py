@@ -0,0 +1,88 @@
+import io
+import logging
+
+from typing import Iterator, List, Tuple
+
+from pypdf import PdfReader, PdfWriter
+from pypdf.errors import PdfReadError
+
+logger = logging.getLogger(__name__)
+
+# Tamanho mínimo do texto extraído para considerar que a página tem camada de texto (não é digitalizada)
+MIN_TEXT_LAYER_CHARS = 40
+
+
+def split_pdf_pages(pdf_bytes: bytes) -> Iterator[bytes]:
+    """
+    Divide um PDF em PDFs de uma página, gerados um a um conforme são consumidos.
+
+    Se o PDF não puder ser lido, ele é devolvido inteiro (o modelo ainda pode tentar lê-lo).
+
+    Args:
+        pdf_bytes: Bytes do PDF
+
+    Yields:
+        bytes: PDF de cada página
+    """
+    try:
+        reader = PdfReader(io.BytesIO(pdf_bytes))
+        page_count = len(reader.pages)
+    except (PdfReadError, ValueError) as e:
+        logger.warning(f"PDF ilegível, enviado sem divisão: {e}")
+        yield pdf_bytes
+        return
+
+    if page_count == 1:
+        yield pdf_bytes
+        return
+
+    for page in reader.pages:
+        writer = PdfWriter()
+        writer.add_page(page)
+        output = io.BytesIO()
+        writer.write(output)
+        yield output.getvalue()
+
+
+def extract_pdf_attachments(pdf_bytes: bytes, extensions: Tuple[str, ...] = (".xml",)) -> List[Tuple[str, bytes]]:
+    """
+    Retorna os arquivos anexados ao PDF (ex.: o XML da NF-e embutido na DANFE).
+
+    Args:
+        pdf_bytes: Bytes do PDF
+        extensions: Extensões dos anexos desejados
+
+    Returns:
+        List[Tuple[str, bytes]]: Nome e conteúdo de cada anexo
+    """
+    try:
+        attachments = PdfReader(io.BytesIO(pdf_bytes)).attachments
+    except (PdfReadError, ValueError) as e:
+        logger.warning(f"Não foi possível ler os anexos do PDF: {e}")
+        return []
+
+    return [
+        (name, content)
+        for name, contents in attachments.items() if name.lower().endswith(extensions)
+        for content in contents
+    ]
+
+
+def extract_pdf_text(pdf_bytes: bytes) -> str:
+    """
+    Extrai a camada de texto de um PDF, página por página.
+
+    Args:
+        pdf_bytes: Bytes do PDF
+
+    Returns:
+        str: Texto das páginas com camada de texto ("" para PDFs digitalizados ou ilegíveis)
+    """
+    try:
+        reader = PdfReader(io.BytesIO(pdf_bytes))
+        texts = [page.extract_text() or "" for page in reader.pages]
+    except (PdfReadError, ValueError) as e:
+        logger.warning(f"Não foi possível extrair o texto do PDF: {e}")
+        return ""
+
+    return "\n".join(text for text in texts if len(text.strip()) >= MIN_TEXT_LAYER_CHARS)
@@ -0,0 +1,547 @@
+import asyncio
+import contextvars
+import json
+import logging
+import os
+import random
+import re
+import sqlite3
+import threading
+import time
+
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import Callable, Dict, Iterator, Optional, TypeVar
+
+from google.adk.models import LlmRequest
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+# Faixas de prioridade (menor valor = atendido primeiro): o chat passa à frente do lote
+INTERACTIVE_PRIORITY = 0
+BATCH_PRIORITY = 1
+
+# Códigos HTTP de erros temporários (limite de cota ou falha do servidor)
+RETRYABLE_STATUS_CODES = {429, 500, 502, 503, 504}
+
+# Estimativa de tokens da requisição (o uso real é acertado quando a resposta chega)
+CHARS_PER_TOKEN = 4
+TOKENS_PER_INLINE_BLOB = 258
+DEFAULT_OUTPUT_TOKENS = 1024
+
+# Intervalo de nova verificação enquanto a requisição aguarda na fila do limitador
+MIN_POLL_SECONDS = 0.05
+MAX_POLL_SECONDS = 1.0
+
+# Espera registrada no log a partir deste valor
+SLOW_ACQUIRE_SECONDS = 1.0
+
+# Banco com o estado dos limitadores, compartilhado pelos processos da máquina (chat, API, lote e
+# workers do pool) para que todos respeitem uma única cota (GEMINI_RATE_LIMIT_DB; GEMINI_RATE_LIMIT_SHARED=0
+# mantém o estado em memória, por processo)
+DEFAULT_RATE_LIMIT_DB_PATH = os.path.join(".cache", "rate_limits.sqlite3")
+
+# Espera máxima pelo banco do limitador quando outro processo o está atualizando
+SQLITE_TIMEOUT_SECONDS = 5.0
+
+# Atributo marcado nas exceções cujas novas tentativas já foram feitas pela chamada ao modelo (ver gemini_backend)
+RETRIES_EXHAUSTED_ATTRIBUTE = "model_retries_exhausted"
+
+
+@dataclass
+class RateLimit:
+    """
+    Limites de cota de um modelo.
+
+    Attributes:
+        rpm: Requisições por minuto
+        tpm: Tokens (entrada + saída) por minuto
+    """
+    rpm: float
+    tpm: float
+
+
+# Limites de cota por modelo: nenhum por padrão, pois a cota depende do nível da conta do Google AI Studio.
+# São configurados por GEMINI_RATE_LIMITS, ex.: '{"gemini-2.5-flash": {"rpm": 1000, "tpm": 1000000}}'
+DEFAULT_RATE_LIMITS: Dict[str, RateLimit] = {}
+
+# Cotas do nível gratuito dos modelos de DEFAULT_MODELS_PRETTY_NAME (GEMINI_RATE_LIMITS=free)
+FREE_TIER_RATE_LIMITS = {
+    "gemini-2.5-flash": RateLimit(rpm=10, tpm=250_000),
+    "gemini-2.0-flash": RateLimit(rpm=15, tpm=1_000_000),
+}
+
+# Modelo usado quando a cota do modelo do agente se esgota
+MODEL_FALLBACKS = {
+    "gemini-2.5-flash": "gemini-2.0-flash",
+}
+
+_request_priority: contextvars.ContextVar[int] = contextvars.ContextVar("gemini_request_priority", default=INTERACTIVE_PRIORITY)
+
+
+def get_request_priority() -> int:
+    """
+    Returns:
+        int: Faixa de prioridade das chamadas ao modelo feitas no contexto atual
+    """
+    return _request_priority.get()
+
+
+def set_request_priority(priority: int):
+    """
+    Define a faixa de prioridade das chamadas ao modelo feitas a partir da tarefa asyncio atual
+    (e das tarefas que ela criar), ex.: `set_request_priority(BATCH_PRIORITY)` no processamento em lote.
+
+    Args:
+        priority: INTERACTIVE_PRIORITY ou BATCH_PRIORITY
+    """
+    _request_priority.set(priority)
+
+
+@contextmanager
+def request_priority(priority: int) -> Iterator[None]:
+    """
+    Executa o bloco com a faixa de prioridade informada.
+
+    Args:
+        priority: INTERACTIVE_PRIORITY ou BATCH_PRIORITY
+    """
+    token = _request_priority.set(priority)
+    try:
+        yield
+    finally:
+        _request_priority.reset(token)
+
+
+def is_retryable_error(error: Exception) -> bool:
+    """
+    Indica se o erro é temporário (limite de cota ou falha do servidor) e vale uma nova tentativa.
+
+    Args:
+        error: Exceção levantada pela execução do agente
+
+    Returns:
+        bool: True se a chamada deve ser repetida
+    """
+    code = getattr(error, "code", None)
+    if code in RETRYABLE_STATUS_CODES:
+        return True
+    message = str(error)
+    return "RESOURCE_EXHAUSTED" in message or "UNAVAILABLE" in message
+
+
+def mark_retries_exhausted(error: Exception):
+    """
+    Marca um erro temporário que já passou por todas as novas tentativas da chamada ao modelo,
+    para que as camadas acima (ex.: lote) não repitam o documento inteiro pelo mesmo motivo.
+
+    Args:
+        error: Exceção levantada pela chamada ao modelo
+    """
+    try:
+        setattr(error, RETRIES_EXHAUSTED_ATTRIBUTE, True)
+    except AttributeError:
+        pass
+
+
+def retries_exhausted(error: Exception) -> bool:
+    """
+    Args:
+        error: Exceção levantada pela execução do agente
+
+    Returns:
+        bool: True se a chamada ao modelo já repetiu a requisição (ver `mark_retries_exhausted`)
+    """
+    return getattr(error, RETRIES_EXHAUSTED_ATTRIBUTE, False)
+
+
+def is_quota_error(error: Exception) -> bool:
+    """
+    Indica se o erro é de cota esgotada (HTTP 429 / RESOURCE_EXHAUSTED).
+
+    Args:
+        error: Exceção levantada pela chamada ao modelo
+
+    Returns:
+        bool: True se a cota do modelo se esgotou
+    """
+    return getattr(error, "code", None) == 429 or "RESOURCE_EXHAUSTED" in str(error)
+
+
+def retry_delay_from_error(error: Exception) -> Optional[float]:
+    """
+    Lê a espera sugerida pela API (RetryInfo.retryDelay, ex.: "23s") na mensagem do erro.
+
+    Args:
+        error: Exceção levantada pela chamada ao modelo
+
+    Returns:
+        Optional[float]: Segundos a aguardar, ou None se a API não informou
+    """
+    match = re.search(r"retryDelay['\"]?\s*:\s*['\"]?(\d+(?:\.\d+)?)s", str(error))
+    return float(match.group(1)) if match else None
+
+
+def backoff_delay(attempt: int, base_delay: float, max_delay: float) -> float:
+    """
+    Calcula a espera antes da próxima tentativa (exponencial com jitter completo).
+
+    Args:
+        attempt: Número da tentativa que falhou (começando em 1)
+        base_delay: Espera base em segundos
+        max_delay: Espera máxima em segundos
+
+    Returns:
+        float: Segundos a aguardar
+    """
+    return random.uniform(0, min(max_delay, base_delay * (2 ** (attempt - 1))))
+
+
+def estimate_request_tokens(llm_request: LlmRequest) -> int:
+    """
+    Estima os tokens de uma requisição ao modelo (entrada aproximada pelo texto e pelos dados
+    inline, mais a saída máxima configurada).
+
+    Args:
+        llm_request: Requisição ao modelo
+
+    Returns:
+        int: Tokens estimados
+    """
+    tokens = 0
+    for content in llm_request.contents:
+        for part in content.parts or []:
+            if part.text:
+                tokens += len(part.text) // CHARS_PER_TOKEN
+            if part.inline_data:
+                tokens += TOKENS_PER_INLINE_BLOB
+    config = llm_request.config
+    if config is not None and isinstance(config.system_instruction, str):
+        tokens += len(config.system_instruction) // CHARS_PER_TOKEN
+    max_output_tokens = config.max_output_tokens if config is not None else None
+    return tokens + (max_output_tokens or DEFAULT_OUTPUT_TOKENS)
+
+
+class TokenBucket:
+    """
+    Balde de fichas com capacidade `capacity`, reabastecido continuamente a `refill_per_second`.
+    Não é thread-safe; o `ModelRateLimiter` protege o acesso.
+    """
+
+    def __init__(self, capacity: float, refill_per_second: float):
+        self.capacity = capacity
+        self.refill_per_second = refill_per_second
+        self.tokens = capacity
+        self.updated_at = time.monotonic()
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.refill_per_second)
+        self.updated_at = now
+
+    def wait_time(self, amount: float, now: float) -> float:
+        """
+        Args:
+            amount: Fichas necessárias (limitadas à capacidade do balde)
+            now: Instante atual (time.monotonic)
+
+        Returns:
+            float: Segundos até haver fichas suficientes (0 se já houver)
+        """
+        self._refill(now)
+        missing = min(amount, self.capacity) - self.tokens
+        return max(missing, 0) / self.refill_per_second
+
+    def consume(self, amount: float, now: float):
+        self._refill(now)
+        self.tokens -= min(amount, self.capacity)
+
+    def adjust(self, amount: float):
+        # Devolve (positivo) ou cobra (negativo) fichas após o uso real ser conhecido
+        self.tokens = min(self.capacity, self.tokens + amount)
+
+
+class ModelRateLimiter:
+    """
+    Limitador de cota de um modelo: um balde de requisições (RPM) e um de tokens estimados (TPM),
+    com faixas de prioridade. Uma requisição só é liberada quando não há requisições de prioridade
+    maior aguardando, de modo que o chat passa à frente do processamento em lote.
+
+    É compartilhado por todos os event loops e threads do processo; o estado fica em memória
+    (ver `SharedModelRateLimiter` para dividir a cota entre processos).
+    """
+
+    def __init__(self, model_id: str, limit: RateLimit):
+        self.model_id = model_id
+        self.limit = limit
+        self.requests = TokenBucket(limit.rpm, limit.rpm / 60)
+        self.tokens = TokenBucket(limit.tpm, limit.tpm / 60)
+        self.blocked_until = 0.0
+        self._waiting: Dict[int, int] = {}
+        self._waiting_lock = threading.Lock()
+        self._lock = threading.Lock()
+
+    def _now(self) -> float:
+        return time.monotonic()
+
+    @contextmanager
+    def _state(self) -> Iterator[None]:
+        # Acesso exclusivo aos baldes e à suspensão do modelo
+        with self._lock:
+            yield
+
+    async def _offload(self, function: Callable[..., T], *args) -> T:
+        # Estado em memória: a operação é rápida e roda no próprio event loop
+        return function(*args)
+
+    @property
+    def exhausted(self) -> bool:
+        """True enquanto a cota do modelo estiver esgotada (ver `block`)."""
+        with self._state():
+            return self._now() < self.blocked_until
+
+    def _try_acquire(self, tokens: int, priority: int) -> float:
+        # Uma verificação da fila: consome a cota e retorna 0, ou retorna a espera até a próxima verificação
+        with self._state():
+            now = self._now()
+            with self._waiting_lock:
+                ahead = any(count for lane, count in self._waiting.items() if lane < priority)
+            wait = max(
+                self.blocked_until - now,
+                self.requests.wait_time(1, now),
+                self.tokens.wait_time(tokens, now)
+            )
+            if not ahead and wait <= 0:
+                self.requests.consume(1, now)
+                self.tokens.consume(tokens, now)
+                return 0.0
+            return max(wait, MIN_POLL_SECONDS)
+
+    async def acquire(self, tokens: int, priority: int = INTERACTIVE_PRIORITY) -> float:
+        """
+        Aguarda até a requisição caber na cota do modelo e a consome.
+
+        Args:
+            tokens: Tokens estimados da requisição
+            priority: Faixa de prioridade (menor valor = atendido primeiro)
+
+        Returns:
+            float: Segundos aguardados
+        """
+        started = time.monotonic()
+        registered = False
+        try:
+            while True:
+                wait = await self._offload(self._try_acquire, tokens, priority)
+                if wait == 0:
+                    return time.monotonic() - started
+                if not registered:
+                    with self._waiting_lock:
+                        self._waiting[priority] = self._waiting.get(priority, 0) + 1
+                    registered = True
+                await asyncio.sleep(min(wait, MAX_POLL_SECONDS))
+        finally:
+            if registered:
+                with self._waiting_lock:
+                    self._waiting[priority] -= 1
+
+    def settle(self, estimated_tokens: int, actual_tokens: int):
+        """
+        Acerta o balde de tokens com o uso real informado pelo modelo.
+
+        Args:
+            estimated_tokens: Tokens consumidos em `acquire`
+            actual_tokens: Tokens usados (usage_metadata.total_token_count)
+        """
+        with self._state():
+            self.tokens.adjust(estimated_tokens - actual_tokens)
+
+    def block(self, seconds: float):
+        """
+        Suspende as requisições ao modelo após uma resposta de cota esgotada (HTTP 429).
+
+        Args:
+            seconds: Duração da suspensão
+        """
+        with self._state():
+            self.blocked_until = max(self.blocked_until, self._now() + seconds)
+            # A cota informada pela API acabou antes da estimada: esvazia os baldes
+            self.requests.tokens = min(self.requests.tokens, 0)
+
+    async def settle_async(self, estimated_tokens: int, actual_tokens: int):
+        """`settle` para uso em um event loop (ver `SharedModelRateLimiter`)."""
+        await self._offload(self.settle, estimated_tokens, actual_tokens)
+
+    async def block_async(self, seconds: float):
+        """`block` para uso em um event loop (ver `SharedModelRateLimiter`)."""
+        await self._offload(self.block, seconds)
+
+
+class SharedModelRateLimiter(ModelRateLimiter):
+    """
+    `ModelRateLimiter` com os baldes e a suspensão guardados em SQLite, compartilhados por todos
+    os processos que usam o mesmo banco (chat, API, lote e workers do pool), que assim respeitam
+    uma única cota. Cada acesso lê e grava o estado em uma transação exclusiva, executada em uma
+    thread pelos métodos assíncronos, para que a espera pelo banco não trave o event loop.
+
+    As faixas de prioridade valem entre as requisições de um mesmo processo.
+    """
+
+    def __init__(self, model_id: str, limit: RateLimit, db_path: str = DEFAULT_RATE_LIMIT_DB_PATH):
+        super().__init__(model_id, limit)
+        if os.path.dirname(db_path):
+            os.makedirs(os.path.dirname(db_path), exist_ok=True)
+
+        self.db_path = db_path
+        self._connection = sqlite3.connect(db_path, timeout=SQLITE_TIMEOUT_SECONDS, check_same_thread=False, isolation_level=None)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("""
+            CREATE TABLE IF NOT EXISTS rate_limits (
+                model_id TEXT PRIMARY KEY,
+                requests REAL NOT NULL,
+                requests_updated_at REAL NOT NULL,
+                tokens REAL NOT NULL,
+                tokens_updated_at REAL NOT NULL,
+                blocked_until REAL NOT NULL
+            )""")
+
+    async def _offload(self, function: Callable[..., T], *args) -> T:
+        # Transação SQLite fora do event loop: a espera pelo lock de outro processo não trava as outras tarefas
+        return await asyncio.to_thread(function, *args)
+
+    def _now(self) -> float:
+        # Relógio comum aos processos (time.monotonic não é comparável entre processos)
+        return time.time()
+
+    @contextmanager
+    def _state(self) -> Iterator[None]:
+        # Carrega o estado do modelo do banco, bloqueando os outros processos até gravar o resultado
+        with self._lock:
+            self._connection.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._connection.execute(
+                    "SELECT requests, requests_updated_at, tokens, tokens_updated_at, blocked_until FROM rate_limits WHERE model_id = ?",
+                    (self.model_id,)
+                ).fetchone()
+                if row is None:
+                    now = self._now()
+                    row = (self.requests.capacity, now, self.tokens.capacity, now, 0.0)
+                self.requests.tokens, self.requests.updated_at, self.tokens.tokens, self.tokens.updated_at, self.blocked_until = row
+
+                yield
+
+                self._connection.execute(
+                    "INSERT OR REPLACE INTO rate_limits VALUES (?, ?, ?, ?, ?, ?)",
+                    (self.model_id, self.requests.tokens, self.requests.updated_at, self.tokens.tokens, self.tokens.updated_at, self.blocked_until)
+                )
+                self._connection.execute("COMMIT")
+            except BaseException:
+                self._connection.execute("ROLLBACK")
+                raise
+
+
+def is_rate_limit_shared() -> bool:
+    """
+    Returns:
+        bool: True se o estado dos limitadores é compartilhado entre processos (GEMINI_RATE_LIMIT_SHARED, padrão "1")
+    """
+    return os.getenv("GEMINI_RATE_LIMIT_SHARED", "1") != "0"
+
+
+def load_rate_limits() -> Dict[str, RateLimit]:
+    """
+    Carrega os limites de cota por modelo: DEFAULT_RATE_LIMITS sobrescritos por GEMINI_RATE_LIMITS
+    (JSON, ou "free" para as cotas do nível gratuito). Modelos sem limite configurado não passam pelo limitador.
+
+    Com o estado em memória (GEMINI_RATE_LIMIT_SHARED=0), cada processo tem os seus próprios baldes:
+    os workers de `worker_pool` recebem a sua parte dos limites (GEMINI_RATE_LIMIT_PROCESSES), mas
+    processos independentes (chat, API e lote) precisam ter GEMINI_RATE_LIMITS com a sua parte da cota.
+
+    Returns:
+        Dict[str, RateLimit]: Limites por id do modelo
+    """
+    limits = dict(DEFAULT_RATE_LIMITS)
+    overrides = os.getenv("GEMINI_RATE_LIMITS")
+    if overrides == "free":
+        limits.update(FREE_TIER_RATE_LIMITS)
+    elif overrides:
+        for model_id, values in json.loads(overrides).items():
+            limits[model_id] = RateLimit(rpm=float(values["rpm"]), tpm=float(values["tpm"]))
+
+    processes = int(os.getenv("GEMINI_RATE_LIMIT_PROCESSES", 1))
+    if processes > 1 and not is_rate_limit_shared():
+        limits = {model_id: RateLimit(rpm=limit.rpm / processes, tpm=limit.tpm / processes) for model_id, limit in limits.items()}
+    return limits
+
+
+_limiters: Dict[str, ModelRateLimiter] = {}
+_limiters_lock = threading.Lock()
+
+
+def get_rate_limiter(model_id: str) -> Optional[ModelRateLimiter]:
+    """
+    Retorna o limitador compartilhado do modelo, criado na primeira chamada.
+
+    Configuração via ambiente: GEMINI_RATE_LIMITS_ENABLED ("0" desativa), GEMINI_RATE_LIMITS,
+    GEMINI_RATE_LIMIT_SHARED ("0" mantém o estado por processo) e GEMINI_RATE_LIMIT_DB.
+
+    Args:
+        model_id: Id do modelo (ex.: "gemini-2.5-flash")
+
+    Returns:
+        Optional[ModelRateLimiter]: Limitador, ou None se desativado ou sem limite configurado para o modelo
+    """
+    if os.getenv("GEMINI_RATE_LIMITS_ENABLED", "1") == "0":
+        return None
+
+    with _limiters_lock:
+        limiter = _limiters.get(model_id)
+        if limiter is None:
+            limit = load_rate_limits().get(model_id)
+            if limit is None:
+                return None
+            if is_rate_limit_shared():
+                limiter = SharedModelRateLimiter(model_id, limit, os.getenv("GEMINI_RATE_LIMIT_DB", DEFAULT_RATE_LIMIT_DB_PATH))
+            else:
+                limiter = ModelRateLimiter(model_id, limit)
+            _limiters[model_id] = limiter
+        return limiter
+
+
+def select_model(model_id: str) -> str:
+    """
+    Escolhe o modelo da próxima chamada: o do agente ou, se a sua cota estiver esgotada,
+    o modelo de MODEL_FALLBACKS (desde que a cota dele não esteja esgotada também).
+
+    Args:
+        model_id: Modelo configurado no agente
+
+    Returns:
+        str: Modelo a ser chamado
+    """
+    limiter = get_rate_limiter(model_id)
+    fallback = MODEL_FALLBACKS.get(model_id)
+    if limiter is None or not limiter.exhausted or fallback is None:
+        return model_id
+
+    fallback_limiter = get_rate_limiter(fallback)
+    if fallback_limiter is not None and fallback_limiter.exhausted:
+        return model_id
+    return fallback
+
+
+async def select_model_async(model_id: str) -> str:
+    """
+    `select_model` para uso em um event loop: com o estado compartilhado, a consulta ao banco
+    (e a criação dos limitadores) roda em uma thread.
+
+    Args:
+        model_id: Modelo configurado no agente
+
+    Returns:
+        str: Modelo a ser chamado
+    """
+    if is_rate_limit_shared():
+        return await asyncio.to_thread(select_model, model_id)
+    return select_model(model_id)
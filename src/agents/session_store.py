@@ -0,0 +1,510 @@
+import asyncio
+import copy
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+import uuid
+
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+from google.adk.events import Event
+from google.adk.sessions import BaseSessionService, Session
+from google.adk.sessions.base_session_service import GetSessionConfig, ListSessionsResponse
+from google.adk.sessions.state import State
+from google.genai import types
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SESSION_DB_PATH = os.path.join(".cache", "sessions.sqlite3")
+DEFAULT_BLOB_DIR = os.path.join(".cache", "blobs")
+
+# Histórico enviado ao modelo: últimos eventos e turnos do usuário cujos arquivos são reenviados
+DEFAULT_MAX_HISTORY_EVENTS = 40
+DEFAULT_BLOB_HISTORY_TURNS = 1
+
+# Sessões sem atividade por mais tempo que isso são removidas (verificado a cada intervalo)
+DEFAULT_IDLE_TTL_SECONDS = 24 * 60 * 60
+DEFAULT_EVICTION_INTERVAL_SECONDS = 5 * 60
+
+# Prefixo das referências aos arquivos guardados fora do banco (em `file_data.file_uri`)
+BLOB_URI_PREFIX = "blob://"
+
+
+class BlobStore:
+    """
+    Armazena arquivos (imagens, PDFs, XML) em disco, endereçados pelo SHA-256 do conteúdo.
+    Conteúdos repetidos são gravados uma única vez.
+    """
+
+    def __init__(self, root_dir: str = DEFAULT_BLOB_DIR):
+        self.root_dir = root_dir
+        os.makedirs(root_dir, exist_ok=True)
+        self._last_prune = 0.0
+        self._prune_lock = threading.Lock()
+
+    def _path(self, digest: str) -> str:
+        return os.path.join(self.root_dir, digest[:2], digest)
+
+    def put(self, data: bytes) -> str:
+        """
+        Grava um arquivo (se ainda não existir).
+
+        Args:
+            data: Conteúdo do arquivo
+
+        Returns:
+            str: SHA-256 do conteúdo (identificador do arquivo)
+        """
+        digest = hashlib.sha256(data).hexdigest()
+        path = self._path(digest)
+        if os.path.exists(path):
+            # Renova a data do arquivo para `prune` considerar o uso mais recente
+            os.utime(path)
+        else:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # Grava em um arquivo temporário e renomeia, para nunca expor um arquivo incompleto
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+            with os.fdopen(fd, "wb") as tmp_file:
+                tmp_file.write(data)
+            os.replace(tmp_path, path)
+        return digest
+
+    def get(self, digest: str) -> Optional[bytes]:
+        """
+        Lê um arquivo.
+
+        Args:
+            digest: Identificador retornado por `put`
+
+        Returns:
+            Optional[bytes]: Conteúdo ou None se o arquivo não existir
+        """
+        try:
+            with open(self._path(digest), "rb") as blob_file:
+                return blob_file.read()
+        except FileNotFoundError:
+            return None
+
+    def delete(self, digest: str):
+        """Remove um arquivo (se existir)."""
+        try:
+            os.remove(self._path(digest))
+        except FileNotFoundError:
+            pass
+
+    def prune(self, max_age_seconds: float) -> int:
+        """
+        Remove os arquivos gravados há mais de `max_age_seconds`.
+
+        Args:
+            max_age_seconds: Idade máxima dos arquivos
+
+        Returns:
+            int: Número de arquivos removidos
+        """
+        cutoff = time.time() - max_age_seconds
+        removed = 0
+        for directory, _, file_names in os.walk(self.root_dir):
+            for file_name in file_names:
+                path = os.path.join(directory, file_name)
+                try:
+                    if os.path.getmtime(path) < cutoff:
+                        os.remove(path)
+                        removed += 1
+                except FileNotFoundError:
+                    pass
+        return removed
+
+    def maybe_prune(self, max_age_seconds: float, interval_seconds: float = DEFAULT_EVICTION_INTERVAL_SECONDS) -> int:
+        """
+        Executa `prune` se a última execução foi há mais de `interval_seconds`; pode ser chamado
+        a cada uso do armazenamento (mesmo intervalo da remoção de sessões inativas).
+
+        Args:
+            max_age_seconds: Idade máxima dos arquivos
+            interval_seconds: Intervalo mínimo entre duas execuções
+
+        Returns:
+            int: Número de arquivos removidos (0 se não executou)
+        """
+        now = time.time()
+        with self._prune_lock:
+            if now - self._last_prune < interval_seconds:
+                return 0
+            self._last_prune = now
+
+        removed = self.prune(max_age_seconds)
+        if removed:
+            logger.info(f"{removed} arquivo(s) antigo(s) removido(s) de {self.root_dir}")
+        return removed
+
+
+def _merge_state(app_state: Dict, user_state: Dict, session_state: Dict) -> Dict:
+    # Estado visto pelos agentes: estado da sessão + prefixos "app:" e "user:"
+    merged = copy.deepcopy(session_state)
+    merged.update({State.APP_PREFIX + key: value for key, value in app_state.items()})
+    merged.update({State.USER_PREFIX + key: value for key, value in user_state.items()})
+    return merged
+
+
+def _split_state_delta(state_delta: Dict) -> Dict[str, Dict]:
+    # Separa o delta de estado em app/user/sessão (chaves "temp:" não são persistidas)
+    deltas = {"app": {}, "user": {}, "session": {}}
+    for key, value in (state_delta or {}).items():
+        if key.startswith(State.APP_PREFIX):
+            deltas["app"][key.removeprefix(State.APP_PREFIX)] = value
+        elif key.startswith(State.USER_PREFIX):
+            deltas["user"][key.removeprefix(State.USER_PREFIX)] = value
+        elif not key.startswith(State.TEMP_PREFIX):
+            deltas["session"][key] = value
+    return deltas
+
+
+class SQLiteSessionService(BaseSessionService):
+    """
+    Serviço de sessões persistente (SQLite), com os arquivos dos eventos guardados fora do banco.
+
+    A cada `get_session` (feito pelo Runner antes de cada turno), o histórico é limitado aos
+    últimos `max_history_events` eventos, e apenas os arquivos dos últimos `blob_history_turns`
+    turnos do usuário são recarregados; nos anteriores, o arquivo é substituído por um aviso
+    em texto. Assim, o tamanho do prompt e a memória do processo não crescem com a conversa.
+    Os dados extraídos continuam disponíveis no estado da sessão.
+
+    Sessões sem atividade por mais de `idle_ttl_seconds` são removidas periodicamente.
+    """
+
+    def __init__(
+        self,
+        db_path: str = DEFAULT_SESSION_DB_PATH,
+        blob_store: Optional[BlobStore] = None,
+        max_history_events: Optional[int] = DEFAULT_MAX_HISTORY_EVENTS,
+        blob_history_turns: int = DEFAULT_BLOB_HISTORY_TURNS,
+        idle_ttl_seconds: Optional[float] = DEFAULT_IDLE_TTL_SECONDS,
+        eviction_interval_seconds: float = DEFAULT_EVICTION_INTERVAL_SECONDS,
+    ):
+        if os.path.dirname(db_path):
+            os.makedirs(os.path.dirname(db_path), exist_ok=True)
+
+        self.db_path = db_path
+        self.blob_store = blob_store or BlobStore(os.path.join(os.path.dirname(db_path) or ".", "blobs"))
+        self.max_history_events = max_history_events
+        self.blob_history_turns = blob_history_turns
+        self.idle_ttl_seconds = idle_ttl_seconds
+        self.eviction_interval_seconds = eviction_interval_seconds
+        self._last_eviction = 0.0
+
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(db_path, check_same_thread=False)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.executescript("""
+            CREATE TABLE IF NOT EXISTS sessions (
+                app_name TEXT NOT NULL,
+                user_id TEXT NOT NULL,
+                id TEXT NOT NULL,
+                state TEXT NOT NULL,
+                last_update_time REAL NOT NULL,
+                PRIMARY KEY (app_name, user_id, id)
+            );
+            CREATE INDEX IF NOT EXISTS idx_sessions_last_update ON sessions (last_update_time);
+            CREATE TABLE IF NOT EXISTS app_states (
+                app_name TEXT PRIMARY KEY,
+                state TEXT NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS user_states (
+                app_name TEXT NOT NULL,
+                user_id TEXT NOT NULL,
+                state TEXT NOT NULL,
+                PRIMARY KEY (app_name, user_id)
+            );
+            CREATE TABLE IF NOT EXISTS events (
+                seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                app_name TEXT NOT NULL,
+                user_id TEXT NOT NULL,
+                session_id TEXT NOT NULL,
+                timestamp REAL NOT NULL,
+                data TEXT NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_events_session ON events (app_name, user_id, session_id, seq);
+            CREATE TABLE IF NOT EXISTS event_blobs (
+                app_name TEXT NOT NULL,
+                user_id TEXT NOT NULL,
+                session_id TEXT NOT NULL,
+                digest TEXT NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_event_blobs_session ON event_blobs (app_name, user_id, session_id);
+            CREATE INDEX IF NOT EXISTS idx_event_blobs_digest ON event_blobs (digest);
+        """)
+        self._connection.commit()
+
+    # --- Estado ---
+
+    def _load_state(self, table: str, where: str, params: tuple) -> Dict:
+        row = self._connection.execute(f"SELECT state FROM {table} WHERE {where}", params).fetchone()
+        return json.loads(row[0]) if row else {}
+
+    def _merged_state(self, app_name: str, user_id: str, session_state: Dict) -> Dict:
+        return _merge_state(
+            self._load_state("app_states", "app_name = ?", (app_name,)),
+            self._load_state("user_states", "app_name = ? AND user_id = ?", (app_name, user_id)),
+            session_state
+        )
+
+    def _apply_state_deltas(self, app_name: str, user_id: str, deltas: Dict[str, Dict]):
+        if deltas["app"]:
+            state = self._load_state("app_states", "app_name = ?", (app_name,)) | deltas["app"]
+            self._connection.execute(
+                "INSERT OR REPLACE INTO app_states (app_name, state) VALUES (?, ?)",
+                (app_name, json.dumps(state, ensure_ascii=False))
+            )
+        if deltas["user"]:
+            state = self._load_state("user_states", "app_name = ? AND user_id = ?", (app_name, user_id)) | deltas["user"]
+            self._connection.execute(
+                "INSERT OR REPLACE INTO user_states (app_name, user_id, state) VALUES (?, ?, ?)",
+                (app_name, user_id, json.dumps(state, ensure_ascii=False))
+            )
+
+    # --- Eventos e arquivos ---
+
+    def _store_event_blobs(self, event: Event) -> Tuple[Event, List[str]]:
+        # Substitui os dados inline do evento por referências aos arquivos gravados no BlobStore
+        if not event.content or not any(part.inline_data and part.inline_data.data for part in event.content.parts or []):
+            return event, []
+
+        stored = event.model_copy(deep=True)
+        digests = []
+        for index, part in enumerate(stored.content.parts):
+            if part.inline_data and part.inline_data.data:
+                digest = self.blob_store.put(part.inline_data.data)
+                digests.append(digest)
+                stored.content.parts[index] = types.Part(
+                    file_data=types.FileData(file_uri=BLOB_URI_PREFIX + digest, mime_type=part.inline_data.mime_type)
+                )
+        return stored, digests
+
+    def _load_event_blobs(self, event: Event, rehydrate: bool) -> Event:
+        # Recarrega os arquivos do evento, ou os substitui por um aviso em texto
+        if not event.content or not event.content.parts:
+            return event
+
+        for index, part in enumerate(event.content.parts):
+            file_data = part.file_data
+            if not file_data or not (file_data.file_uri or "").startswith(BLOB_URI_PREFIX):
+                continue
+            data = self.blob_store.get(file_data.file_uri.removeprefix(BLOB_URI_PREFIX)) if rehydrate else None
+            if data is not None:
+                event.content.parts[index] = types.Part(inline_data=types.Blob(mime_type=file_data.mime_type, data=data))
+            else:
+                event.content.parts[index] = types.Part(
+                    text=f"[Arquivo ({file_data.mime_type}) enviado anteriormente, omitido do histórico]"
+                )
+        return event
+
+    def _align_history(self, events: List[Event]) -> List[Event]:
+        # Começa o histórico truncado em uma mensagem do usuário (sem separar chamadas de ferramentas)
+        for index, event in enumerate(events):
+            if event.author == "user":
+                return events[index:]
+        return events
+
+    def _delete_orphan_blobs(self, digests: Set[str]):
+        # Remove os arquivos que não são mais referenciados por nenhuma sessão
+        for digest in digests:
+            referenced = self._connection.execute("SELECT 1 FROM event_blobs WHERE digest = ? LIMIT 1", (digest,)).fetchone()
+            if referenced is None:
+                self.blob_store.delete(digest)
+
+    def _delete_session_rows(self, app_name: str, user_id: str, session_id: str) -> Set[str]:
+        key = (app_name, user_id, session_id)
+        digests = {
+            row[0] for row in self._connection.execute(
+                "SELECT digest FROM event_blobs WHERE app_name = ? AND user_id = ? AND session_id = ?", key
+            )
+        }
+        self._connection.execute("DELETE FROM event_blobs WHERE app_name = ? AND user_id = ? AND session_id = ?", key)
+        self._connection.execute("DELETE FROM events WHERE app_name = ? AND user_id = ? AND session_id = ?", key)
+        self._connection.execute("DELETE FROM sessions WHERE app_name = ? AND user_id = ? AND id = ?", key)
+        return digests
+
+    # --- Operações síncronas (executadas fora do event loop) ---
+
+    def _create_session(self, app_name: str, user_id: str, state: Optional[Dict], session_id: Optional[str]) -> Session:
+        session_id = session_id.strip() if session_id and session_id.strip() else str(uuid.uuid4())
+        deltas = _split_state_delta(state)
+        now = time.time()
+
+        with self._lock:
+            exists = self._connection.execute(
+                "SELECT 1 FROM sessions WHERE app_name = ? AND user_id = ? AND id = ?", (app_name, user_id, session_id)
+            ).fetchone()
+            if exists:
+                raise ValueError(f"Sessão já existe: {session_id}")
+
+            self._apply_state_deltas(app_name, user_id, deltas)
+            self._connection.execute(
+                "INSERT INTO sessions (app_name, user_id, id, state, last_update_time) VALUES (?, ?, ?, ?, ?)",
+                (app_name, user_id, session_id, json.dumps(deltas["session"], ensure_ascii=False), now)
+            )
+            self._connection.commit()
+            merged_state = self._merged_state(app_name, user_id, deltas["session"])
+
+        return Session(app_name=app_name, user_id=user_id, id=session_id, state=merged_state, last_update_time=now)
+
+    def _get_session(self, app_name: str, user_id: str, session_id: str, config: Optional[GetSessionConfig]) -> Optional[Session]:
+        key = (app_name, user_id, session_id)
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT state, last_update_time FROM sessions WHERE app_name = ? AND user_id = ? AND id = ?", key
+            ).fetchone()
+            if row is None:
+                return None
+
+            where = "app_name = ? AND user_id = ? AND session_id = ?"
+            params = list(key)
+            if config and config.after_timestamp:
+                where += " AND timestamp >= ?"
+                params.append(config.after_timestamp)
+
+            limit = config.num_recent_events if config and config.num_recent_events else self.max_history_events
+            if limit:
+                # Lê apenas a cauda do histórico
+                rows = self._connection.execute(
+                    f"SELECT data FROM (SELECT seq, data FROM events WHERE {where} ORDER BY seq DESC LIMIT ?) ORDER BY seq ASC",
+                    (*params, limit)
+                ).fetchall()
+            else:
+                rows = self._connection.execute(f"SELECT data FROM events WHERE {where} ORDER BY seq ASC", params).fetchall()
+
+            state = self._merged_state(app_name, user_id, json.loads(row[0]))
+
+        events = [Event.model_validate_json(data) for (data,) in rows]
+        if limit and len(events) == limit and not (config and config.num_recent_events):
+            events = self._align_history(events)
+
+        # Apenas os arquivos dos últimos turnos do usuário são recarregados
+        user_turns = 0
+        for event in reversed(events):
+            if event.author == "user":
+                user_turns += 1
+            self._load_event_blobs(event, rehydrate=user_turns <= self.blob_history_turns)
+
+        return Session(app_name=app_name, user_id=user_id, id=session_id, state=state, events=events, last_update_time=row[1])
+
+    def _list_sessions(self, app_name: str, user_id: Optional[str]) -> ListSessionsResponse:
+        with self._lock:
+            if user_id is None:
+                rows = self._connection.execute(
+                    "SELECT user_id, id, state, last_update_time FROM sessions WHERE app_name = ?", (app_name,)
+                ).fetchall()
+            else:
+                rows = self._connection.execute(
+                    "SELECT user_id, id, state, last_update_time FROM sessions WHERE app_name = ? AND user_id = ?", (app_name, user_id)
+                ).fetchall()
+            sessions = [
+                Session(
+                    app_name=app_name,
+                    user_id=row_user_id,
+                    id=session_id,
+                    state=self._merged_state(app_name, row_user_id, json.loads(state)),
+                    last_update_time=last_update_time
+                )
+                for row_user_id, session_id, state, last_update_time in rows
+            ]
+        return ListSessionsResponse(sessions=sessions)
+
+    def _delete_session(self, app_name: str, user_id: str, session_id: str):
+        with self._lock:
+            digests = self._delete_session_rows(app_name, user_id, session_id)
+            self._connection.commit()
+            self._delete_orphan_blobs(digests)
+
+    def _append_event(self, session: Session, event: Event):
+        stored_event, digests = self._store_event_blobs(event)
+        deltas = _split_state_delta(event.actions.state_delta if event.actions else None)
+        key = (session.app_name, session.user_id, session.id)
+
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT state FROM sessions WHERE app_name = ? AND user_id = ? AND id = ?", key
+            ).fetchone()
+            if row is None:
+                raise ValueError(f"Sessão não encontrada: {session.id}")
+
+            self._apply_state_deltas(session.app_name, session.user_id, deltas)
+            session_state = json.loads(row[0]) | deltas["session"]
+            self._connection.execute(
+                "UPDATE sessions SET state = ?, last_update_time = ? WHERE app_name = ? AND user_id = ? AND id = ?",
+                (json.dumps(session_state, ensure_ascii=False), event.timestamp, *key)
+            )
+            self._connection.execute(
+                "INSERT INTO events (app_name, user_id, session_id, timestamp, data) VALUES (?, ?, ?, ?, ?)",
+                (*key, event.timestamp, stored_event.model_dump_json(exclude_none=True))
+            )
+            self._connection.executemany(
+                "INSERT INTO event_blobs (app_name, user_id, session_id, digest) VALUES (?, ?, ?, ?)",
+                [(*key, digest) for digest in digests]
+            )
+            self._connection.commit()
+
+    def evict_idle_sessions(self, max_idle_seconds: Optional[float] = None) -> int:
+        """
+        Remove as sessões sem atividade (e os arquivos que só elas referenciavam).
+
+        Args:
+            max_idle_seconds: Tempo máximo sem atividade (padrão: `idle_ttl_seconds`)
+
+        Returns:
+            int: Número de sessões removidas
+        """
+        max_idle_seconds = self.idle_ttl_seconds if max_idle_seconds is None else max_idle_seconds
+        if max_idle_seconds is None:
+            return 0
+
+        with self._lock:
+            idle_sessions = self._connection.execute(
+                "SELECT app_name, user_id, id FROM sessions WHERE last_update_time < ?", (time.time() - max_idle_seconds,)
+            ).fetchall()
+            digests = set()
+            for app_name, user_id, session_id in idle_sessions:
+                digests |= self._delete_session_rows(app_name, user_id, session_id)
+            self._connection.commit()
+            self._delete_orphan_blobs(digests)
+
+        if idle_sessions:
+            logger.info(f"{len(idle_sessions)} sessão(ões) inativa(s) removida(s)")
+        return len(idle_sessions)
+
+    def _maybe_evict_idle_sessions(self):
+        now = time.time()
+        if now - self._last_eviction >= self.eviction_interval_seconds:
+            self._last_eviction = now
+            self.evict_idle_sessions()
+
+    # --- Interface do BaseSessionService ---
+
+    async def create_session(self, *, app_name: str, user_id: str, state: Optional[Dict[str, Any]] = None, session_id: Optional[str] = None) -> Session:
+        await asyncio.to_thread(self._maybe_evict_idle_sessions)
+        return await asyncio.to_thread(self._create_session, app_name, user_id, state, session_id)
+
+    async def get_session(self, *, app_name: str, user_id: str, session_id: str, config: Optional[GetSessionConfig] = None) -> Optional[Session]:
+        return await asyncio.to_thread(self._get_session, app_name, user_id, session_id, config)
+
+    async def list_sessions(self, *, app_name: str, user_id: Optional[str] = None) -> ListSessionsResponse:
+        return await asyncio.to_thread(self._list_sessions, app_name, user_id)
+
+    async def delete_session(self, *, app_name: str, user_id: str, session_id: str) -> None:
+        await asyncio.to_thread(self._delete_session, app_name, user_id, session_id)
+
+    async def append_event(self, session: Session, event: Event) -> Event:
+        if event.partial:
+            return event
+        event = self._trim_temp_delta_state(event)
+        await asyncio.to_thread(self._append_event, session, event)
+        # Atualiza também a sessão em memória usada no turno atual
+        await super().append_event(session=session, event=event)
+        session.last_update_time = event.timestamp
+        return event
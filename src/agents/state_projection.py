@@ -0,0 +1,121 @@
+import json
+import logging
+
+from typing import Any, Callable, Dict, List, Optional
+
+from google.adk.agents.callback_context import CallbackContext
+from google.adk.agents.readonly_context import ReadonlyContext
+from google.adk.models import LlmRequest, LlmResponse
+from google.genai import types
+
+logger = logging.getLogger(__name__)
+
+# Texto enviado no lugar de uma mensagem do usuário que só tinha arquivos
+ATTACHMENT_PLACEHOLDER = "[documento enviado]"
+
+
+def _field_tree(fields: List[str]) -> Dict[str, Dict]:
+    # ["valor_total", "produtos.codigo"] -> {"valor_total": {}, "produtos": {"codigo": {}}}
+    tree: Dict[str, Dict] = {}
+    for field in fields:
+        node = tree
+        for name in field.split("."):
+            node = node.setdefault(name, {})
+    return tree
+
+
+def _project(value: Any, tree: Dict[str, Dict]) -> Any:
+    if not tree:
+        return value
+    if isinstance(value, list):
+        return [_project(item, tree) for item in value]
+    if isinstance(value, dict):
+        return {name: _project(value[name], subtree) for name, subtree in tree.items() if name in value}
+    return value
+
+
+def project_state_value(value: Any, fields: Optional[List[str]] = None) -> Any:
+    """
+    Mantém apenas os campos pedidos de um valor do estado da sessão. Campos de itens de listas
+    são indicados com ponto (ex.: "produtos.codigo" mantém só o código de cada produto).
+
+    Args:
+        value: Valor do estado (dicionário, lista ou JSON)
+        fields: Campos mantidos, ou None para manter o valor inteiro
+
+    Returns:
+        Any: Valor projetado
+    """
+    if isinstance(value, str):
+        try:
+            value = json.loads(value)
+        except json.JSONDecodeError:
+            return value
+    return _project(value, _field_tree(fields or []))
+
+
+def format_state_value(value: Any) -> str:
+    """
+    Args:
+        value: Valor projetado
+
+    Returns:
+        str: JSON compacto (sem espaços nem indentação) para a instrução do agente
+    """
+    if isinstance(value, str):
+        return value
+    return json.dumps(value, ensure_ascii=False, separators=(",", ":"), default=str)
+
+
+def projected_instruction(template: str, projections: Dict[str, Optional[List[str]]]) -> Callable[[ReadonlyContext], str]:
+    """
+    Cria a instrução de um agente que recebe do estado da sessão apenas os campos de que precisa,
+    em vez do JSON completo de cada etapa anterior (ex.: o cálculo do ICMS usa só códigos e totais).
+
+    Os marcadores `{chave}` das chaves em `projections` são substituídos pelo valor projetado;
+    o restante da instrução é mantido como está (a injeção de estado do ADK não é aplicada).
+
+    Args:
+        template: Texto da instrução com os marcadores das chaves do estado
+        projections: Chave do estado: campos mantidos (None para o valor inteiro)
+
+    Returns:
+        Callable[[ReadonlyContext], str]: Instrução para o `instruction` do LlmAgent
+    """
+    def instruction(context: ReadonlyContext) -> str:
+        text = template
+        for key, fields in projections.items():
+            if key not in context.state:
+                raise KeyError(f"Variável de estado não encontrada: {key}")
+            text = text.replace("{" + key + "}", format_state_value(project_state_value(context.state[key], fields)))
+        return text
+
+    instruction.__qualname__ = f"projected_instruction({', '.join(projections)})"
+    return instruction
+
+
+def keep_user_text_only(callback_context: CallbackContext, llm_request: LlmRequest) -> Optional[LlmResponse]:
+    """
+    before_model_callback de etapas que trabalham só com o estado da sessão: remove da conversa
+    enviada ao modelo as imagens, PDFs e XMLs (`inline_data` e `file_data`), cujos dados já estão
+    na instrução via `projected_instruction`. O texto da conversa é mantido, para que perguntas
+    seguintes no chat tenham o contexto; uma mensagem só com arquivos vira ATTACHMENT_PLACEHOLDER.
+
+    Args:
+        callback_context: Contexto do callback do Google ADK
+        llm_request: Requisição ao modelo
+
+    Returns:
+        Optional[LlmResponse]: Sempre None (a chamada ao modelo segue com o conteúdo reduzido)
+    """
+    contents = []
+    for content in llm_request.contents:
+        parts = [part for part in content.parts or [] if part.inline_data is None and part.file_data is None]
+        if not parts and content.role == "user" and content.parts:
+            parts = [types.Part(text=ATTACHMENT_PLACEHOLDER)]
+        if parts:
+            contents.append(content.model_copy(update={"parts": parts}))
+
+    # O Gemini recusa requisições sem conteúdo
+    llm_request.contents = contents or [types.Content(role="user", parts=[types.Part(text=ATTACHMENT_PLACEHOLDER)])]
+    return None
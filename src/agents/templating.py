@@ -0,0 +1,51 @@
+import logging
+
+from functools import lru_cache
+from pathlib import Path
+from typing import Any, Union
+
+from jinja2 import Environment, FileSystemLoader, StrictUndefined
+
+logger = logging.getLogger(__name__)
+
+
+def markdown_cell(value: Any) -> str:
+    """Filtro `md_cell`: escapa o conteúdo de uma célula de tabela Markdown (barras verticais e quebras de linha)."""
+    return str(value).replace("|", "\\|").replace("\r", " ").replace("\n", " ")
+
+
+@lru_cache(maxsize=None)
+def get_template_environment(template_dir: str) -> Environment:
+    """
+    Ambiente Jinja dos templates de um diretório (um por pacote de agentes), criado uma vez por processo.
+
+    Args:
+        template_dir: Diretório com os templates
+
+    Returns:
+        Environment: Ambiente com os filtros comuns (`md_cell`)
+    """
+    environment = Environment(
+        loader=FileSystemLoader(template_dir),
+        autoescape=False,
+        trim_blocks=True,
+        lstrip_blocks=True,
+        undefined=StrictUndefined
+    )
+    environment.filters["md_cell"] = markdown_cell
+    return environment
+
+
+def render_template(template_dir: Union[str, Path], name: str, **values: Any) -> str:
+    """
+    Renderiza um template Markdown sem LLM.
+
+    Args:
+        template_dir: Diretório com os templates
+        name: Nome do arquivo do template (ex.: "relatorio_nfe.md.j2")
+        **values: Variáveis do template
+
+    Returns:
+        str: Texto renderizado
+    """
+    return get_template_environment(str(template_dir)).get_template(name).render(**values).strip()
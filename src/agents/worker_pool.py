@@ -0,0 +1,516 @@
+import asyncio
+import concurrent.futures
+import itertools
+import logging
+import multiprocessing
+import multiprocessing.connection
+import os
+import threading
+
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Any, Callable, Deque, Dict, List, Optional, Set, Tuple
+
+from src.agents.instrumentation import TurnMetrics, emit_turn_metrics
+from src.agents.rate_limiter import mark_retries_exhausted, retries_exhausted
+
+logger = logging.getLogger(__name__)
+
+# Número padrão de processos (WORKER_PROCESSES; padrão: um por núcleo)
+DEFAULT_WORKER_PROCESSES = os.cpu_count() or 1
+
+# Jobs executados ao mesmo tempo no event loop de cada processo (as chamadas ao modelo são
+# em sua maioria espera de rede; o trabalho de CPU de cada job é que passa a ocupar um núcleo)
+DEFAULT_PROCESS_CONCURRENCY = 4
+
+# Intervalo de verificação dos processos enquanto não chegam resultados
+RESULT_POLL_SECONDS = 1.0
+
+# Processos que terminam seguidamente antes de ficarem prontos (ex.: erro ao importar os agentes)
+# encerram o pool em vez de serem reiniciados indefinidamente
+MAX_STARTUP_FAILURES = 3
+
+# Mensagens dos processos ao processo principal
+WORKER_READY = "pronto"
+JOB_STARTED = "inicio"
+JOB_FINISHED = "fim"
+
+
+class WorkerPoolError(RuntimeError):
+    """O pool foi encerrado ou um processo terminou inesperadamente."""
+
+
+class WorkerJobError(Exception):
+    """
+    Erro de um job executado em um processo do pool.
+
+    A exceção original não é enviada entre processos (nem todas podem ser serializadas);
+    a mensagem, o código HTTP e a marca de novas tentativas já feitas pelo modelo são preservados
+    para `rate_limiter.is_retryable_error` e `rate_limiter.retries_exhausted`.
+
+    Attributes:
+        code: Código HTTP do erro original, se houver
+        error_type: Nome da classe da exceção original
+    """
+
+    def __init__(self, message: str, code: Optional[int] = None, error_type: Optional[str] = None):
+        super().__init__(message)
+        self.code = code
+        self.error_type = error_type
+
+
+@dataclass
+class WorkerJob:
+    """
+    Execução de `run_agent_query` enviada a um processo do pool.
+
+    Attributes:
+        agent_name: Nome do agente no registro (ver `agent_registry`)
+        message: Mensagem do usuário
+        model: Nome do modelo LLM (ver DEFAULT_MODELS_PRETTY_NAME) ou None para usar os modelos do agente
+        files: Bytes dos arquivos enviados
+        state: Valores gravados no estado da sessão antes da execução
+        state_keys: Chaves do estado da sessão devolvidas no resultado
+        priority: Faixa de prioridade das chamadas ao modelo (ver rate_limiter)
+    """
+    agent_name: str
+    message: str
+    model: Optional[str] = None
+    files: List[bytes] = field(default_factory=list)
+    state: Dict[str, Any] = field(default_factory=dict)
+    state_keys: List[str] = field(default_factory=list)
+    priority: Optional[int] = None
+
+
+@dataclass
+class WorkerResult:
+    """
+    Resultado de um job do pool.
+
+    Attributes:
+        response: Resposta final do agente
+        state: Valores de `state_keys` no estado da sessão ao fim da execução
+        metrics: Métricas do turno (ver `TurnMetrics.to_dict`)
+        worker: Índice do processo que executou o job
+    """
+    response: str
+    state: Dict[str, Any]
+    metrics: Optional[Dict] = None
+    worker: Optional[int] = None
+
+
+async def _execute_job(job: WorkerJob, session_service, metrics: TurnMetrics) -> WorkerResult:
+    # Executado no processo do pool: agente do registro local, sessão descartável e métricas do turno
+    from src.agents.agent_config import run_agent_query
+    from src.agents.agent_registry import get_agent_registry
+    from src.agents.rate_limiter import set_request_priority
+
+    if job.priority is not None:
+        set_request_priority(job.priority)
+
+    agent = get_agent_registry().load(job.agent_name)
+    session = await session_service.create_session(app_name="worker", user_id="worker")
+    try:
+        response = await run_agent_query(
+            agent,
+            session_service,
+            session,
+            job.message,
+            job.model,
+            files=job.files or None,
+            metrics=metrics,
+            state=job.state
+        )
+        final_session = await session_service.get_session(app_name=session.app_name, user_id=session.user_id, session_id=session.id)
+        state = {key: final_session.state[key] for key in job.state_keys if key in final_session.state}
+        return WorkerResult(response=response, state=state, metrics=metrics.to_dict())
+    finally:
+        await session_service.delete_session(app_name=session.app_name, user_id=session.user_id, session_id=session.id)
+
+
+async def _serve(index: int, jobs: multiprocessing.Queue, results: multiprocessing.connection.Connection, concurrency: int):
+    from src.agents.agent_config import create_session_service
+
+    # Sessões locais ao processo: cada job usa uma sessão própria, removida ao final
+    session_service = create_session_service("memory://")
+    slots = asyncio.Semaphore(concurrency)
+    running = set()
+
+    async def run(job_id: int, job: WorkerJob):
+        metrics = TurnMetrics()
+        try:
+            result = await _execute_job(job, session_service, metrics)
+            result.worker = index
+            message = (JOB_FINISHED, job_id, result, None)
+        except Exception as e:
+            # Métricas do turno interrompido, se a execução do agente chegou a começar
+            turn_metrics = metrics.to_dict() if metrics.total_time_s is not None else None
+            message = (JOB_FINISHED, job_id, None, (str(e), getattr(e, "code", None), type(e).__name__, turn_metrics, retries_exhausted(e)))
+        finally:
+            slots.release()
+
+        try:
+            results.send(message)
+        except Exception as e:
+            # Resultado que não pode ser serializado (ex.: valor do estado sem suporte a pickle)
+            results.send((JOB_FINISHED, job_id, None, (f"Resultado do job não pôde ser enviado: {e}", None, type(e).__name__, None, False)))
+
+    results.send((WORKER_READY,))
+    while True:
+        item = await asyncio.to_thread(jobs.get)
+        if item is None:
+            break
+        await slots.acquire()
+        job_id, job = item
+        # A partir daqui o job pertence a este processo: se ele terminar inesperadamente, o job falha
+        results.send((JOB_STARTED, job_id))
+        task = asyncio.create_task(run(job_id, job))
+        running.add(task)
+        task.add_done_callback(running.discard)
+
+    await asyncio.gather(*running, return_exceptions=True)
+
+
+def _worker_main(index: int, jobs: multiprocessing.Queue, results: multiprocessing.connection.Connection, processes: int, concurrency: int, log_level: int, initializer: Optional[Callable[[], None]]):
+    # Ponto de entrada de cada processo do pool (iniciado com "spawn": sem estado herdado do processo principal)
+    logging.basicConfig(level=log_level)
+
+    from src.agents.instrumentation import set_metrics_sinks
+
+    # Com os limitadores em memória (GEMINI_RATE_LIMIT_SHARED=0) a cota do Gemini é dividida entre os processos;
+    # as métricas são exportadas pelo processo principal
+    os.environ["GEMINI_RATE_LIMIT_PROCESSES"] = str(processes)
+    set_metrics_sinks([])
+
+    if initializer is not None:
+        initializer()
+
+    logger.info(f"Processo {index} do pool iniciado (pid {os.getpid()}, {concurrency} job(s) por vez)")
+    asyncio.run(_serve(index, jobs, results, concurrency))
+
+
+def _resolve_future(future: concurrent.futures.Future, result: Any = None, error: Optional[Exception] = None):
+    # O futuro pode ter sido cancelado pelo chamador (ex.: job da API interrompido) enquanto o processo executava
+    try:
+        if error is not None:
+            future.set_exception(error)
+        else:
+            future.set_result(result)
+    except concurrent.futures.InvalidStateError:
+        pass
+
+
+@dataclass
+class _WorkerProcess:
+    """
+    Processo do pool, visto pelo processo principal.
+
+    Attributes:
+        index: Posição do processo no pool (mantida quando o processo é reiniciado)
+        process: Processo
+        jobs: Fila de jobs do processo
+        results: Conexão por onde chegam as mensagens do processo
+        queued: Jobs enviados ao processo que ele ainda não iniciou (reenviados a outro processo se ele terminar)
+        started: Jobs que o processo iniciou (falham se ele terminar)
+        ready: Se o processo terminou de iniciar
+    """
+    index: int
+    process: multiprocessing.Process
+    jobs: multiprocessing.Queue
+    results: multiprocessing.connection.Connection
+    queued: Dict[int, WorkerJob] = field(default_factory=dict)
+    started: Set[int] = field(default_factory=set)
+    ready: bool = False
+
+    @property
+    def load(self) -> int:
+        return len(self.queued) + len(self.started)
+
+
+class AgentWorkerPool:
+    """
+    Pool de processos para executar agentes em vários núcleos.
+
+    Cada processo tem o seu event loop, as suas árvores de agentes (carregadas do registro na
+    primeira execução de cada agente) e o seu cliente Gemini com o pool de conexões HTTP, e executa
+    até `concurrency` jobs ao mesmo tempo. O trabalho de CPU dos jobs (decodificação de imagens,
+    leitura de PDFs, validação dos schemas, sessões) deixa de disputar o GIL de um único processo.
+
+    O processo principal distribui os jobs para o processo menos ocupado, cada um com a sua fila.
+    Cada processo avisa quando inicia um job; se um processo termina inesperadamente, apenas os jobs
+    que ele já tinha iniciado falham, os que ainda aguardavam nele são reenviados e o processo é reiniciado.
+
+    Os resultados e as métricas de cada turno voltam para o processo principal, que exporta as
+    métricas pelos coletores registrados (ver `instrumentation`).
+
+    Args:
+        processes: Número de processos (padrão: WORKER_PROCESSES ou o número de núcleos)
+        concurrency: Jobs executados ao mesmo tempo em cada processo
+        initializer: Função (importável pelo nome) chamada em cada processo antes dos jobs,
+            ex.: para registrar agentes montados em scripts
+    """
+
+    def __init__(self, processes: Optional[int] = None, concurrency: int = DEFAULT_PROCESS_CONCURRENCY, initializer: Optional[Callable[[], None]] = None):
+        self.processes = processes or int(os.getenv("WORKER_PROCESSES", DEFAULT_WORKER_PROCESSES))
+        self.concurrency = concurrency
+        self.initializer = initializer
+        self._context = multiprocessing.get_context("spawn")
+        self._log_level = logging.getLogger().getEffectiveLevel()
+        self._workers: Dict[int, _WorkerProcess] = {}
+        self._pending: Deque[Tuple[int, WorkerJob]] = deque()
+        self._futures: Dict[int, concurrent.futures.Future] = {}
+        self._lock = threading.RLock()
+        self._job_ids = itertools.count()
+        self._collector: Optional[threading.Thread] = None
+        self._started = False
+        self._closed = False
+        self._restarts = 0
+        self._startup_failures = 0
+
+    @property
+    def closed(self) -> bool:
+        return self._closed
+
+    def start(self):
+        """Inicia os processos e a thread que recebe as mensagens deles."""
+        with self._lock:
+            if self._started:
+                return
+            self._started = True
+            for index in range(self.processes):
+                self._workers[index] = self._spawn(index)
+
+        self._collector = threading.Thread(target=self._collect_results, name="agent-worker-results", daemon=True)
+        self._collector.start()
+        logger.info(f"Pool de agentes iniciado com {self.processes} processo(s) x {self.concurrency} job(s)")
+
+    def _spawn(self, index: int) -> _WorkerProcess:
+        jobs = self._context.Queue()
+        reader, writer = self._context.Pipe(duplex=False)
+        process = self._context.Process(
+            target=_worker_main,
+            args=(index, jobs, writer, self.processes, self.concurrency, self._log_level, self.initializer),
+            name=f"agent-worker-{index}",
+            daemon=True
+        )
+        process.start()
+        # A ponta de escrita fica só com o processo filho (a leitura recebe EOF quando ele termina)
+        writer.close()
+        return _WorkerProcess(index=index, process=process, jobs=jobs, results=reader)
+
+    def submit(self, job: WorkerJob) -> concurrent.futures.Future:
+        """
+        Envia um job para o pool sem bloquear a thread atual.
+
+        Args:
+            job: Job a ser executado
+
+        Returns:
+            concurrent.futures.Future: Futuro com o WorkerResult (ou WorkerJobError)
+
+        Raises:
+            WorkerPoolError: Se o pool foi encerrado
+        """
+        if self._closed:
+            raise WorkerPoolError("Pool de agentes encerrado")
+        self.start()
+
+        future = concurrent.futures.Future()
+        with self._lock:
+            job_id = next(self._job_ids)
+            self._futures[job_id] = future
+            self._pending.append((job_id, job))
+            self._dispatch()
+        return future
+
+    async def run(self, job: WorkerJob) -> WorkerResult:
+        """
+        Executa um job no pool e aguarda o resultado.
+
+        Args:
+            job: Job a ser executado
+
+        Returns:
+            WorkerResult: Resultado do job
+
+        Raises:
+            WorkerJobError: Se a execução do agente falhou
+            WorkerPoolError: Se o pool foi encerrado ou o processo terminou inesperadamente durante o job
+        """
+        return await asyncio.wrap_future(self.submit(job))
+
+    def health(self) -> Dict[str, Any]:
+        """
+        Returns:
+            Dict[str, Any]: Processos ativos e iniciando, reinícios e jobs em execução e aguardando
+        """
+        with self._lock:
+            workers = list(self._workers.values())
+            alive = [worker for worker in workers if worker.process.is_alive()]
+            return {
+                "processos": self.processes,
+                "ativos": sum(1 for worker in alive if worker.ready),
+                "iniciando": sum(1 for worker in alive if not worker.ready),
+                "reinicios": self._restarts,
+                "jobs_em_execucao": sum(len(worker.started) for worker in workers),
+                "jobs_aguardando": len(self._pending) + sum(len(worker.queued) for worker in workers),
+                "encerrado": self._closed,
+            }
+
+    def _dispatch(self, force: bool = False):
+        # Envia os jobs pendentes aos processos menos ocupados, até `concurrency` por processo
+        # (com `force`, ao encerrar, envia todos). Chamado com self._lock.
+        while self._pending and self._workers:
+            worker = min(self._workers.values(), key=lambda worker: worker.load)
+            if worker.load >= self.concurrency and not force:
+                return
+            job_id, job = self._pending.popleft()
+            future = self._futures.get(job_id)
+            if future is None or future.cancelled():
+                self._futures.pop(job_id, None)
+                continue
+            worker.queued[job_id] = job
+            worker.jobs.put((job_id, job))
+
+    def _collect_results(self):
+        while True:
+            with self._lock:
+                workers = list(self._workers.values())
+            if self._closed and not any(worker.process.is_alive() for worker in workers):
+                for worker in workers:
+                    self._receive(worker)
+                return
+
+            connections = {worker.results: worker for worker in workers}
+            sentinels = {worker.process.sentinel: worker for worker in workers}
+            ready = multiprocessing.connection.wait(list(connections) + list(sentinels), timeout=RESULT_POLL_SECONDS)
+            for handle in ready:
+                if handle in connections:
+                    self._receive(connections[handle])
+            for handle in ready:
+                if handle in sentinels:
+                    self._handle_exit(sentinels[handle])
+
+    def _receive(self, worker: _WorkerProcess):
+        # Lê todas as mensagens já disponíveis do processo
+        while True:
+            try:
+                if not worker.results.poll():
+                    return
+                message = worker.results.recv()
+            except (EOFError, OSError):
+                return
+
+            if message[0] == WORKER_READY:
+                with self._lock:
+                    worker.ready = True
+                    self._startup_failures = 0
+            elif message[0] == JOB_STARTED:
+                with self._lock:
+                    worker.queued.pop(message[1], None)
+                    worker.started.add(message[1])
+            elif message[0] == JOB_FINISHED:
+                self._finish_job(worker, *message[1:])
+
+    def _finish_job(self, worker: _WorkerProcess, job_id: int, result: Optional[WorkerResult], error: Optional[Tuple]):
+        with self._lock:
+            worker.started.discard(job_id)
+            worker.queued.pop(job_id, None)
+            future = self._futures.pop(job_id, None)
+            if not self._closed:
+                self._dispatch()
+
+        metrics = result.metrics if result is not None else error[3]
+        if metrics is not None:
+            emit_turn_metrics(TurnMetrics.from_dict(metrics))
+
+        if future is None:
+            return
+        if error is not None:
+            message, code, error_type, _, model_retried = error
+            job_error = WorkerJobError(message, code=code, error_type=error_type)
+            if model_retried:
+                mark_retries_exhausted(job_error)
+            _resolve_future(future, error=job_error)
+        else:
+            _resolve_future(future, result=result)
+
+    def _handle_exit(self, worker: _WorkerProcess):
+        # Mensagens enviadas antes do fim do processo (ex.: resultados) são processadas primeiro
+        self._receive(worker)
+        worker.process.join()
+
+        with self._lock:
+            if self._workers.get(worker.index) is not worker:
+                return
+            failed = [self._futures.pop(job_id, None) for job_id in worker.started]
+            worker.started.clear()
+            if self._closed:
+                failed += [self._futures.pop(job_id, None) for job_id in worker.queued]
+                worker.queued.clear()
+                del self._workers[worker.index]
+                error = WorkerPoolError("Pool de agentes encerrado")
+            else:
+                error = WorkerPoolError(f"Processo {worker.process.name} terminou inesperadamente (código {worker.process.exitcode})")
+                # Jobs que o processo ainda não tinha iniciado voltam para a frente da fila
+                self._pending.extendleft(reversed(list(worker.queued.items())))
+                worker.queued.clear()
+
+                if not worker.ready:
+                    self._startup_failures += 1
+                if self._startup_failures >= MAX_STARTUP_FAILURES:
+                    logger.error(f"{error}; {self._startup_failures} processo(s) seguidos terminaram antes de iniciar, encerrando o pool")
+                    self._close_broken(error)
+                    del self._workers[worker.index]
+                else:
+                    logger.error(f"{error}; reiniciando o processo ({len([future for future in failed if future])} job(s) em execução falharam)")
+                    self._restarts += 1
+                    self._workers[worker.index] = self._spawn(worker.index)
+                    self._dispatch()
+
+        worker.results.close()
+        for future in failed:
+            if future is not None:
+                _resolve_future(future, error=error)
+
+    def _close_broken(self, error: Exception):
+        # Sem processos capazes de iniciar: encerra o pool e falha todos os jobs. Chamado com self._lock.
+        self._closed = True
+        for worker in self._workers.values():
+            if worker.process.is_alive():
+                worker.process.terminate()
+        self._pending.clear()
+        futures, self._futures = self._futures, {}
+        for future in futures.values():
+            _resolve_future(future, error=error)
+
+    def shutdown(self, timeout: Optional[float] = None):
+        """
+        Encerra o pool depois dos jobs já enviados.
+
+        Args:
+            timeout: Tempo máximo de espera por processo em segundos (depois disso, o processo é terminado)
+        """
+        with self._lock:
+            if self._closed and not self._workers:
+                return
+            self._closed = True
+            # Jobs ainda não distribuídos seguem para os processos, que os executam antes de terminar
+            self._dispatch(force=True)
+            workers = list(self._workers.values())
+            for worker in workers:
+                worker.jobs.put(None)
+
+        for worker in workers:
+            worker.process.join(timeout)
+            if worker.process.is_alive():
+                worker.process.terminate()
+                worker.process.join()
+        if self._collector is not None:
+            self._collector.join()
+
+        with self._lock:
+            futures, self._futures = self._futures, {}
+            self._workers = {}
+        for future in futures.values():
+            _resolve_future(future, error=WorkerPoolError("Pool de agentes encerrado"))
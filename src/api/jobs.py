@@ -0,0 +1,344 @@
+import asyncio
+import hashlib
+import logging
+import time
+import uuid
+
+from dataclasses import dataclass, field
+from typing import Any, AsyncIterator, Callable, Dict, List, Optional, Tuple
+
+from google.adk.agents import BaseAgent
+from google.adk.sessions import BaseSessionService
+
+from src.agents.agent_config import stream_agent_query, STAGE_LABELS
+from src.agents.rate_limiter import set_request_priority, BATCH_PRIORITY
+from src.agents.worker_pool import AgentWorkerPool, WorkerJob
+
+logger = logging.getLogger(__name__)
+
+# Configuração padrão da fila (pode ser sobrescrita por variáveis de ambiente em server.py)
+DEFAULT_WORKERS = 4
+DEFAULT_QUEUE_SIZE = 100
+DEFAULT_JOB_TTL_SECONDS = 60 * 60
+
+# Status de um job
+PENDING = "pendente"
+RUNNING = "executando"
+DONE = "ok"
+FAILED = "erro"
+
+
+class QueueFullError(Exception):
+    """A fila de jobs atingiu o limite; o cliente deve tentar novamente mais tarde."""
+
+
+class IdempotencyConflictError(Exception):
+    """A chave de idempotência já foi usada com outro conteúdo."""
+
+
+def request_fingerprint(agent_name: str, message: str, model: Optional[str], files: List[bytes], state: Optional[Dict]) -> str:
+    """
+    Gera a impressão digital do pedido, usada para conferir reenvios com a mesma chave de idempotência.
+
+    Args:
+        agent_name: Nome do agente
+        message: Mensagem do usuário
+        model: Nome do modelo LLM
+        files: Bytes dos arquivos enviados
+        state: Valores iniciais do estado da sessão
+
+    Returns:
+        str: Hash SHA-256 hexadecimal
+    """
+    digest = hashlib.sha256()
+    for value in (agent_name, message, model or "", repr(sorted((state or {}).items()))):
+        digest.update(value.encode() + b"\x00")
+    for file_bytes in files:
+        digest.update(hashlib.sha256(file_bytes).digest())
+    return digest.hexdigest()
+
+
+@dataclass
+class Job:
+    """
+    Execução de um agente pedida pela API.
+
+    Attributes:
+        id: Identificador do job
+        agent_name: Nome do agente executado
+        message: Mensagem do usuário
+        model: Nome do modelo LLM (ver DEFAULT_MODELS_PRETTY_NAME) ou None para usar os modelos do agente
+        files: Bytes dos arquivos enviados (liberados quando o job termina)
+        state: Valores gravados no estado da sessão antes da execução
+        fingerprint: Impressão digital do pedido (ver `request_fingerprint`)
+        idempotency_key: Chave de idempotência enviada pelo cliente
+        status: "pendente", "executando", "ok" ou "erro"
+        response: Resposta final do agente
+        result_state: Resultados das etapas gravados no estado da sessão (ex.: "nota_fiscal_data")
+        error: Mensagem de erro, se a execução falhou
+        events: Eventos de progresso (etapas, trechos de texto e mudanças de status), na ordem
+    """
+    id: str
+    agent_name: str
+    message: str
+    model: Optional[str]
+    files: List[bytes]
+    state: Dict[str, Any]
+    fingerprint: str
+    idempotency_key: Optional[str] = None
+    status: str = PENDING
+    response: Optional[str] = None
+    result_state: Dict[str, Any] = field(default_factory=dict)
+    error: Optional[str] = None
+    events: List[Dict[str, Any]] = field(default_factory=list)
+    created_at: float = field(default_factory=time.time)
+    started_at: Optional[float] = None
+    finished_at: Optional[float] = None
+    _changed: asyncio.Condition = field(default_factory=asyncio.Condition, repr=False)
+
+    @property
+    def finished(self) -> bool:
+        return self.status in (DONE, FAILED)
+
+    async def publish(self, event: Dict[str, Any]):
+        # Registra o evento e acorda quem acompanha o job (ver `follow`)
+        async with self._changed:
+            self.events.append(event)
+            self._changed.notify_all()
+
+    async def follow(self) -> AsyncIterator[Dict[str, Any]]:
+        """
+        Emite os eventos do job desde o início e acompanha os novos até o job terminar.
+
+        Yields:
+            Dict[str, Any]: Eventos de progresso
+        """
+        position = 0
+        while True:
+            async with self._changed:
+                await self._changed.wait_for(lambda: position < len(self.events) or self.finished)
+                pending = self.events[position:]
+                finished = self.finished
+            position += len(pending)
+            for event in pending:
+                yield event
+            if finished and position >= len(self.events):
+                return
+
+    def to_dict(self) -> Dict[str, Any]:
+        """
+        Returns:
+            Dict[str, Any]: Job no formato da API (mesmas chaves do resultado do processamento em lote)
+        """
+        duration = self.finished_at - self.started_at if self.finished_at and self.started_at else None
+        return {
+            "id": self.id,
+            "agente": self.agent_name,
+            "status": self.status,
+            "resposta": self.response,
+            "estado": self.result_state,
+            "erro": self.error,
+            "criado_em": self.created_at,
+            "duracao_segundos": round(duration, 3) if duration is not None else None,
+        }
+
+
+class JobQueue:
+    """
+    Fila de jobs em memória com um número fixo de workers assíncronos.
+
+    A fila é limitada (`max_size`): acima do limite `submit` recusa o job (backpressure, HTTP 429).
+    Pedidos com a mesma chave de idempotência devolvem o job já criado. Jobs concluídos ficam
+    disponíveis para consulta por `job_ttl_seconds`.
+
+    Com um pool de processos (`pool`), os agentes são executados nos processos do pool; os
+    eventos de progresso das etapas são publicados quando o job termina, sem trechos de texto parciais.
+    """
+
+    def __init__(
+        self,
+        resolve_agent: Callable[[str], BaseAgent],
+        session_service: BaseSessionService,
+        workers: int = DEFAULT_WORKERS,
+        max_size: int = DEFAULT_QUEUE_SIZE,
+        job_ttl_seconds: float = DEFAULT_JOB_TTL_SECONDS,
+        pool: Optional[AgentWorkerPool] = None,
+    ):
+        self.resolve_agent = resolve_agent
+        self.pool = pool
+        self.session_service = session_service
+        self.workers = workers
+        self.job_ttl_seconds = job_ttl_seconds
+        self.jobs: Dict[str, Job] = {}
+        self._idempotency_keys: Dict[str, str] = {}
+        self._queue: asyncio.Queue = asyncio.Queue(maxsize=max_size)
+        self._tasks: List[asyncio.Task] = []
+
+    @property
+    def pending(self) -> int:
+        return self._queue.qsize()
+
+    @property
+    def max_size(self) -> int:
+        return self._queue.maxsize
+
+    def start(self):
+        """Inicia os workers no event loop atual (e os processos do pool, se houver)."""
+        if self.pool is not None:
+            self.pool.start()
+        self._tasks = [asyncio.create_task(self._worker(index)) for index in range(self.workers)]
+
+    async def stop(self):
+        """Interrompe os workers (jobs em execução são cancelados) e encerra o pool."""
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        if self.pool is not None:
+            await asyncio.to_thread(self.pool.shutdown)
+
+    def get(self, job_id: str) -> Optional[Job]:
+        return self.jobs.get(job_id)
+
+    def submit(
+        self,
+        agent_name: str,
+        message: str,
+        model: Optional[str],
+        files: List[bytes],
+        state: Optional[Dict[str, Any]] = None,
+        idempotency_key: Optional[str] = None,
+    ) -> Tuple[Job, bool]:
+        """
+        Enfileira a execução de um agente.
+
+        Args:
+            agent_name: Nome do agente
+            message: Mensagem do usuário
+            model: Nome do modelo LLM ou None para usar os modelos do agente
+            files: Bytes dos arquivos enviados
+            state: Valores gravados no estado da sessão antes da execução
+            idempotency_key: Chave de idempotência do cliente (opcional)
+
+        Returns:
+            Tuple[Job, bool]: Job e se foi criado agora (False quando a chave de idempotência devolve um job existente)
+
+        Raises:
+            IdempotencyConflictError: Se a chave já foi usada com outro conteúdo
+            QueueFullError: Se a fila está cheia
+        """
+        self._prune()
+        fingerprint = request_fingerprint(agent_name, message, model, files, state)
+
+        if idempotency_key is not None:
+            existing = self.jobs.get(self._idempotency_keys.get(idempotency_key, ""))
+            if existing is not None:
+                if existing.fingerprint != fingerprint:
+                    raise IdempotencyConflictError(f"Chave de idempotência já usada com outro pedido: {idempotency_key}")
+                return existing, False
+
+        job = Job(
+            id=uuid.uuid4().hex,
+            agent_name=agent_name,
+            message=message,
+            model=model,
+            files=files,
+            state=dict(state or {}),
+            fingerprint=fingerprint,
+            idempotency_key=idempotency_key
+        )
+        try:
+            self._queue.put_nowait(job)
+        except asyncio.QueueFull:
+            raise QueueFullError(f"Fila de jobs cheia ({self._queue.maxsize})")
+
+        self.jobs[job.id] = job
+        if idempotency_key is not None:
+            self._idempotency_keys[idempotency_key] = job.id
+        return job, True
+
+    def _prune(self):
+        # Remove os jobs concluídos há mais de job_ttl_seconds (e suas chaves de idempotência)
+        now = time.time()
+        expired = [job for job in self.jobs.values() if job.finished and now - job.finished_at > self.job_ttl_seconds]
+        for job in expired:
+            del self.jobs[job.id]
+            if job.idempotency_key is not None and self._idempotency_keys.get(job.idempotency_key) == job.id:
+                del self._idempotency_keys[job.idempotency_key]
+
+    async def _worker(self, index: int):
+        # Jobs da API cedem a cota do modelo ao chat interativo (ver rate_limiter)
+        set_request_priority(BATCH_PRIORITY)
+        while True:
+            job = await self._queue.get()
+            try:
+                await self._run_job(job)
+            except Exception as e:
+                logger.error(f"Worker {index}: falha inesperada no job {job.id}: {e}")
+            finally:
+                self._queue.task_done()
+
+    async def _run_job(self, job: Job):
+        job.status = RUNNING
+        job.started_at = time.time()
+        await job.publish({"tipo": "status", "status": RUNNING})
+
+        try:
+            if self.pool is not None:
+                job.response = await self._run_in_pool(job)
+            else:
+                job.response = await self._run_in_process(job)
+            job.status = DONE
+        except Exception as e:
+            logger.error(f"Falha no job {job.id} ({job.agent_name}): {e}")
+            job.error = str(e)
+            job.status = FAILED
+        finally:
+            job.finished_at = time.time()
+            job.files = []
+            await job.publish({"tipo": "status", "status": job.status, "erro": job.error})
+
+    async def _run_in_process(self, job: Job) -> Optional[str]:
+        session = await self.session_service.create_session(app_name="api", user_id="api", session_id=f"job-{job.id}")
+        texts = []
+        try:
+            agent = self.resolve_agent(job.agent_name)
+            async for event in stream_agent_query(
+                agent,
+                self.session_service,
+                session,
+                job.message,
+                job.model,
+                files=job.files,
+                state=job.state
+            ):
+                if event.kind == "stage":
+                    job.result_state[event.state_key] = event.data
+                    await job.publish({"tipo": "etapa", "etapa": event.state_key, "texto": event.text, "dados": event.data})
+                else:
+                    texts.append(event.text)
+                    await job.publish({"tipo": "texto", "autor": event.author, "texto": event.text})
+
+            final_session = await self.session_service.get_session(app_name=session.app_name, user_id=session.user_id, session_id=session.id)
+            if final_session is not None:
+                job.result_state.update({key: final_session.state[key] for key in STAGE_LABELS if key in final_session.state})
+            return "".join(texts) or None
+        finally:
+            await self.session_service.delete_session(app_name=session.app_name, user_id=session.user_id, session_id=session.id)
+
+    async def _run_in_pool(self, job: Job) -> Optional[str]:
+        result = await self.pool.run(WorkerJob(
+            agent_name=job.agent_name,
+            message=job.message,
+            model=job.model,
+            files=job.files,
+            state=job.state,
+            state_keys=list(STAGE_LABELS),
+            priority=BATCH_PRIORITY
+        ))
+        for key, value in result.state.items():
+            job.result_state[key] = value
+            await job.publish({"tipo": "etapa", "etapa": key, "texto": STAGE_LABELS[key], "dados": value})
+        if result.response:
+            await job.publish({"tipo": "texto", "autor": job.agent_name, "texto": result.response})
+        return result.response or None
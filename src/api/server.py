@@ -0,0 +1,204 @@
+import argparse
+import asyncio
+import json
+import logging
+import math
+import os
+
+from contextlib import asynccontextmanager
+from typing import Dict, List, Optional
+
+import dotenv
+
+from fastapi import FastAPI, File, Form, Header, HTTPException, UploadFile
+from fastapi.responses import JSONResponse, StreamingResponse
+from google.adk.agents import BaseAgent
+
+from src.agents.agent_config import create_session_service, DEFAULT_MODELS_PRETTY_NAME, NARRATIVE_STATE_KEY
+from src.agents.agent_registry import AgentRegistry, get_agent_registry
+from src.agents.worker_pool import AgentWorkerPool
+from src.agents.ingestion import read_file_guarded, IngestionError, UnsupportedFileTypeError, FileTooLargeError
+from src.api.jobs import JobQueue, QueueFullError, IdempotencyConflictError, DEFAULT_WORKERS, DEFAULT_QUEUE_SIZE, DEFAULT_JOB_TTL_SECONDS
+
+logger = logging.getLogger(__name__)
+
+# Mensagem enviada junto com os documentos quando o cliente não informa uma
+DEFAULT_API_MESSAGE = "Processar este documento"
+
+# Espera sugerida ao cliente (cabeçalho Retry-After) quando a fila está cheia
+RETRY_AFTER_SECONDS = 5
+
+
+def create_app(
+    workers: Optional[int] = None,
+    queue_size: Optional[int] = None,
+    job_ttl_seconds: Optional[float] = None,
+    agents: Optional[Dict[str, BaseAgent]] = None,
+    registry: Optional[AgentRegistry] = None,
+    processes: Optional[int] = None,
+) -> FastAPI:
+    """
+    Cria a aplicação ASGI da API de jobs dos agentes.
+
+    Rotas:
+        GET  /agents              Agentes disponíveis
+        POST /jobs                Enfileira um job (multipart: agent, message, model, narrative, files)
+        GET  /jobs/{id}           Status e resultado do job
+        GET  /jobs/{id}/events    Progresso do job (Server-Sent Events)
+        GET  /health              Tamanho da fila, número de jobs e processos do pool (se houver)
+
+    Configuração via ambiente (quando os argumentos não são informados): API_WORKERS,
+    API_QUEUE_SIZE, API_JOB_TTL_SECONDS, API_SESSION_STORE_URL (padrão: "memory://") e
+    API_WORKER_PROCESSES (padrão: 0, agentes executados no processo da API).
+
+    Args:
+        workers: Número de workers assíncronos
+        queue_size: Número máximo de jobs na fila (acima disso, HTTP 429)
+        job_ttl_seconds: Tempo que os jobs concluídos ficam disponíveis para consulta
+        agents: Agentes já montados, por nome (substituem o registro; usado em testes)
+        registry: Registro dos agentes, importados no primeiro job de cada um (padrão: `get_agent_registry()`)
+        processes: Número de processos que executam os agentes (ver `worker_pool`); 0 executa no processo da API
+
+    Returns:
+        FastAPI: Aplicação
+
+    Raises:
+        ValueError: Se `processes` é usado com `agents` (os processos carregam os agentes pelo registro)
+    """
+    if agents is not None:
+        registry = AgentRegistry([])
+        for agent in agents.values():
+            registry.register(agent)
+    elif registry is None:
+        registry = get_agent_registry()
+
+    workers = workers if workers is not None else int(os.getenv("API_WORKERS", DEFAULT_WORKERS))
+    processes = processes if processes is not None else int(os.getenv("API_WORKER_PROCESSES", 0))
+    pool = None
+    if processes > 0:
+        if agents is not None:
+            raise ValueError("Agentes montados em memória não podem ser executados em processos separados")
+        # Os workers assíncronos da fila são divididos entre os processos
+        pool = AgentWorkerPool(processes, concurrency=math.ceil(workers / processes))
+
+    queue = JobQueue(
+        resolve_agent=registry.load,
+        session_service=create_session_service(os.getenv("API_SESSION_STORE_URL", "memory://")),
+        workers=workers,
+        max_size=queue_size if queue_size is not None else int(os.getenv("API_QUEUE_SIZE", DEFAULT_QUEUE_SIZE)),
+        job_ttl_seconds=job_ttl_seconds if job_ttl_seconds is not None else float(os.getenv("API_JOB_TTL_SECONDS", DEFAULT_JOB_TTL_SECONDS)),
+        pool=pool
+    )
+
+    @asynccontextmanager
+    async def lifespan(app: FastAPI):
+        queue.start()
+        logger.info(f"API iniciada com {queue.workers} worker(s) e fila de até {queue.max_size} job(s)" + (f" em {pool.processes} processo(s)" if pool else ""))
+        yield
+        await queue.stop()
+
+    app = FastAPI(title="LabLIA - API de Agentes", lifespan=lifespan)
+    app.state.job_queue = queue
+
+    def get_job_or_404(job_id: str):
+        job = queue.get(job_id)
+        if job is None:
+            raise HTTPException(status_code=404, detail=f"Job não encontrado: {job_id}")
+        return job
+
+    @app.get("/health")
+    async def health():
+        if pool is None:
+            return {"status": "ok", "fila": queue.pending, "jobs": len(queue.jobs)}
+        # Processos reiniciados após uma falha aparecem como "iniciando" até ficarem prontos
+        pool_health = pool.health()
+        healthy = not pool_health["encerrado"] and pool_health["ativos"] + pool_health["iniciando"] == pool_health["processos"]
+        return JSONResponse(
+            {"status": "ok" if healthy else "degradado", "fila": queue.pending, "jobs": len(queue.jobs), "pool": pool_health},
+            status_code=200 if not pool_health["encerrado"] else 503
+        )
+
+    @app.get("/agents")
+    async def list_agents():
+        return [{"nome": spec.name, "descricao": spec.description} for spec in registry.specs]
+
+    @app.post("/jobs", status_code=202)
+    async def submit_job(
+        agent: str = Form(..., description="Nome do agente (ver GET /agents)"),
+        message: str = Form(DEFAULT_API_MESSAGE, description="Mensagem enviada junto com os documentos"),
+        model: Optional[str] = Form(None, description="Modelo LLM (padrão: modelos do agente)"),
+        narrative: bool = Form(False, description="Gera o resumo com o LLM em vez do relatório montado por template"),
+        files: Optional[List[UploadFile]] = File(None, description="Imagens, PDFs ou XMLs da NF-e"),
+        idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key"),
+    ):
+        if agent not in registry:
+            raise HTTPException(status_code=404, detail=f"Agente não encontrado: {agent}")
+        if model is not None and model not in DEFAULT_MODELS_PRETTY_NAME:
+            raise HTTPException(status_code=422, detail=f"Modelo inválido: {model} (opções: {', '.join(DEFAULT_MODELS_PRETTY_NAME)})")
+        if pool is not None and pool.closed:
+            raise HTTPException(status_code=503, detail="Pool de processos dos agentes indisponível")
+
+        # Tipo e tamanho de cada arquivo são conferidos antes da leitura completa
+        try:
+            file_bytes = [await asyncio.to_thread(read_file_guarded, upload.file, upload.filename, upload.size) for upload in files or []]
+        except UnsupportedFileTypeError as e:
+            raise HTTPException(status_code=415, detail=str(e))
+        except FileTooLargeError as e:
+            raise HTTPException(status_code=413, detail=str(e))
+        except IngestionError as e:
+            raise HTTPException(status_code=422, detail=str(e))
+
+        try:
+            job, created = queue.submit(
+                agent,
+                message,
+                model,
+                file_bytes,
+                state={NARRATIVE_STATE_KEY: narrative},
+                idempotency_key=idempotency_key
+            )
+        except IdempotencyConflictError as e:
+            raise HTTPException(status_code=409, detail=str(e))
+        except QueueFullError as e:
+            raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": str(RETRY_AFTER_SECONDS)})
+
+        # Reenvio com a mesma chave de idempotência: devolve o job existente
+        return JSONResponse(job.to_dict(), status_code=202 if created else 200, headers={"Location": f"/jobs/{job.id}"})
+
+    @app.get("/jobs/{job_id}")
+    async def get_job(job_id: str):
+        return get_job_or_404(job_id).to_dict()
+
+    @app.get("/jobs/{job_id}/events")
+    async def stream_job_events(job_id: str):
+        job = get_job_or_404(job_id)
+
+        async def event_stream():
+            async for event in job.follow():
+                yield f"event: {event['tipo']}\ndata: {json.dumps(event, ensure_ascii=False, default=str)}\n\n"
+
+        return StreamingResponse(event_stream(), media_type="text/event-stream")
+
+    return app
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="API HTTP dos agentes (fila de jobs com workers assíncronos)")
+    parser.add_argument("--host", default="127.0.0.1", help="Endereço do servidor")
+    parser.add_argument("--porta", type=int, default=8000, help="Porta do servidor")
+    parser.add_argument("-w", "--workers", type=int, default=None, help="Jobs executados ao mesmo tempo (padrão: API_WORKERS ou 4)")
+    parser.add_argument("--fila", type=int, default=None, help="Tamanho máximo da fila (padrão: API_QUEUE_SIZE ou 100)")
+    parser.add_argument("-p", "--processos", type=int, default=None, help="Processos que executam os agentes (padrão: API_WORKER_PROCESSES ou 0, no processo da API)")
+    args = parser.parse_args(argv)
+
+    if os.path.exists('.env'):
+        dotenv.load_dotenv(override=True)
+
+    import uvicorn
+
+    logging.basicConfig(level=logging.INFO)
+    uvicorn.run(create_app(workers=args.workers, queue_size=args.fila, processes=args.processos), host=args.host, port=args.porta)
+
+
+if __name__ == "__main__":
+    main()
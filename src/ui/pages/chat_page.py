@@ -1,33 +1,123 @@
 import streamlit as st
-import asyncio
 import os
 import dotenv
 
-from src.agents.agent_config import run_agent_query, DEFAULT_MODELS_PRETTY_NAME
-from google.adk.sessions import Session, InMemorySessionService
-from google.adk.agents import LlmAgent
-
-from typing import List
+from src.agents.agent_config import stream_agent_query, get_session_service, DEFAULT_MODELS_PRETTY_NAME, NARRATIVE_STATE_KEY
+from src.agents.agent_registry import AgentRegistry, get_agent_registry
+from src.agents.execution_service import get_execution_service
+from src.agents.instrumentation import TurnMetrics
+from src.agents.image_preprocessing import make_thumbnail
+from src.agents.ingestion import check_file_header, IngestionError, CONVERTED_MIME_TYPES, SNIFF_BYTES
 
 import uuid
 
+from typing import TYPE_CHECKING
+
+# Módulos que dependem do Google ADK são importados só depois que o agente selecionado é carregado,
+# para que a página seja exibida antes dessa importação (vários segundos na primeira execução)
+if TYPE_CHECKING:
+    from google.adk.agents import BaseAgent
+    from google.adk.sessions import BaseSessionService, Session
+    from src.agents.session_store import BlobStore
+
+# Mensagens do histórico exibidas por página (as mais antigas são carregadas sob demanda)
+CHAT_HISTORY_PAGE_SIZE = 20
+
+# Arquivos enviados no chat (guardados em disco; o histórico mantém apenas o hash e a miniatura)
+UPLOAD_BLOB_DIR = os.path.join(".cache", "uploads")
+
+@st.cache_resource
+def _create_upload_store() -> "BlobStore":
+    from src.agents.session_store import BlobStore
+
+    # Um BlobStore por servidor
+    return BlobStore(os.getenv("CHAT_UPLOAD_DIR", UPLOAD_BLOB_DIR))
+
+def get_upload_store() -> "BlobStore":
+    from src.agents.session_store import DEFAULT_IDLE_TTL_SECONDS
+
+    # Arquivos sem uso há mais tempo que as sessões inativas são removidos periodicamente (no mesmo intervalo delas)
+    upload_store = _create_upload_store()
+    upload_store.maybe_prune(float(os.getenv("SESSION_IDLE_TTL_SECONDS", DEFAULT_IDLE_TTL_SECONDS)))
+    return upload_store
+
+@st.cache_resource(show_spinner="Carregando agente...")
+def load_agent(agent_name: str) -> "BaseAgent":
+    # Importa e monta a árvore do agente na primeira seleção; compartilhada por todas as sessões
+    return get_agent_registry().load(agent_name)
+
+# Exibe um arquivo de uma mensagem do usuário: miniatura (imagens) e original carregado do disco sob demanda
+def render_message_file(file_info: dict, key: str):
+    file_type = file_info.get("file_type", "")
+    file_name = file_info.get("file_name", "Arquivo")
+
+    if file_type.startswith('image/'):
+        if file_info.get("thumbnail"):
+            st.image(file_info["thumbnail"], caption=f"Imagem enviada: {file_name}")
+        else:
+            st.write(f"🖼️ Imagem enviada: {file_name}")
+    elif file_type == 'application/pdf':
+        st.write(f"📄 PDF enviado: {file_name}")
+    elif file_type.endswith('/xml'):
+        st.write(f"🧾 XML enviado: {file_name}")
+    else:
+        st.write(f"📎 Arquivo enviado: {file_name}")
+
+    if file_type.startswith('image/') and st.toggle("Ver original", key=f"original_{key}"):
+        original = get_upload_store().get(file_info["file_digest"])
+        if original is None:
+            st.caption("O arquivo original não está mais disponível.")
+        else:
+            st.image(original, caption=file_name)
+
+# Cria a sessão da aba no serviço de sessões compartilhado, com o operador da aba como usuário
+def create_chat_session(execution_service, session_service: "BaseSessionService") -> "Session":
+    return execution_service.run(
+        session_service.create_session(
+            session_id=str(uuid.uuid4()),
+            app_name="agents",
+            user_id=st.session_state.operator_id
+        )
+    )
+
+# Recria a sessão da aba se ela foi removida por inatividade (SESSION_IDLE_TTL_SECONDS);
+# retorna True quando uma nova sessão foi criada
+def ensure_chat_session(execution_service, session_service: "BaseSessionService") -> bool:
+    from google.adk.sessions.base_session_service import GetSessionConfig
+
+    session = st.session_state.session
+    stored_session = execution_service.run(
+        session_service.get_session(
+            app_name=session.app_name,
+            user_id=session.user_id,
+            session_id=session.id,
+            config=GetSessionConfig(num_recent_events=1)
+        )
+    )
+    if stored_session is not None:
+        return False
+    st.session_state.session = create_chat_session(execution_service, session_service)
+    return True
+
 # Renderiza a página de chat com o agente
-def agent_chat_page(agent_list: List[LlmAgent]):
+def agent_chat_page(agent_registry: AgentRegistry):
     """
     Renderiza a página de chat com o agente
     
     Args:
-        agent_list (List[LlmAgent]): Lista de agentes disponíveis para seleção.
+        agent_registry (AgentRegistry): Registro dos agentes disponíveis para seleção.
     """
     
     if "messages" not in st.session_state:
         st.session_state.messages = []
-    if "uploaded_file" not in st.session_state:
-        st.session_state.uploaded_file = None
+    if "uploaded_files" not in st.session_state:
+        st.session_state.uploaded_files = []
+    # Operador da aba do navegador: usuário da sessão (estado "user:" próprio) e do limite de documentos simultâneos
+    if "operator_id" not in st.session_state:
+        st.session_state.operator_id = f"operador-{uuid.uuid4().hex[:12]}"
 
-    # Mapeamento - Nome: Agente
-    agents_by_name = {a.name: a for a in agent_list}
-    agent_names = list(agents_by_name.keys())
+    # Nomes dos agentes registrados (os módulos só são importados quando o agente é selecionado)
+    agent_names = agent_registry.names
     
     # Configuração da página
     st.set_page_config(
@@ -51,7 +141,10 @@ def agent_chat_page(agent_list: List[LlmAgent]):
             key="selected_agent_name"
         )
         
-        selected_agent = agents_by_name[st.session_state.selected_agent_name]
+        selected_agent = load_agent(st.session_state.selected_agent_name)
+        agent_description = agent_registry.get_spec(st.session_state.selected_agent_name).description
+        if agent_description:
+            st.caption(agent_description)
         
         st.header("Escolha um Modelo LLM")
         st.selectbox(
@@ -61,6 +154,13 @@ def agent_chat_page(agent_list: List[LlmAgent]):
             key="selected_llm_model"
         )
         
+        st.checkbox(
+            "Gerar resumo narrativo com o LLM",
+            value=False,
+            key="narrative_summary",
+            help="Sem esta opção o resultado é montado localmente a partir dos dados extraídos, sem chamadas ao LLM"
+        )
+
         st.markdown("""
         **Status:** Online
         
@@ -72,29 +172,34 @@ def agent_chat_page(agent_list: List[LlmAgent]):
         3. Aguarde a resposta do agente
         """)
         
+        # Contadores do cache de extração
+        from src.agents.extraction_cache import get_extraction_cache
+        extraction_cache = get_extraction_cache()
+        if extraction_cache is not None:
+            cache_stats = extraction_cache.stats()
+            st.caption(f"Cache de extração: {cache_stats['hits']} acerto(s), {cache_stats['misses']} falha(s), {cache_stats['entries']} entrada(s)")
+
         if st.button("🗑️ Limpar Conversa", type="secondary"):
             st.session_state.messages = []
+            st.session_state.history_limit = CHAT_HISTORY_PAGE_SIZE
             st.rerun()
 
     # Carrega variáveis de ambiente
     if os.path.exists('.env'):
         dotenv.load_dotenv(override=True)
 
-    # Inicializa os serviços (uma vez por sessão)
+    # Serviço de execução compartilhado: um event loop persistente para todas as sessões do servidor
+    execution_service = get_execution_service()
+
+    # Serviço de sessões compartilhado pelo servidor (persistente, com histórico limitado e
+    # remoção de sessões inativas); cada aba do navegador usa a sua própria sessão
     if 'session_service' not in st.session_state:
-        st.session_state.session_service = InMemorySessionService()
+        st.session_state.session_service = get_session_service()
 
     if 'session' not in st.session_state:
         try:
             # Criar e registrar sessão no session_service
-            session = asyncio.run(
-                st.session_state.session_service.create_session(
-                    session_id=str(uuid.uuid4()),
-                    app_name="agents",
-                    user_id="user_1"
-                )
-            )
-            st.session_state.session = session
+            st.session_state.session = create_chat_session(execution_service, st.session_state.session_service)
         except Exception as e:
             st.error(f"Erro ao criar sessão: {e}")
             st.stop()
@@ -103,20 +208,22 @@ def agent_chat_page(agent_list: List[LlmAgent]):
     if "messages" not in st.session_state:
         st.session_state.messages = []
 
-    # Exibir histórico de mensagens
-    for message in st.session_state.messages:
+    # Exibir histórico de mensagens (apenas as mais recentes; as anteriores são carregadas sob demanda)
+    if "history_limit" not in st.session_state:
+        st.session_state.history_limit = CHAT_HISTORY_PAGE_SIZE
+
+    hidden_messages = max(len(st.session_state.messages) - st.session_state.history_limit, 0)
+    if hidden_messages:
+        if st.button(f"⬆️ Carregar mensagens anteriores ({hidden_messages})"):
+            st.session_state.history_limit += CHAT_HISTORY_PAGE_SIZE
+            st.rerun()
+
+    for index, message in enumerate(st.session_state.messages[hidden_messages:], start=hidden_messages):
         with st.chat_message(message["role"]):
             if isinstance(message["content"], dict):
-                # Conteúdo estruturado (com arquivo)
-                if "file" in message["content"]:
-                    file_type = message["content"].get("file_type", "")
-                    file_name = message["content"].get("file_name", "Arquivo")
-                    if file_type.startswith('image/'):
-                        st.image(message["content"]["file"], caption=f"Imagem enviada: {file_name}", width=300)
-                    elif file_type == 'application/pdf':
-                        st.write(f"📄 PDF enviado: {file_name}")
-                    else:
-                        st.write(f"📎 Arquivo enviado: {file_name}")
+                # Conteúdo estruturado (com arquivos)
+                for file_index, file_info in enumerate(message["content"].get("files", [])):
+                    render_message_file(file_info, key=f"{index}_{file_index}")
                 if "text" in message["content"] and message["content"]["text"]:
                     st.markdown(message["content"]["text"])
             else:
@@ -128,81 +235,197 @@ def agent_chat_page(agent_list: List[LlmAgent]):
         # Preparar conteúdo da mensagem
         message_content = {"text": prompt.strip()}
 
-        # Processar arquivo se enviado
-        file_data = None
-        file_type = None
-        if st.session_state.uploaded_file is not None:
-            file_data = st.session_state.uploaded_file.getvalue()
-            file_type = st.session_state.uploaded_file.type.lower()
-            message_content["file"] = file_data
-            message_content["file_type"] = file_type
-            message_content["file_name"] = st.session_state.uploaded_file.name
+        # Processar arquivos se enviados
+        # O histórico guarda o hash (original em disco) e uma miniatura, não os bytes dos arquivos
+        documents = []
+        message_content["files"] = []
+        for uploaded_file in st.session_state.uploaded_files:
+            file_data = uploaded_file.getvalue()
+            file_type = uploaded_file.type.lower()
+            documents.append((uploaded_file.name, file_data))
+            message_content["files"].append({
+                "file_digest": get_upload_store().put(file_data),
+                "file_type": file_type,
+                "file_name": uploaded_file.name,
+                "thumbnail": make_thumbnail(file_data) if file_type.startswith('image/') else None,
+            })
 
         # Adicionar mensagem do usuário ao histórico
         st.session_state.messages.append({"role": "user", "content": message_content})
 
         # Exibir mensagem do usuário
         with st.chat_message("user"):
-            if file_data and file_type:
-                if file_type.startswith('image/'):
-                    st.image(file_data, caption="Imagem enviada", width=300)
-                elif file_type == 'application/pdf':
-                    st.write(f"📄 PDF enviado: {st.session_state.uploaded_file.name}")
-                else:
-                    st.write(f"📎 Arquivo enviado: {st.session_state.uploaded_file.name}")
+            for file_index, file_info in enumerate(message_content["files"]):
+                render_message_file(file_info, key=f"{len(st.session_state.messages) - 1}_{file_index}")
             st.markdown(message_content["text"])
         
         # Placeholder para resposta do assistente
         with st.chat_message("assistant"):
-            with st.spinner("Pensando..."):
-                try:
-                    # Preparar parâmetros para o agente
-                    agent_text = message_content["text"]
-                    agent_files = [file_data] if file_data else None
-
-                    # Executar query de forma assíncrona
-                    response = asyncio.run(run_agent_query(
+            status = st.status("Pensando...", expanded=len(documents) > 1)
+
+            # Métricas do turno (exibidas na barra lateral)
+            turn_metrics = TurnMetrics()
+
+            try:
+                # A sessão da aba pode ter sido removida por inatividade: o turno segue em uma sessão nova
+                if ensure_chat_session(execution_service, st.session_state.session_service):
+                    st.info("A sessão ficou inativa e foi encerrada; o agente continua em uma nova sessão, sem o contexto das mensagens anteriores.")
+
+                # Preparar parâmetros para o agente
+                agent_text = message_content["text"]
+                agent_files = [file_data for _, file_data in documents] or None
+                agent_state = {NARRATIVE_STATE_KEY: st.session_state.narrative_summary}
+
+                if len(documents) > 1:
+                    from src.agents.document_fanout import stream_documents_query
+
+                    # Vários documentos: um pipeline por documento, em paralelo, com o progresso de cada um
+                    document_lines = [status.empty() for _ in documents]
+                    for line, (name, _) in zip(document_lines, documents):
+                        line.write(f"⏳ {name}: na fila")
+                    progress_bar = st.progress(0.0, text=f"0 de {len(documents)} documento(s) concluído(s)")
+                    finished = 0
+                    response = ""
+
+                    for event in execution_service.iterate(stream_documents_query(
                         selected_agent,
                         st.session_state.session_service,
                         st.session_state.session,
                         agent_text,
+                        documents,
                         st.session_state.selected_llm_model,
-                        files=agent_files
-                    ))
+                        state=agent_state,
+                        concurrency_key=st.session_state.operator_id,
+                        metrics=turn_metrics
+                    )):
+                        if event.kind == "summary":
+                            response = event.text
+                            continue
 
-                    # Exibir resposta
+                        line = document_lines[event.index]
+                        if event.kind == "waiting":
+                            line.write(f"⏳ {event.name}: aguardando (limite de documentos simultâneos)")
+                        elif event.kind == "started":
+                            line.write(f"🔄 {event.name}: processando")
+                        elif event.kind == "stage":
+                            line.write(f"🔄 {event.name}: {event.text}")
+                        else:
+                            finished += 1
+                            line.write(f"✅ {event.name}: concluído" if event.kind == "done" else f"❌ {event.name}: {event.text}")
+                            progress_bar.progress(finished / len(documents), text=f"{finished} de {len(documents)} documento(s) concluído(s)")
+                            status.update(label=f"{finished} de {len(documents)} documento(s) concluído(s)")
+
+                    progress_bar.empty()
                     st.markdown(response)
+                else:
+                    # Executar query no loop do serviço de execução, exibindo a resposta à medida que chega
+                    def response_stream():
+                        for event in execution_service.iterate(stream_agent_query(
+                            selected_agent,
+                            st.session_state.session_service,
+                            st.session_state.session,
+                            agent_text,
+                            st.session_state.selected_llm_model,
+                            files=agent_files,
+                            metrics=turn_metrics,
+                            state=agent_state
+                        )):
+                            if event.kind == "stage":
+                                # Etapas intermediárias (ex.: extração concluída) aparecem antes da resposta final
+                                status.update(label=event.text)
+                                status.write(f"✅ {event.text}")
+                                if event.data:
+                                    status.json(event.data, expanded=False)
+                            else:
+                                yield event.text
+
+                    response = st.write_stream(response_stream())
+                    if not isinstance(response, str):
+                        response = "".join(str(chunk) for chunk in response)
+                    if not response:
+                        response = "Nenhuma resposta recebida do agente."
+                        st.markdown(response)
+                status.update(label="Concluído", state="complete")
 
-                    # Adicionar resposta ao histórico
-                    st.session_state.messages.append({"role": "assistant", "content": response})
+                # Adicionar resposta ao histórico
+                st.session_state.messages.append({"role": "assistant", "content": response})
 
-                except Exception as e:
-                    error_msg = f"Erro ao processar mensagem: {str(e)}"
-                    st.error(error_msg)
-                    st.session_state.messages.append({"role": "assistant", "content": error_msg})
+            except Exception as e:
+                status.update(label="Erro", state="error")
+                error_msg = f"Erro ao processar mensagem: {str(e)}"
+                st.error(error_msg)
+                st.session_state.messages.append({"role": "assistant", "content": error_msg})
 
-        # Limpar o arquivo após processamento (para permitir novo upload)
-        st.session_state.uploaded_file = None
+            if turn_metrics.total_time_s is not None:
+                st.session_state.last_turn_metrics = turn_metrics.to_dict()
 
-    uploaded_file = st.file_uploader(
-        "📎 Enviar arquivo (opcional)",
-        type=["png", "jpg", "jpeg", "gif", "webp", "pdf"],
+        # Limpar os arquivos após processamento (para permitir novo upload)
+        st.session_state.uploaded_files = []
+
+    uploaded_files = st.file_uploader(
+        "📎 Enviar arquivos (opcional)",
+        type=["png", "jpg", "jpeg", "gif", "webp", "tif", "tiff", "bmp", "heic", "heif", "pdf", "xml"],
+        accept_multiple_files=True,
         key="file_upload",
-        help="Selecione uma imagem ou PDF para enviar junto com sua mensagem"
+        help="Selecione imagens (inclusive TIFF de scanners e HEIC de celulares), PDFs ou XMLs da NF-e; com vários arquivos, cada documento é processado em paralelo"
     )
 
-    # Atualizar estado do arquivo
-    if uploaded_file is not None:
-        st.session_state.uploaded_file = uploaded_file
+    # Atualizar estado dos arquivos, recusando (pelo conteúdo, não pela extensão) os de tipo não suportado ou grandes demais
+    if uploaded_files:
+        accepted_files = []
+        for uploaded_file in uploaded_files:
+            try:
+                check_file_header(uploaded_file.getvalue()[:SNIFF_BYTES], uploaded_file.size, uploaded_file.name)
+            except IngestionError as e:
+                st.error(f"Arquivo recusado: {e}")
+                continue
+            accepted_files.append(uploaded_file)
+        st.session_state.uploaded_files = accepted_files
 
-    # Mostrar preview do arquivo selecionado
-    if st.session_state.uploaded_file is not None:
-        file_type = st.session_state.uploaded_file.type.lower()
-        if file_type.startswith('image/'):
-            st.image(st.session_state.uploaded_file, caption="Imagem selecionada", width=200)
+    # Mostrar preview dos arquivos selecionados
+    for uploaded_file in st.session_state.uploaded_files:
+        file_type = uploaded_file.type.lower()
+        if file_type in CONVERTED_MIME_TYPES:
+            # TIFF/BMP/HEIC não são exibidos pelo navegador: mostra uma miniatura JPEG, se possível
+            thumbnail = make_thumbnail(uploaded_file.getvalue())
+            if thumbnail:
+                st.image(thumbnail, caption=f"Imagem selecionada: {uploaded_file.name}", width=200)
+            else:
+                st.write(f"🖼️ Imagem selecionada: {uploaded_file.name}")
+        elif file_type.startswith('image/'):
+            st.image(uploaded_file, caption=f"Imagem selecionada: {uploaded_file.name}", width=200)
         elif file_type == 'application/pdf':
-            st.write(f"📄 PDF selecionado: {st.session_state.uploaded_file.name}")
+            st.write(f"📄 PDF selecionado: {uploaded_file.name}")
+        elif file_type.endswith('/xml'):
+            st.write(f"🧾 XML selecionado: {uploaded_file.name}")
         else:
-            st.write(f"📎 Arquivo selecionado: {st.session_state.uploaded_file.name}")
+            st.write(f"📎 Arquivo selecionado: {uploaded_file.name}")
+
+    # Painel de métricas do último turno
+    last_turn_metrics = st.session_state.get("last_turn_metrics")
+    if last_turn_metrics:
+        with st.sidebar:
+            st.write("---")
+            st.header("Métricas do Último Turno")
+            st.caption(
+                f"Total: {last_turn_metrics['total_time_s']:.2f}s · "
+                f"Envio + primeira resposta: {(last_turn_metrics['first_event_s'] or 0):.2f}s · "
+                f"Envio: {last_turn_metrics['upload_bytes'] / 1024:.0f} KB"
+            )
+            st.dataframe(
+                [
+                    {
+                        "Etapa": stage["author"],
+                        "Modelo": stage["model_id"] or "-",
+                        "Tempo (s)": stage["wall_time_s"],
+                        "Tokens entrada": stage["prompt_tokens"],
+                        "Tokens saída": stage["response_tokens"],
+                        "Tokens em cache": stage["cached_tokens"],
+                        "Bytes": stage["payload_bytes"],
+                    }
+                    for stage in last_turn_metrics["stages"]
+                ],
+                hide_index=True
+            )
 
     # st.write(st.session_state.session.events)
\ No newline at end of file
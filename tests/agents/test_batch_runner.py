@@ -0,0 +1,49 @@
+import asyncio
+import json
+
+from google.adk.agents import BaseAgent
+
+from src.agents.batch_runner import input_key, load_completed_inputs, run_batch
+
+
+class UnusedAgent(BaseAgent):
+    async def _run_async_impl(self, ctx):
+        raise AssertionError("nenhum documento deveria ser processado")
+        yield
+
+
+def test_input_key_normalizes_relative_paths(tmp_path, monkeypatch):
+    (tmp_path / "notas").mkdir()
+    monkeypatch.chdir(tmp_path / "notas")
+
+    assert input_key("a.png") == str(tmp_path / "notas" / "a.png")
+    assert input_key(tmp_path / "outras" / ".." / "notas" / "a.png") == input_key("a.png")
+
+
+def test_load_completed_inputs_skips_corrupted_lines(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    output_path = tmp_path / "resultados.jsonl"
+    output_path.write_bytes(
+        json.dumps({"arquivo": "a.png", "status": "ok"}).encode() + b"\n"
+        + b'{"arquivo": "\xff\xfe.png", "status": "ok"}\n'
+        + b"[1, 2]\n"
+        + json.dumps({"arquivo": "b.png", "status": "erro"}).encode() + b"\n"
+        + json.dumps({"status": "ok"}).encode() + b"\n"
+        + b'{"arquivo": "c.png", "sta'
+    )
+
+    assert load_completed_inputs(str(output_path)) == {str(tmp_path / "a.png")}
+
+
+def test_resume_matches_paths_and_appends_after_truncated_line(tmp_path, monkeypatch):
+    document = tmp_path / "notas" / "a.png"
+    document.parent.mkdir()
+    document.write_bytes(b"")
+    output_path = tmp_path / "resultados.jsonl"
+    # Registro de uma execução chamada de dentro de notas/ seguido de uma linha cortada
+    output_path.write_text(json.dumps({"arquivo": str(document), "status": "ok"}) + "\n" + '{"arquivo": "x.png"')
+
+    monkeypatch.chdir(tmp_path)
+    summary = asyncio.run(run_batch([document.relative_to(tmp_path)], str(output_path), UnusedAgent(name="agente")))
+    assert summary == {"ok": 0, "erro": 0, "ignorado": 1}
+    assert output_path.read_text().endswith('"x.png"\n')
@@ -0,0 +1,36 @@
+from src.agents.nfe_sequential_agent.chunked_extraction import merge_chunk_products
+
+
+def _product(codigo: str, quantidade: float = 1.0) -> dict:
+    return {"codigo": codigo, "descricao": f"Item {codigo}", "preco_unidade": 1.0, "quantidade": quantidade, "preco_total": "1,00"}
+
+
+def test_pages_keep_every_product():
+    # Páginas de um PDF não se sobrepõem: a mesma linha em duas páginas é mantida
+    pages = [[_product("A"), _product("B")], [_product("B"), _product("C")]]
+
+    assert merge_chunk_products(pages) == [_product("A"), _product("B"), _product("B"), _product("C")]
+
+
+def test_overlapping_tiles_drop_repeated_products():
+    tiles = [[_product("A"), _product("B")], [_product("B"), _product("C")]]
+
+    assert merge_chunk_products(tiles, [False, True]) == [_product("A"), _product("B"), _product("C")]
+
+
+def test_overlapping_tiles_keep_same_code_with_other_values():
+    tiles = [[_product("A", 1.0)], [_product("A", 2.0)]]
+
+    assert merge_chunk_products(tiles, [False, True]) == [_product("A", 1.0), _product("A", 2.0)]
+
+
+def test_each_previous_product_drops_one_repeat():
+    tiles = [[_product("A")], [_product("A"), _product("A")]]
+
+    assert merge_chunk_products(tiles, [False, True]) == [_product("A"), _product("A")]
+
+
+def test_only_the_previous_chunk_is_compared():
+    tiles = [[_product("A")], [_product("B")], [_product("A")]]
+
+    assert merge_chunk_products(tiles, [False, True, True]) == [_product("A"), _product("B"), _product("A")]
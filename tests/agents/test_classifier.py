@@ -0,0 +1,32 @@
+import pytest
+
+from src.agents.doc_data_extractor.classifier import classify_by_keywords
+
+CNH = "carteira_nacional_de_habilitacao_cnh"
+RG = "carteira_de_identidade_rg"
+
+
+@pytest.mark.parametrize("text, expected", [
+    ("Extraia os dados da CNH", CNH),
+    ("minha carteira de habilitação", CNH),
+    ("documento de identidade: CNH", CNH),
+    ("Extraia os dados do RG", RG),
+    ("Carteira de Identidade", RG),
+    ("registro geral do cliente", RG),
+])
+def test_classify_by_keywords(text, expected):
+    classification = classify_by_keywords(text)
+
+    assert classification is not None
+    assert classification.agent_name == expected
+
+
+@pytest.mark.parametrize("text", [
+    "Extraia os dados do documento",
+    "documento de identidade",
+    "minha carteira de identidade de motorista",
+    "envio a CNH e o RG",
+    "cargo de diretor",
+])
+def test_classify_by_keywords_leaves_ambiguous_messages_to_the_coordinator(text):
+    assert classify_by_keywords(text) is None
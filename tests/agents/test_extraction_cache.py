@@ -0,0 +1,55 @@
+import asyncio
+
+from google.adk.agents import LlmAgent
+from google.genai import types
+
+from src.agents import extraction_cache
+from src.agents.extraction_cache import ExtractionCache, discard_extraction, make_cache_key, store_extraction
+
+
+def make_agent():
+    return LlmAgent(name="extrator", model="gemini-2.5-flash", instruction="Extraia os dados", output_key="dados")
+
+
+def make_user_content(document: bytes):
+    return types.Content(role="user", parts=[types.Part(text="Extraia"), types.Part.from_bytes(data=document, mime_type="image/png")])
+
+
+def test_cache_delete_removes_entry(tmp_path):
+    cache = ExtractionCache(db_path=str(tmp_path / "cache.sqlite3"))
+    key = make_cache_key([b"documento"], "extrator", "gemini-2.5-flash", "instrucao")
+
+    cache.put(key, "extrator", "gemini-2.5-flash", {"valor": 1})
+    assert cache.get(key) == {"valor": 1}
+
+    cache.delete(key)
+    assert cache.get(key) is None
+    assert cache.stats()["entries"] == 0
+
+
+def test_store_and_discard_extraction(tmp_path, monkeypatch):
+    cache = ExtractionCache(db_path=str(tmp_path / "cache.sqlite3"))
+    monkeypatch.setattr(extraction_cache, "_extraction_cache", cache)
+    monkeypatch.delenv("EXTRACTION_CACHE_ENABLED", raising=False)
+
+    agent = make_agent()
+    user_content = make_user_content(b"documento")
+
+    asyncio.run(store_extraction(agent, user_content, {"valor": 1}))
+    assert cache.stats()["entries"] == 1
+
+    # Outro documento não compartilha a entrada
+    asyncio.run(discard_extraction(agent, make_user_content(b"outro")))
+    assert cache.stats()["entries"] == 1
+
+    asyncio.run(discard_extraction(agent, user_content))
+    assert cache.stats()["entries"] == 0
+
+
+def test_store_extraction_ignores_messages_without_documents(tmp_path, monkeypatch):
+    cache = ExtractionCache(db_path=str(tmp_path / "cache.sqlite3"))
+    monkeypatch.setattr(extraction_cache, "_extraction_cache", cache)
+    monkeypatch.delenv("EXTRACTION_CACHE_ENABLED", raising=False)
+
+    asyncio.run(store_extraction(make_agent(), types.Content(role="user", parts=[types.Part(text="Oi")]), {"valor": 1}))
+    assert cache.stats()["entries"] == 0
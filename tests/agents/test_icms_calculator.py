@@ -0,0 +1,62 @@
+from decimal import Decimal
+
+import pytest
+
+from src.agents.nfe_sequential_agent.icms_calculator import calculate_icms, parse_brl_decimal
+from src.agents.nfe_sequential_agent.pydantic_schema import NotaFiscalData, Produto
+
+
+@pytest.mark.parametrize("value, expected", [
+    ("R$ 1.234,56", Decimal("1234.56")),
+    ("1234.56", Decimal("1234.56")),
+    ("1,234.56", Decimal("1234.56")),
+    ("1.234", Decimal("1234")),
+    ("12.345.678", Decimal("12345678")),
+    ("0,5", Decimal("0.5")),
+    ("-10,00", Decimal("-10.00")),
+    (10, Decimal("10")),
+    (0.1, Decimal("0.1")),
+    (Decimal("3.14"), Decimal("3.14")),
+])
+def test_parse_brl_decimal(value, expected):
+    assert parse_brl_decimal(value) == expected
+
+
+@pytest.mark.parametrize("value", ["", "abc", "R$"])
+def test_parse_brl_decimal_rejects_non_numbers(value):
+    with pytest.raises(ValueError):
+        parse_brl_decimal(value)
+
+
+def _nota_fiscal(valor_total: str, valor_icms: str, totals: list) -> NotaFiscalData:
+    return NotaFiscalData(
+        destinatario_nome="Fulano",
+        valor_total=valor_total,
+        valor_ICMS=valor_icms,
+        produtos=[
+            Produto(codigo=f"P{i}", descricao=f"Produto {i}", preco_unidade=1.0, quantidade=1, preco_total=total)
+            for i, total in enumerate(totals)
+        ]
+    )
+
+
+def test_calculate_icms_proportional_per_product():
+    result = calculate_icms(_nota_fiscal("1.000,00", "180,00", ["600,00", "400,00"]))
+
+    assert result.porcentagem_icms == 18.0
+    assert [(item.codigo, item.valor_icms) for item in result.imposto_produtos] == [("P0", 108.0), ("P1", 72.0)]
+
+
+def test_calculate_icms_rounds_only_at_the_end():
+    # 7/30 = 23,333...%: o ICMS de cada produto usa a razão exata, não a porcentagem arredondada
+    result = calculate_icms(_nota_fiscal("30,00", "7,00", ["10,00", "20,00"]))
+
+    assert result.porcentagem_icms == 23.33
+    assert [item.valor_icms for item in result.imposto_produtos] == [2.33, 4.67]
+
+
+def test_calculate_icms_zero_total():
+    result = calculate_icms(_nota_fiscal("0,00", "0,00", ["0,00"]))
+
+    assert result.porcentagem_icms == 0.0
+    assert result.imposto_produtos[0].valor_icms == 0.0
@@ -0,0 +1,78 @@
+import pytest
+
+from src.agents.ingestion import (
+    MB,
+    FileTooLargeError,
+    UnsupportedFileTypeError,
+    check_file_header,
+    sniff_mime_type,
+)
+
+
+@pytest.fixture(autouse=True)
+def default_limits(monkeypatch):
+    monkeypatch.delenv("INGESTION_MAX_FILE_MB", raising=False)
+    monkeypatch.delenv("INGESTION_MAX_MESSAGE_MB", raising=False)
+
+
+@pytest.mark.parametrize("head, expected", [
+    (b"%PDF-1.7\n", "application/pdf"),
+    (b"\xff\xd8\xff\xe0\x00\x10JFIF", "image/jpeg"),
+    (b"\x89PNG\r\n\x1a\n\x00\x00", "image/png"),
+    (b"GIF89a\x01\x00", "image/gif"),
+    (b"RIFF\x10\x00\x00\x00WEBPVP8 ", "image/webp"),
+    (b"II*\x00\x08\x00", "image/tiff"),
+    (b"\x00\x00\x00\x18ftypheic", "image/heic"),
+    (b"\x00\x00\x00\x18ftypmif1", "image/heif"),
+    (b"\xef\xbb\xbf  <?xml version='1.0'?>", "text/xml"),
+    (b"<nfeProc versao='4.00'>", "text/xml"),
+])
+def test_sniff_mime_type_by_content(head, expected):
+    assert sniff_mime_type(head) == expected
+
+
+def test_sniff_mime_type_ignores_misleading_extension():
+    assert sniff_mime_type(b"%PDF-1.4", "foto.png") == "application/pdf"
+
+
+def test_sniff_mime_type_requires_every_signature_check():
+    # RIFF sem a marca WEBP (ex.: áudio WAV) não é uma imagem
+    assert sniff_mime_type(b"RIFF\x10\x00\x00\x00WAVEfmt ") is None
+
+
+@pytest.mark.parametrize("filename, expected", [
+    ("nota.xml", "text/xml"),
+    ("foto.jpg", "image/jpeg"),
+    ("planilha.xlsx", None),
+    (None, None),
+])
+def test_sniff_mime_type_falls_back_to_extension(filename, expected):
+    assert sniff_mime_type(b"\x00\x01\x02\x03", filename) == expected
+
+
+def test_check_file_header_returns_mime_type():
+    assert check_file_header(b"%PDF-1.7", 1 * MB, "nota.pdf") == "application/pdf"
+    assert check_file_header(b"%PDF-1.7", None) == "application/pdf"
+
+
+def test_check_file_header_rejects_unsupported_types():
+    with pytest.raises(UnsupportedFileTypeError, match="planilha.xlsx"):
+        check_file_header(b"PK\x03\x04", 1000, "planilha.xlsx")
+
+
+def test_check_file_header_applies_type_limits():
+    with pytest.raises(FileTooLargeError, match="nota.pdf"):
+        check_file_header(b"%PDF-1.7", 13 * MB, "nota.pdf")
+    # Imagens são reduzidas antes do envio e aceitam arquivos maiores
+    assert check_file_header(b"\xff\xd8\xff\xe0", 13 * MB, "foto.jpg") == "image/jpeg"
+
+
+def test_check_file_header_environment_limits(monkeypatch):
+    monkeypatch.setenv("INGESTION_MAX_FILE_MB", "1")
+    with pytest.raises(FileTooLargeError):
+        check_file_header(b"\xff\xd8\xff\xe0", 2 * MB, "foto.jpg")
+
+    monkeypatch.delenv("INGESTION_MAX_FILE_MB")
+    monkeypatch.setenv("INGESTION_MAX_MESSAGE_MB", "2")
+    with pytest.raises(FileTooLargeError):
+        check_file_header(b"%PDF-1.7", 3 * MB, "nota.pdf")
@@ -0,0 +1,52 @@
+import pytest
+
+from src.agents.nfe_sequential_agent.local_extraction import parse_nfe_xml
+
+
+def _nfe_xml(dets: str, dest: str = "<dest><xNome>Fulano de Tal</xNome></dest>", namespace: bool = True) -> bytes:
+    xmlns = ' xmlns="http://www.portalfiscal.inf.br/nfe"' if namespace else ""
+    return (
+        f'<?xml version="1.0" encoding="UTF-8"?><nfeProc{xmlns} versao="4.00"><NFe><infNFe Id="NFe1" versao="4.00">'
+        f"<emit><xNome>Emitente</xNome></emit>{dest}{dets}"
+        "<total><ICMSTot><vICMS>216.00</vICMS><vNF>1234.5</vNF></ICMSTot></total>"
+        "</infNFe></NFe><protNFe/></nfeProc>"
+    ).encode()
+
+
+def _det(codigo: str, quantidade: str, unitario: str, total: str) -> str:
+    return (
+        f"<det><prod><cProd>{codigo}</cProd><xProd>Item {codigo}</xProd>"
+        f"<qCom>{quantidade}</qCom><vUnCom>{unitario}</vUnCom><vProd>{total}</vProd></prod></det>"
+    )
+
+
+@pytest.mark.parametrize("namespace", [True, False])
+def test_parse_nfe_xml(namespace):
+    nota_fiscal = parse_nfe_xml(_nfe_xml(_det("A1", "2.5000", "10.00", "25.00") + _det("B2", "3", "403.1667", "1209.50"), namespace=namespace))
+
+    assert nota_fiscal.destinatario_nome == "Fulano de Tal"
+    assert nota_fiscal.valor_total == "1.234,50"
+    assert nota_fiscal.valor_ICMS == "216,00"
+    assert [(p.codigo, p.quantidade, p.preco_unidade, p.preco_total) for p in nota_fiscal.produtos] == [
+        ("A1", 2.5, 10.0, "25,00"),
+        ("B2", 3.0, 403.1667, "1.209,50"),
+    ]
+
+
+def test_parse_nfe_xml_accepts_file_objects(tmp_path):
+    path = tmp_path / "nfe.xml"
+    path.write_bytes(_nfe_xml(_det("A1", "1", "1.00", "1.00")))
+
+    with path.open("rb") as file:
+        assert len(parse_nfe_xml(file).produtos) == 1
+
+
+@pytest.mark.parametrize("content, message", [
+    (b"<nfeProc><NFe>", "XML inválido"),
+    (b"<?xml version='1.0'?><outro/>", "infNFe"),
+    (_nfe_xml(_det("A1", "1", "1.00", "1.00"), dest=""), "dest/xNome"),
+    (_nfe_xml("<det><prod><cProd>A1</cProd></prod></det>"), "prod/xProd"),
+])
+def test_parse_nfe_xml_rejects_invalid_documents(content, message):
+    with pytest.raises(ValueError, match=message):
+        parse_nfe_xml(content)
@@ -0,0 +1,36 @@
+import pytest
+
+from src.agents.nfe_sequential_agent.icms_calculator import calculate_icms
+from src.agents.nfe_sequential_agent.pydantic_schema import NotaFiscalData, Produto
+from src.agents.nfe_sequential_agent.report import render_nfe_report
+
+
+def _nota_fiscal() -> NotaFiscalData:
+    # A mesma mercadoria em duas linhas, com valores diferentes
+    return NotaFiscalData(
+        destinatario_nome="Fulano",
+        valor_total="300,00",
+        valor_ICMS="54,00",
+        produtos=[
+            Produto(codigo="A", descricao="Cimento", preco_unidade=10.0, quantidade=10, preco_total="100,00"),
+            Produto(codigo="A", descricao="Cimento", preco_unidade=10.0, quantidade=20, preco_total="200,00"),
+        ]
+    )
+
+
+def test_repeated_codes_keep_their_own_icms():
+    nota_fiscal = _nota_fiscal()
+    report = render_nfe_report(nota_fiscal.model_dump(), calculate_icms(nota_fiscal).model_dump())
+
+    assert "| A | Cimento | R$ 100,00 | R$ 18,00 |" in report
+    assert "| A | Cimento | R$ 200,00 | R$ 36,00 |" in report
+    assert "**Porcentagem do ICMS:** 18,00%" in report
+
+
+def test_icms_must_have_one_item_per_product():
+    nota_fiscal = _nota_fiscal()
+    icms_result = calculate_icms(nota_fiscal).model_dump()
+    icms_result["imposto_produtos"].pop()
+
+    with pytest.raises(ValueError):
+        render_nfe_report(nota_fiscal.model_dump(), icms_result)
@@ -0,0 +1,155 @@
+import asyncio
+import sqlite3
+import time
+
+import pytest
+
+from src.agents.rate_limiter import (
+    BATCH_PRIORITY,
+    INTERACTIVE_PRIORITY,
+    ModelRateLimiter,
+    RateLimit,
+    SharedModelRateLimiter,
+    TokenBucket,
+    load_rate_limits,
+)
+
+
+def test_token_bucket_waits_for_refill():
+    bucket = TokenBucket(capacity=10, refill_per_second=2)
+    now = bucket.updated_at
+
+    assert bucket.wait_time(10, now) == 0
+    bucket.consume(10, now)
+    assert bucket.wait_time(1, now) == pytest.approx(0.5)
+    assert bucket.wait_time(1, now + 0.25) == pytest.approx(0.25)
+    assert bucket.wait_time(1, now + 1) == 0
+
+
+def test_token_bucket_caps_amount_and_refill_at_capacity():
+    bucket = TokenBucket(capacity=10, refill_per_second=1)
+    now = bucket.updated_at
+
+    # Pedidos maiores que o balde esperam apenas até o balde encher
+    bucket.consume(100, now)
+    assert bucket.tokens == 0
+    assert bucket.wait_time(100, now) == pytest.approx(10)
+
+    bucket.adjust(50)
+    assert bucket.tokens == 10
+    assert bucket.wait_time(1, now + 60) == 0
+    assert bucket.tokens == 10
+
+
+def test_token_bucket_adjust_charges_extra_usage():
+    bucket = TokenBucket(capacity=10, refill_per_second=1)
+
+    bucket.adjust(-15)
+    assert bucket.wait_time(1, bucket.updated_at) == pytest.approx(6)
+
+
+def test_acquire_is_immediate_within_quota():
+    limiter = ModelRateLimiter("modelo", RateLimit(rpm=60, tpm=10_000))
+
+    async def acquire_all():
+        return [await limiter.acquire(100) for _ in range(5)]
+
+    assert all(waited < 0.05 for waited in asyncio.run(acquire_all()))
+    assert limiter.requests.tokens == pytest.approx(55, abs=0.1)
+    assert limiter.tokens.tokens == pytest.approx(9_500, abs=5)
+
+
+def test_acquire_waits_for_requests_and_tokens():
+    limiter = ModelRateLimiter("modelo", RateLimit(rpm=600, tpm=6_000))
+    limiter.requests.tokens = 0
+    assert asyncio.run(limiter.acquire(1)) >= 0.08
+
+    limiter = ModelRateLimiter("modelo", RateLimit(rpm=600, tpm=6_000))
+    limiter.tokens.tokens = 0
+    # 6.000 tokens por minuto = 100 por segundo
+    assert asyncio.run(limiter.acquire(20)) >= 0.18
+
+
+def test_acquire_waits_while_blocked():
+    limiter = ModelRateLimiter("modelo", RateLimit(rpm=600, tpm=10_000))
+    limiter.block(0.2)
+
+    assert limiter.exhausted
+    assert asyncio.run(limiter.acquire(1)) >= 0.18
+    assert not limiter.exhausted
+
+
+def test_settle_returns_unused_tokens():
+    limiter = ModelRateLimiter("modelo", RateLimit(rpm=60, tpm=10_000))
+    asyncio.run(limiter.acquire(1_000))
+
+    limiter.settle(estimated_tokens=1_000, actual_tokens=200)
+    assert limiter.tokens.tokens == pytest.approx(9_800, abs=5)
+
+
+def test_interactive_requests_go_first():
+    limiter = ModelRateLimiter("modelo", RateLimit(rpm=600, tpm=10_000))
+    limiter.requests.tokens = 0
+    order = []
+
+    async def request(priority, label):
+        await limiter.acquire(1, priority)
+        order.append(label)
+
+    async def run():
+        batch = asyncio.create_task(request(BATCH_PRIORITY, "lote"))
+        await asyncio.sleep(0)
+        await asyncio.gather(batch, request(INTERACTIVE_PRIORITY, "chat"))
+
+    asyncio.run(run())
+    assert order == ["chat", "lote"]
+
+
+def test_shared_limiter_splits_quota_between_instances(tmp_path):
+    db_path = str(tmp_path / "rate_limits.sqlite3")
+    first = SharedModelRateLimiter("modelo", RateLimit(rpm=2, tpm=10_000), db_path)
+    second = SharedModelRateLimiter("modelo", RateLimit(rpm=2, tpm=10_000), db_path)
+
+    async def run():
+        await first.acquire(1)
+        await first.acquire(1)
+        with pytest.raises(asyncio.TimeoutError):
+            await asyncio.wait_for(second.acquire(1), timeout=0.2)
+
+    asyncio.run(run())
+
+    first.block(60)
+    assert second.exhausted
+
+
+def test_shared_limiter_waits_for_the_database_off_the_event_loop(tmp_path):
+    db_path = str(tmp_path / "rate_limits.sqlite3")
+    limiter = SharedModelRateLimiter("modelo", RateLimit(rpm=60, tpm=10_000), db_path)
+    other_process = sqlite3.connect(db_path, isolation_level=None)
+    other_process.execute("BEGIN IMMEDIATE")
+    ticks = []
+
+    async def ticker():
+        for _ in range(5):
+            ticks.append(time.monotonic())
+            await asyncio.sleep(0.02)
+
+    async def run():
+        acquire = asyncio.create_task(limiter.acquire(1))
+        await ticker()
+        other_process.execute("COMMIT")
+        await acquire
+
+    asyncio.run(run())
+    assert ticks[-1] - ticks[0] < 0.5
+
+
+def test_rate_limits_are_opt_in(monkeypatch):
+    monkeypatch.delenv("GEMINI_RATE_LIMITS", raising=False)
+    assert load_rate_limits() == {}
+
+    monkeypatch.setenv("GEMINI_RATE_LIMITS", "free")
+    assert load_rate_limits()["gemini-2.5-flash"] == RateLimit(rpm=10, tpm=250_000)
+
+    monkeypatch.setenv("GEMINI_RATE_LIMITS", '{"gemini-2.5-flash": {"rpm": 1000, "tpm": 1000000}}')
+    assert load_rate_limits() == {"gemini-2.5-flash": RateLimit(rpm=1000, tpm=1_000_000)}
@@ -0,0 +1,82 @@
+import json
+
+from google.adk.models import LlmRequest
+from google.genai import types
+
+from src.agents.state_projection import ATTACHMENT_PLACEHOLDER, keep_user_text_only, project_state_value
+
+NOTA_FISCAL = {
+    "destinatario_nome": "Fulano",
+    "valor_total": "30,00",
+    "produtos": [
+        {"codigo": "A", "descricao": "Item A", "preco_total": "10,00"},
+        {"codigo": "B", "descricao": "Item B", "preco_total": "20,00"},
+    ],
+}
+
+
+def test_projects_top_level_and_list_item_fields():
+    projected = project_state_value(NOTA_FISCAL, ["valor_total", "produtos.codigo", "produtos.preco_total"])
+
+    assert projected == {
+        "valor_total": "30,00",
+        "produtos": [{"codigo": "A", "preco_total": "10,00"}, {"codigo": "B", "preco_total": "20,00"}],
+    }
+
+
+def test_keeps_whole_value_without_fields():
+    assert project_state_value(NOTA_FISCAL) == NOTA_FISCAL
+    assert project_state_value(NOTA_FISCAL, []) == NOTA_FISCAL
+
+
+def test_skips_missing_fields():
+    assert project_state_value(NOTA_FISCAL, ["valor_ICMS", "produtos.quantidade"]) == {"produtos": [{}, {}]}
+
+
+def test_parses_json_strings():
+    assert project_state_value(json.dumps(NOTA_FISCAL), ["destinatario_nome"]) == {"destinatario_nome": "Fulano"}
+
+
+def test_returns_plain_text_unchanged():
+    assert project_state_value("texto livre", ["campo"]) == "texto livre"
+
+
+def _request(*contents):
+    return LlmRequest(contents=list(contents))
+
+
+def _blob(data: bytes = b"%PDF-1.7") -> types.Part:
+    return types.Part(inline_data=types.Blob(mime_type="application/pdf", data=data))
+
+
+def test_keep_user_text_only_strips_files_and_keeps_history():
+    request = _request(
+        types.Content(role="user", parts=[types.Part(text="Calcule o ICMS"), _blob()]),
+        types.Content(role="model", parts=[types.Part(text="ICMS de 18%")]),
+        types.Content(role="user", parts=[types.Part(text="E o produto A?"), types.Part(file_data=types.FileData(file_uri="gs://b/nota.pdf"))]),
+    )
+
+    keep_user_text_only(None, request)
+
+    assert [(content.role, [part.text for part in content.parts]) for content in request.contents] == [
+        ("user", ["Calcule o ICMS"]),
+        ("model", ["ICMS de 18%"]),
+        ("user", ["E o produto A?"]),
+    ]
+
+
+def test_keep_user_text_only_replaces_file_only_messages():
+    request = _request(types.Content(role="user", parts=[_blob()]))
+
+    keep_user_text_only(None, request)
+
+    assert [part.text for part in request.contents[-1].parts] == [ATTACHMENT_PLACEHOLDER]
+
+
+def test_keep_user_text_only_never_sends_empty_contents():
+    request = _request()
+
+    keep_user_text_only(None, request)
+
+    assert request.contents[0].role == "user"
+    assert request.contents[0].parts[0].text == ATTACHMENT_PLACEHOLDER
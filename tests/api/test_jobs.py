@@ -0,0 +1,31 @@
+from src.api.jobs import request_fingerprint
+
+
+def test_fingerprint_is_stable():
+    arguments = ("nfe", "Calcule o ICMS", "gemini-2.5-flash", [b"pdf"], {"a": 1})
+
+    assert request_fingerprint(*arguments) == request_fingerprint(*arguments)
+    assert len(request_fingerprint(*arguments)) == 64
+
+
+def test_fingerprint_ignores_state_key_order():
+    assert request_fingerprint("nfe", "m", None, [], {"a": 1, "b": 2}) == request_fingerprint("nfe", "m", None, [], {"b": 2, "a": 1})
+
+
+def test_fingerprint_treats_missing_model_and_state_as_empty():
+    assert request_fingerprint("nfe", "m", None, [], None) == request_fingerprint("nfe", "m", "", [], {})
+
+
+def test_fingerprint_changes_with_any_field():
+    base = request_fingerprint("nfe", "m", "gemini-2.5-flash", [b"a", b"b"], {"a": 1})
+
+    assert base != request_fingerprint("outro", "m", "gemini-2.5-flash", [b"a", b"b"], {"a": 1})
+    assert base != request_fingerprint("nfe", "m2", "gemini-2.5-flash", [b"a", b"b"], {"a": 1})
+    assert base != request_fingerprint("nfe", "m", "gemini-2.0-flash", [b"a", b"b"], {"a": 1})
+    assert base != request_fingerprint("nfe", "m", "gemini-2.5-flash", [b"b", b"a"], {"a": 1})
+    assert base != request_fingerprint("nfe", "m", "gemini-2.5-flash", [b"a", b"b"], {"a": 2})
+
+
+def test_fingerprint_separates_fields():
+    assert request_fingerprint("ab", "c", None, [], None) != request_fingerprint("a", "bc", None, [], None)
+    assert request_fingerprint("nfe", "m", None, [b"ab"], None) != request_fingerprint("nfe", "m", None, [b"a", b"b"], None)